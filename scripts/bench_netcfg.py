@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Offline benchmark of the rpi_ble.netcfg GATT callbacks — no Pi, no phone.
+
+Runs the real netcfg.main() against the stand-ins in scripts/benchfakes
+(GLib main loop, bluezero peripheral, no system bus) with fake nmcli,
+ping, curl, ip, getent and vcgencmd on PATH (fixture output, configurable
+latency), a fake /proc + /sys tree and a local HTTP server for the public
+IP lookup. Every operation goes through ByteCharacteristic.ReadValue /
+WriteValue on the main-loop thread, as BlueZ would call it.
+
+Per scenario it reports callback latency percentiles (time spent on the
+main loop), end-to-end time for asynchronous operations (scan, apply,
+RPC: until the result is in state / notified) and processes spawned per
+operation; --json writes the same as a machine-readable result and
+--compare prints the change against an earlier one:
+
+    python3 scripts/bench_netcfg.py --json before.json
+    ...change something...
+    python3 scripts/bench_netcfg.py --compare before.json
+
+With --serve ADDR it runs no scenarios: the same offline netcfg is served
+over the loopback transport (rpi_ble.loopback) on a Unix socket path or
+host:port until interrupted, for scripts/loadgen_netcfg.py.
+
+Latencies of the fake tools: --delay nmcli=0.05 --delay curl=0.2 (seconds).
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "benchfakes"), os.path.join(HERE, "..", "srv")]
+
+DEFAULT_DELAYS = {"nmcli": 0.03, "ping": 0.01, "curl": 0.05, "ip": 0.0, "getent": 0.005,
+                  "vcgencmd": 0.0, "http": 0.05}
+CENTRAL = "AA:BB:CC:DD:EE:01"
+DEVICE_PATH = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_01"
+
+
+# ---------- fixtures ----------
+
+def scan_lines(n: int) -> str:
+    secus = ["WPA2", "WPA2", "WPA1 WPA2", "WPA2 WPA3", "", "WPA2 802.1X"]
+    return "".join(f"Office-{i // 3}:{95 - i % 45}:{secus[i % len(secus)]}\n" for i in range(n))
+
+
+def nmcli_cases(aps: int) -> List[tuple]:
+    """(shell case pattern on "$*", stdout) in match order."""
+    return [
+        ("*GENERAL.DEVICE,GENERAL.TYPE,GENERAL.CONNECTION,IP4.ADDRESS,IP4.GATEWAY,IP4.DNS*",
+         "GENERAL.DEVICE:eth0\nGENERAL.TYPE:ethernet\nGENERAL.CONNECTION:Wired connection 1\n"
+         "IP4.ADDRESS[1]:192.0.2.10/24\nIP4.GATEWAY:192.0.2.1\nIP4.DNS[1]:192.0.2.1\nIP4.DNS[2]:1.1.1.1\n\n"
+         "GENERAL.DEVICE:wlan0\nGENERAL.TYPE:wifi\nGENERAL.CONNECTION:Office-0\n"
+         "IP4.ADDRESS[1]:198.51.100.20/24\nIP4.GATEWAY:198.51.100.1\nIP4.DNS[1]:198.51.100.1\n\n"
+         "GENERAL.DEVICE:lo\nGENERAL.TYPE:loopback\nGENERAL.CONNECTION:lo\nIP4.ADDRESS[1]:127.0.0.1/8\n"),
+        ("*connection.id,ipv4.method*",
+         "connection.id:Wired connection 1\nipv4.method:manual\n\nconnection.id:Office-0\nipv4.method:auto\n"),
+        ("*wifi list*", scan_lines(aps)),
+        ("*DEVICE,TYPE,STATE*", "eth0:ethernet:connected\nwlan0:wifi:connected\nlo:loopback:unmanaged\n"),
+        ("*GENERAL.CONNECTION*wlan0*", "GENERAL.CONNECTION:Office-0\n"),
+        ("*GENERAL.CONNECTION*eth0*", "GENERAL.CONNECTION:Wired connection 1\n"),
+        ("*IP4.ADDRESS*wlan0*", "IP4.ADDRESS[1]:198.51.100.20/24\n"),
+        ("*-g IP4.ADDRESS*", "192.0.2.10/24\n"),
+        ("*-g IP4.GATEWAY*", "192.0.2.1\n"),
+        ("*-g IP4.DNS*", "192.0.2.1\n1.1.1.1\n"),
+        ("*-g ipv4.method*", "manual\n"),
+        ("*wifi connect*", "Device 'wlan0' successfully activated.\n"),
+        ("*con up*", "Connection successfully activated.\n"),
+    ]
+
+
+TOOL_CASES = {
+    "ping": [("*", "64 bytes from 1.1.1.1: icmp_seq=1 ttl=57 time=12.3 ms\n")],
+    "curl": [("*", "204 0.045")],
+    "ip": [("*route show default*", "default via 192.0.2.1 dev eth0 proto dhcp metric 100\n"),
+           ("*route get*", "1.1.1.1 via 192.0.2.1 dev eth0 src 192.0.2.10 uid 0\n    cache\n")],
+    "getent": [("*", "93.184.215.14   example.com\n")],
+    "vcgencmd": [("*", "temp=48.3'C\n")],
+}
+
+
+def write_tool(bindir: str, tool: str, cases: List[tuple], delay: float) -> None:
+    fixdir = os.path.join(bindir, "fixtures")
+    lines = ["#!/bin/sh", f"sleep {delay:g}" if delay > 0 else ":", 'case "$*" in']
+    for i, (pattern, out) in enumerate(cases):
+        path = os.path.join(fixdir, f"{tool}.{i}")
+        with open(path, "w") as f:
+            f.write(out)
+        # only the "*" stay unquoted: the literal parts contain spaces
+        glob = "*".join(shlex.quote(part) if part else "" for part in pattern.split("*"))
+        lines.append(f"  {glob}) cat {shlex.quote(path)};;")
+    lines += ["esac", "exit 0", ""]
+    exe = os.path.join(bindir, tool)
+    with open(exe, "w") as f:
+        f.write("\n".join(lines))
+    os.chmod(exe, 0o755)
+
+
+def make_bin(root: str, aps: int, delays: Dict[str, float]) -> str:
+    bindir = os.path.join(root, "bin")
+    os.makedirs(os.path.join(bindir, "fixtures"))
+    write_tool(bindir, "nmcli", nmcli_cases(aps), delays["nmcli"])
+    for tool, cases in TOOL_CASES.items():
+        write_tool(bindir, tool, cases, delays.get(tool, 0.0))
+    sudo = os.path.join(bindir, "sudo")  # when not run as root: cmdexec's helper / sudo -n
+    with open(sudo, "w") as f:
+        # like sudo's env_reset: PYTHONPATH does not get through
+        f.write('#!/bin/sh\n[ "$1" = "-n" ] && shift\nexec env -u PYTHONPATH "$@"\n')
+    os.chmod(sudo, 0o755)
+    return bindir
+
+
+def make_proc(root: str) -> Dict[str, str]:
+    files = {
+        "proc/loadavg": "0.52 0.40 0.31 1/213 4242\n",
+        "proc/uptime": "274320.51 1090000.00\n",
+        "proc/meminfo": "MemTotal:        3884096 kB\nMemFree:         1200000 kB\nMemAvailable:    2431200 kB\n",
+        "proc/device-tree/model": "Raspberry Pi 4 Model B Rev 1.4\x00",
+        "sys/class/thermal/thermal_zone0/temp": "48312\n",
+        "etc/os-release": 'PRETTY_NAME="Debian GNU/Linux 12 (bookworm)"\nID=debian\n',
+    }
+    for rel, text in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+    return {"proc": os.path.join(root, "proc"), "sys": os.path.join(root, "sys"),
+            "os_release": os.path.join(root, "etc/os-release")}
+
+
+def serve_public_ip(delay: float) -> http.server.ThreadingHTTPServer:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            time.sleep(delay)
+            body = b"203.0.113.7\n"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args):
+            pass
+
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+# ---------- harness ----------
+
+def pct(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    s = sorted(samples)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 3)
+
+
+class Bench:
+    def __init__(self, netcfg: Any, GLib: Any, cmdexec: Any):
+        self.netcfg = netcfg
+        self.GLib = GLib
+        self.cmdexec = cmdexec
+        app = netcfg.peripheral.Peripheral.last
+        self.app = app
+        self.chars = {c.name: c for c in app.characteristics}
+
+    def on_loop(self, fn: Callable[[], Any]) -> float:
+        """Run fn on the main loop; return its duration, ms."""
+        done = threading.Event()
+        box: Dict[str, Any] = {}
+
+        def job() -> bool:
+            t0 = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                box["error"] = e
+            box["ms"] = (time.perf_counter() - t0) * 1000.0
+            done.set()
+            return False
+        self.GLib.idle_add(job)
+        if not done.wait(60):
+            raise RuntimeError("main loop did not run the callback within 60 s")
+        if "error" in box:
+            raise box["error"]
+        return box["ms"]
+
+    def settled(self) -> bool:
+        """No worker job in flight and no main-loop source due: background work has landed.
+
+        Checked twice on the loop, a moment apart: a job is done() just before its
+        completion callback is queued on the loop.
+        """
+        worker = self.netcfg.worker
+        ctx = self.GLib.main_context_default()
+        box = {"quiet": 0}
+
+        def check() -> None:
+            with worker._lock:
+                busy = any(not f.done() for f in worker._inflight.values())
+            box["quiet"] += not busy and not ctx.pending()
+        self.on_loop(check)
+        time.sleep(0.002)
+        self.on_loop(check)
+        return box["quiet"] == 2
+
+    def spawns(self) -> int:
+        return sum(int(st["spawns"]) for st in self.cmdexec.stats().values())
+
+    @staticmethod
+    def wait_for(pred: Callable[[], bool], timeout: float = 60.0) -> bool:
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if pred():
+                return True
+            time.sleep(0.001)
+        return False
+
+    def read(self, name: str, mtu: int = 247) -> Callable[[], None]:
+        chrc = self.chars[name]
+        return lambda: chrc.ReadValue({"mtu": mtu, "device": DEVICE_PATH})
+
+    def write(self, name: str, value: bytes) -> Callable[[], None]:
+        chrc = self.chars[name]
+        return lambda: chrc.WriteValue(value, {"mtu": 247, "device": DEVICE_PATH})
+
+    def run(self, label: str, fn: Callable[[], None], n: int,
+            start: Optional[Callable[[], Any]] = None,
+            done: Optional[Callable[[Any], bool]] = None,
+            ok: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """n times: fn on the loop; with `done`, also wait until done(start()) holds (end to end).
+
+        `ok` checks the outcome once done; operations it rejects are counted as failed.
+        """
+        cb: List[float] = []
+        e2e: List[float] = []
+        timeouts = 0
+        failed = 0
+        spawns0 = self.spawns()
+        for _ in range(n):
+            token = start() if start else None
+            t0 = time.perf_counter()
+            cb.append(self.on_loop(fn))
+            if done is not None:
+                if self.wait_for(lambda: done(token)):
+                    e2e.append((time.perf_counter() - t0) * 1000.0)
+                    failed += ok is not None and not ok()
+                else:
+                    timeouts += 1
+        res: Dict[str, Any] = {"n": n, "p50": pct(cb, 0.5), "p90": pct(cb, 0.9), "p99": pct(cb, 0.99),
+                               "max": round(max(cb), 3), "mean": round(sum(cb) / len(cb), 3),
+                               "spawns_per_op": round((self.spawns() - spawns0) / n, 2)}
+        if done is not None:
+            res.update(e2e_p50=pct(e2e, 0.5), e2e_p99=pct(e2e, 0.99), timeouts=timeouts, failed=failed)
+        return res
+
+
+def capture(chrc: Any) -> List[Any]:
+    """Complete messages notified on chrc: unframed JSON chunks, joined until they parse."""
+    msgs: List[Any] = []
+    buf = [b""]
+    orig = chrc.Set
+
+    def Set(iface: str, prop: str, value: Any) -> None:  # noqa: N802
+        orig(iface, prop, value)
+        if prop == "Value" and chrc.props[iface]["Notifying"]:
+            buf[0] += bytes(value)
+            try:
+                msgs.append(json.loads(buf[0]))
+            except ValueError:
+                return
+            buf[0] = b""
+    chrc.Set = Set
+    return msgs
+
+
+def check_fixtures(nc: Any, aps: Optional[int]) -> List[str]:
+    """What the service made of the fixtures; a harness that measures failing tools is useless."""
+    st = nc._state
+    problems = []
+    if st["wifi"].get("ssid") != "Office-0" or not st["wifi"].get("connected"):
+        problems.append(f"wifi snapshot {st['wifi']}")
+    eth = [i for i in st["lan"].get("ifaces", []) if i.get("device") == "eth0"]
+    if not eth or eth[0].get("ip") != "192.0.2.10" or eth[0].get("method") != "static":
+        problems.append(f"lan snapshot {st['lan']}")
+    if st["devinfo"]["info"].get("public_ip") != "203.0.113.7":
+        problems.append(f"devinfo {st['devinfo']['info']}")
+    if aps is not None and len(st["last_scan"].get("aps", [])) != aps:
+        problems.append(f"scan returned {len(st['last_scan'].get('aps', []))} APs, fixture has {aps}")
+    if aps is not None and not nc._versions["last_scan"]:
+        problems.append("scan result stored without a version bump")
+    return problems
+
+
+def scenarios(b: Bench, reads: int, writes: int, aps: int) -> Dict[str, Dict[str, Any]]:
+    nc = b.netcfg
+    out: Dict[str, Dict[str, Any]] = {}
+    for name in ("devinfo", "scan_result", "wifi_cfg", "lan_cfg", "status", "versions", "metrics"):
+        if name in b.chars:
+            out[f"read:{name}"] = b.run(f"read:{name}", b.read(name), reads)
+    # cold: stale snapshots, as after a quiet period. The callback only starts the refresh;
+    # e2e waits until it has landed, so its tool spawns are counted for the operation
+    def stale() -> None:
+        nc._snapshot_ts.update(wifi=0, lan=0)
+        nc._state["devinfo"]["ts"] = 0
+    for name in ("devinfo", "wifi_cfg", "lan_cfg"):
+        out[f"read:{name}:cold"] = b.run(f"read:{name}:cold",
+                                          lambda name=name: (stale(), b.read(name)()), writes,
+                                          done=lambda _t: b.settled())
+
+    out["write:scan_ctrl"] = b.run(
+        "write:scan_ctrl", b.write("scan_ctrl", b"start"), writes,
+        start=lambda: nc._state.get("last_scan"),
+        done=lambda prev: nc._state.get("last_scan") is not prev,
+        ok=lambda: len(nc._state["last_scan"]["aps"]) == aps)
+    out["write:wifi_cfg"] = b.run(
+        "write:wifi_cfg", b.write("wifi_cfg", json.dumps({"ssid": "Office-1", "psk": "bench-pass"}).encode()),
+        writes, done=lambda _t: nc._state["status"].get("stage") == "wifi_connect_done",
+        ok=lambda: nc._state["status"].get("ok") is True)
+    out["write:lan_cfg"] = b.run(
+        "write:lan_cfg", b.write("lan_cfg", json.dumps({"method": "dhcp", "device": "eth0"}).encode()),
+        writes, done=lambda _t: nc._state["status"].get("stage") == "lan_config_done",
+        ok=lambda: nc._state["status"].get("ok") is True)
+    if "rpc" in b.chars:
+        answers = capture(b.chars["rpc"])
+        batch = json.dumps([{"id": 1, "method": "devinfo"}, {"id": 2, "method": "wifi.get"},
+                            {"id": 3, "method": "lan.get"}]).encode()
+        out["write:rpc_batch"] = b.run(
+            "write:rpc_batch", b.write("rpc", batch), reads,
+            start=lambda: len(answers), done=lambda prev: len(answers) > prev,
+            ok=lambda: (isinstance(answers[-1], list) and len(answers[-1]) == 3
+                        and all(a.get("result") for a in answers[-1])))
+    return out
+
+
+def print_table(res: Dict[str, Dict[str, Any]], base: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    print(f"{'scenario':24s} {'n':>5s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s} "
+          f"{'e2e p50':>9s} {'e2e p99':>9s} {'spawn/op':>8s}" + ("  p50 vs base" if base else ""))
+
+    def f(v: Any) -> str:
+        return "-" if v is None else f"{v:.3f}" if isinstance(v, float) else str(v)
+    for name, r in res.items():
+        row = (f"{name:24s} {r['n']:5d} {f(r['p50']):>8s} {f(r['p90']):>8s} {f(r['p99']):>8s} {f(r['max']):>8s} "
+               f"{f(r.get('e2e_p50')):>9s} {f(r.get('e2e_p99')):>9s} {r['spawns_per_op']:8.2f}")
+        old = (base or {}).get(name)
+        if old and old.get("p50") and r.get("p50") is not None:
+            row += f"  x{r['p50'] / old['p50']:.2f}"
+            if old.get("e2e_p50") and r.get("e2e_p50"):
+                row += f" (e2e x{r['e2e_p50'] / old['e2e_p50']:.2f})"
+        print(row)
+
+
+def git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "-C", HERE, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--reads", type=int, default=200, help="iterations per read scenario")
+    ap.add_argument("--writes", type=int, default=10, help="iterations per write / cold scenario")
+    ap.add_argument("--aps", type=int, default=40, help="access points in the fake scan")
+    ap.add_argument("--delay", action="append", default=[], metavar="TOOL=SECS",
+                    help=f"latency of a fake tool or 'http' (defaults: {DEFAULT_DELAYS})")
+    ap.add_argument("--no-subscribe", action="store_true", help="no central subscribed to notifications")
+    ap.add_argument("--json", help="write the result to this file")
+    ap.add_argument("--compare", help="earlier --json result to compare against")
+    ap.add_argument("--serve", metavar="ADDR", help="serve over the loopback transport instead of benchmarking")
+    args = ap.parse_args()
+
+    delays = dict(DEFAULT_DELAYS)
+    for spec in args.delay:
+        tool, _, secs = spec.partition("=")
+        delays[tool] = float(secs)
+
+    root = tempfile.mkdtemp(prefix="bench-netcfg-")
+    http_srv = None
+    try:
+        bindir = make_bin(root, args.aps, delays)
+        paths = make_proc(root)
+        http_srv = serve_public_ip(delays["http"])
+        os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+        os.environ["RPI_BLE_NET_BACKEND"] = "nmcli"
+        os.environ["RPI_BLE_METRICS_SOCK"] = ""
+        if args.serve:
+            os.environ["RPI_BLE_LOOPBACK"] = args.serve
+
+        from gi.repository import GLib
+        from rpi_ble import cmdexec, sysinfo
+        sysinfo.PROC_ROOT, sysinfo.SYS_ROOT, sysinfo.OS_RELEASE = paths["proc"], paths["sys"], paths["os_release"]
+        from rpi_ble import netcfg
+        netcfg.PUBLIC_IP_URLS[:] = [f"http://127.0.0.1:{http_srv.server_address[1]}/ip"]
+        if args.serve:
+            netcfg.main()
+            return
+
+        server = threading.Thread(target=netcfg.main, name="netcfg-main", daemon=True)
+        server.start()
+        if not Bench.wait_for(lambda: netcfg.peripheral.Peripheral.last is not None
+                              and len(netcfg.peripheral.Peripheral.last.characteristics) >= 9, 30):
+            raise SystemExit("netcfg.main() did not register its characteristics")
+        b = Bench(netcfg, GLib, cmdexec)
+        b.on_loop(lambda: b.app.on_connect(b.app.adapter_address, CENTRAL))
+        if not args.no_subscribe:
+            for c in b.app.characteristics:
+                if "notify" in c.props["org.bluez.GattCharacteristic1"]["Flags"]:
+                    b.on_loop(c.StartNotify)
+        time.sleep(0.5)  # let the start-up refreshes settle
+
+        t0 = time.perf_counter()
+        problems = check_fixtures(netcfg, None)
+        res = scenarios(b, args.reads, args.writes, args.aps) if not problems else {}
+        wall = time.perf_counter() - t0
+        problems += check_fixtures(netcfg, args.aps) if res else []
+        problems += [f"{name}: {r['failed']} failed, {r['timeouts']} timed out"
+                     for name, r in res.items() if r.get("failed") or r.get("timeouts")]
+        b.app.stop()
+        server.join(10)
+        if problems:
+            # numbers measured against failing fixtures would be meaningless
+            raise SystemExit("fixture check failed:\n  " + "\n  ".join(problems))
+
+        base = None
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                base = json.load(f).get("scenarios")
+        print_table(res, base)
+        tools = {t: {k: (round(v, 1) if isinstance(v, float) else v) for k, v in st.items()}
+                 for t, st in cmdexec.stats().items()}
+        print(f"\ntools: {json.dumps(tools)}\nwall {wall:.1f} s")
+        if args.json:
+            doc = {"meta": {"rev": git_rev(), "python": platform.python_version(), "ts": int(time.time()),
+                            "reads": args.reads, "writes": args.writes, "aps": args.aps, "delays": delays,
+                            "subscribed": not args.no_subscribe, "wall_s": round(wall, 2)},
+                   "scenarios": res, "tools": tools}
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=1)
+    finally:
+        if http_srv is not None:
+            http_srv.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmark: Device Info metrics via shell commands vs rpi_ble.sysinfo.
+
+The "shell" path replays the commands read_device_info used to spawn
+(optionally through sudo, as the daemon does); the "native" path calls the
+in-process readers.
+
+    python3 scripts/bench_sysinfo.py -n 50 [--sudo]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srv"))
+
+from rpi_ble import sysinfo  # noqa: E402
+
+SHELL_CMDS = [
+    "hostname -s",
+    "cat /proc/loadavg",
+    "vcgencmd measure_temp 2>/dev/null",
+    "cat /sys/class/thermal/thermal_zone0/temp 2>/dev/null",
+    "free -b",
+    "df -P / | tail -1 | awk '{print $5}'",
+    "uptime -p",
+    "cut -d' ' -f1 /proc/uptime",
+    "awk -F= '$1==\"PRETTY_NAME\"{gsub(/\"/,\"\");print $2}' /etc/os-release",
+    "uname -m",
+    "uname -r",
+    "cat /proc/device-tree/model 2>/dev/null | tr -d '\\0'",
+]
+
+
+def shell_path(prefix: str) -> None:
+    for cmd in SHELL_CMDS:
+        subprocess.run(prefix + cmd, shell=True, text=True, capture_output=True, check=False)
+
+
+def native_path() -> None:
+    sysinfo.read_hostname()
+    sysinfo.read_loadavg1()
+    sysinfo.read_temp_c()
+    sysinfo.read_mem_used_pct()
+    sysinfo.read_disk_used_pct("/")
+    secs = sysinfo.read_uptime_secs()
+    if secs is not None:
+        sysinfo.format_uptime(secs)
+    sysinfo.read_pretty_name()
+    sysinfo.read_arch()
+    sysinfo.read_kernel()
+    sysinfo.read_rpi_model()
+
+
+def bench(fn, n: int) -> list:
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+
+def report(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:8s} n={len(samples):<4d} mean={statistics.mean(samples):9.3f} ms  "
+          f"p50={statistics.median(samples):9.3f} ms  p95={p95:9.3f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", type=int, default=20, help="iterations per path")
+    ap.add_argument("--sudo", action="store_true", help="prefix shell commands with sudo like netcfg.run()")
+    args = ap.parse_args()
+
+    prefix = "sudo " if args.sudo else ""
+    shell = bench(lambda: shell_path(prefix), args.n)
+    native = bench(native_path, args.n)
+    report("shell", shell)
+    report("native", native)
+    print(f"speedup  x{statistics.mean(shell) / max(statistics.mean(native), 1e-9):.0f}")
+
+
+if __name__ == "__main__":
+    main()
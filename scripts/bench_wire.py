@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wire size and airtime: JSON vs CBOR vs packed scan for typical payloads.
+
+Encodes a 40-AP scan result, a Device Info snapshot and a LAN config with
+every rpi_ble.wire encoding, with and without deflate ("+z", preset
+dictionary), splits them into framed notifications for a few ATT MTUs and
+estimates the LE 1M PHY airtime (see airtime_us()).
+
+    python3 scripts/bench_wire.py [--mtu 23 185 247] [--dle]
+"""
+
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srv"))
+
+from rpi_ble import framing, wire  # noqa: E402
+
+# On-air bytes of one LL data packet around its payload: preamble, access address, header, CRC
+LL_OVERHEAD = 1 + 4 + 2 + 3
+L2CAP_HDR = 4
+T_IFS_US = 150
+EMPTY_PDU_US = LL_OVERHEAD * 8  # the central's empty ack
+
+
+def scan_payload(n: int = 40) -> dict:
+    # a few SSIDs seen on several APs (mesh / 2.4+5 GHz), as in an office
+    secus = ["WPA2", "WPA2", "WPA1 WPA2", "WPA2 WPA3", "?", "WPA2 802.1X"]
+    aps = []
+    for i in range(n):
+        ssid = f"Office-{i // 3}" if i % 4 else f"HomeNet_{i:02d}_5G"
+        aps.append({"ssid": ssid, "sign": 95 - i, "secu": secus[i % len(secus)]})
+    return {"ts": 1790000000.123456, "aps": aps}
+
+
+def devinfo_payload() -> dict:
+    return {
+        "hostname": "raspberrypi",
+        "cpu_load": 0.52,
+        "cpu_temp_c": 48.3,
+        "mem_used_pct": 37.4,
+        "disk_used_pct": 21.0,
+        "uptime": "3 days, 4 hours, 12 minutes",
+        "uptime_s": 274320,
+        "os": "Debian GNU/Linux 12 (bookworm)",
+        "host": "Raspberry Pi 4 Model B Rev 1.4",
+        "kernel": "6.6.31+rpt-rpi-v8",
+        "online": True,
+        "public_ip": "203.0.113.17",
+    }
+
+
+def lan_payload() -> dict:
+    # an office /23 over DHCP and a static Wi-Fi address: not the addresses wire.ZDICT was built from
+    return {"ifaces": [
+        {"method": "dhcp", "ip": "172.20.14.87", "mask": "255.255.254.0",
+         "gw": "172.20.14.1", "dns": ["172.20.0.53", "172.20.0.54"], "device": "eth0"},
+        {"method": "static", "ip": "192.168.88.10", "mask": "255.255.255.0",
+         "gw": "192.168.88.1", "dns": ["192.168.88.1"], "device": "wlan0"},
+    ]}
+
+
+def airtime_us(frames: list, dle: bool) -> float:
+    """Rough LE 1M PHY airtime: every ATT notification (+L2CAP header) is cut into
+    LL packets of 27 bytes (251 with Data Length Extension), each acked by an
+    empty PDU. Connection-event scheduling is not modelled."""
+    ll_max = 251 if dle else 27
+    total = 0.0
+    for f in frames:
+        pdu = len(f) + framing.ATT_NOTIFY_OVERHEAD + L2CAP_HDR
+        for k in range(math.ceil(pdu / ll_max)):
+            size = min(ll_max, pdu - k * ll_max)
+            total += (LL_OVERHEAD + size) * 8 + T_IFS_US + EMPTY_PDU_US + T_IFS_US
+    return total
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--mtu", type=int, nargs="+", default=[23, 185, 247], help="ATT MTUs to compare")
+    ap.add_argument("--dle", action="store_true", help="assume LE Data Length Extension (251-byte LL payload)")
+    args = ap.parse_args()
+
+    payloads = [("scan40", scan_payload()), ("scan10", scan_payload(10)),
+                ("devinfo", devinfo_payload()), ("lan", lan_payload())]
+    cols = "".join(f"  {'pkts@' + str(m):>9s} {'ms':>5s}" for m in args.mtu)
+    print(f"{'payload':8s} {'enc':9s} {'bytes':>6s}  {'ratio':>5s}{cols}")
+    for label, obj in payloads:
+        base = len(wire.encode(obj, "json"))
+        for enc in wire.ENCODINGS:
+            for z in (False, True):
+                data = wire.encode(obj, enc)
+                if z:
+                    data = wire.deflate(data)
+                name = enc + ("+z" if z else "")
+                row = f"{label:8s} {name:9s} {len(data):6d}  {len(data) / base:5.2f}"
+                for m in args.mtu:
+                    frames = framing.frames(data, m, compressed=z)
+                    row += f"  {len(frames):9d} {airtime_us(frames, args.dle) / 1000.0:5.1f}"
+                print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""Stand-ins for gi, dbus and bluezero used by scripts/bench_netcfg.py.
+
+Put this directory first on sys.path and rpi_ble.netcfg imports and runs
+without BlueZ, a system bus or a Bluetooth adapter: GLib is a small
+single-thread main loop, the system bus is absent (netcfg falls back to
+the nmcli backend) and a characteristic's Set() records notifications
+instead of emitting PropertiesChanged.
+"""
@@ -0,0 +1,8 @@
+class Adapter:
+    def __init__(self, adapter_addr=None):
+        self.address = adapter_addr or '00:00:5E:00:53:00'
+        self.path = '/org/bluez/hci0'
+
+    @classmethod
+    def available(cls):
+        yield cls()
@@ -0,0 +1,3 @@
+GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
+GATT_SERVICE_IFACE = 'org.bluez.GattService1'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
@@ -0,0 +1,2 @@
+def dbus_to_python(data):
+    return data
@@ -0,0 +1,31 @@
+"""bluezero.localGATT stand-in: Set() records notifications instead of emitting a signal."""
+from bluezero import constants
+
+
+class Characteristic:
+    def __init__(self, service_id, characteristic_id, uuid, value, notifying, flags,
+                 read_callback=None, write_callback=None, notify_callback=None):
+        self.read_callback = read_callback
+        self.write_callback = write_callback
+        self.notify_callback = notify_callback
+        self.path = f'/ukBaz/bluezero/service{service_id:04d}/char{characteristic_id:04d}'
+        self.props = {constants.GATT_CHRC_IFACE: {
+            'UUID': uuid, 'Value': value, 'Notifying': notifying, 'Flags': flags}}
+        self.notified = 0        # Set('Value') calls while notifying
+        self.notified_bytes = 0
+
+    def Set(self, interface_name, property_name, value):
+        self.props[interface_name][property_name] = value
+        if property_name == 'Value' and self.props[interface_name]['Notifying']:
+            self.notified += 1
+            self.notified_bytes += len(value)
+
+    def StartNotify(self):
+        self.props[constants.GATT_CHRC_IFACE]['Notifying'] = True
+        if self.notify_callback:
+            self.notify_callback(True, self)
+
+    def StopNotify(self):
+        self.props[constants.GATT_CHRC_IFACE]['Notifying'] = False
+        if self.notify_callback:
+            self.notify_callback(False, self)
@@ -0,0 +1,34 @@
+"""bluezero.peripheral stand-in: publish() runs the (stand-in) GLib main loop until stop()."""
+from gi.repository import GLib
+
+from bluezero import localGATT
+
+
+class Peripheral:
+    last = None  # the most recent instance, for the benchmark to find
+
+    def __init__(self, adapter_address, local_name=None, appearance=None):
+        self.adapter_address = adapter_address
+        self.local_name = local_name
+        self.services = []
+        self.characteristics = []
+        self.on_connect = None
+        self.on_disconnect = None
+        self._loop = None
+        Peripheral.last = self
+
+    def add_service(self, srv_id, uuid, primary):
+        self.services.append((srv_id, uuid, primary))
+
+    def add_characteristic(self, srv_id, chr_id, uuid, value, notifying, flags,
+                           read_callback=None, write_callback=None, notify_callback=None):
+        self.characteristics.append(localGATT.Characteristic(
+            srv_id, chr_id, uuid, value, notifying, flags, read_callback, write_callback, notify_callback))
+
+    def publish(self):
+        self._loop = GLib.MainLoop()
+        self._loop.run()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.quit()
@@ -0,0 +1,37 @@
+"""dbus-python stand-in: value types only, no system bus."""
+from . import exceptions, service  # noqa: F401
+
+PROPERTIES_IFACE = 'org.freedesktop.DBus.Properties'
+
+
+class Array(list):
+    def __init__(self, value=(), signature=None, variant_level=0):
+        super().__init__(value)
+
+
+class ByteArray(bytes):
+    pass
+
+
+class Dictionary(dict):
+    def __init__(self, value=(), signature=None, variant_level=0):
+        super().__init__(value)
+
+
+String = str
+ObjectPath = str
+Boolean = bool
+Double = float
+Byte = Int16 = Int32 = Int64 = UInt16 = UInt32 = UInt64 = int
+
+
+def SystemBus():
+    raise exceptions.DBusException('no system bus (benchmark stand-in)',
+                                   name='org.freedesktop.DBus.Error.NoServer')
+
+
+Bus = SystemBus
+
+
+def Interface(obj, dbus_interface=None):
+    raise exceptions.DBusException('no system bus (benchmark stand-in)')
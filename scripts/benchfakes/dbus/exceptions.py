@@ -0,0 +1,7 @@
+class DBusException(Exception):
+    def __init__(self, *args, name=None, **_kw):
+        super().__init__(*args)
+        self._dbus_error_name = name
+
+    def get_dbus_name(self):
+        return self._dbus_error_name
@@ -0,0 +1 @@
+from . import glib  # noqa: F401
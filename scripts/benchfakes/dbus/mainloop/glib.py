@@ -0,0 +1,6 @@
+def DBusGMainLoop(set_as_default=False):
+    return None
+
+
+def threads_init():
+    return None
@@ -0,0 +1,11 @@
+def method(*_args, **_kw):
+    return lambda fn: fn
+
+
+def signal(*_args, **_kw):
+    return lambda fn: fn
+
+
+class Object:
+    def __init__(self, *_args, **_kw):
+        pass
@@ -0,0 +1,126 @@
+"""Minimal GLib main loop: idle and timeout sources dispatched on the thread running MainLoop.run()."""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from collections import deque
+
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = 300
+
+_cond = threading.Condition()
+_idle: deque = deque()
+_timers: list = []
+_removed: set = set()
+_ids = itertools.count(1)
+
+
+def idle_add(fn, *args, **_kw) -> int:
+    sid = next(_ids)
+    with _cond:
+        _idle.append((sid, fn, args))
+        _cond.notify()
+    return sid
+
+
+def timeout_add(ms, fn, *args, **_kw) -> int:
+    sid = next(_ids)
+    with _cond:
+        heapq.heappush(_timers, (time.monotonic() + ms / 1000.0, sid, ms, fn, args))
+        _cond.notify()
+    return sid
+
+
+def timeout_add_seconds(secs, fn, *args, **_kw) -> int:
+    return timeout_add(secs * 1000, fn, *args)
+
+
+def source_remove(sid) -> bool:
+    with _cond:
+        _removed.add(sid)
+    return True
+
+
+def _next_ready():
+    """(sid, fn, args, interval_ms or None) of a source due now, or None."""
+    while _idle:
+        sid, fn, args = _idle.popleft()
+        if sid not in _removed:
+            return sid, fn, args, None
+    now = time.monotonic()
+    while _timers and _timers[0][0] <= now:
+        _, sid, ms, fn, args = heapq.heappop(_timers)
+        if sid not in _removed:
+            return sid, fn, args, ms
+    return None
+
+
+def _dispatch(item) -> None:
+    sid, fn, args, ms = item
+    try:
+        again = fn(*args)
+    except Exception:
+        traceback.print_exc()
+        again = False
+    with _cond:
+        if again and sid not in _removed:
+            if ms is None:
+                _idle.append((sid, fn, args))
+            else:
+                heapq.heappush(_timers, (time.monotonic() + ms / 1000.0, sid, ms, fn, args))
+        else:
+            _removed.discard(sid)
+
+
+class MainContext:
+    def pending(self) -> bool:
+        with _cond:
+            return bool(_idle) or bool(_timers and _timers[0][0] <= time.monotonic())
+
+    def iteration(self, may_block: bool = False) -> bool:
+        with _cond:
+            item = _next_ready()
+        if item is None:
+            return False
+        _dispatch(item)
+        return True
+
+
+_context = MainContext()
+
+
+def main_context_default() -> MainContext:
+    return _context
+
+
+class MainLoop:
+    _running = None
+
+    def __init__(self) -> None:
+        self._quit = False
+
+    def run(self) -> None:
+        MainLoop._running = self
+        while not self._quit:
+            with _cond:
+                item = _next_ready()
+                if item is None:
+                    wait = _timers[0][0] - time.monotonic() if _timers else 0.5
+                    _cond.wait(max(0.0, min(wait, 0.5)))
+                    continue
+            _dispatch(item)
+
+    def quit(self) -> None:
+        self._quit = True
+        with _cond:
+            _cond.notify()
+
+
+IO_IN = 1
+IO_ERR = 8
+IO_HUP = 16
+
+
+def io_add_watch(*_args, **_kw) -> int:
+    return next(_ids)
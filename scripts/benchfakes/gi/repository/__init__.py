@@ -0,0 +1 @@
+from . import GLib  # noqa: F401
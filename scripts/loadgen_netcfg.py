@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load generator: N virtual centrals against netcfg over the loopback transport.
+
+Every central is one connection to rpi_ble.loopback (its own address, MTU,
+subscriptions) and runs a random mix of operations until the time is up:
+
+    read  - read one of the state characteristics (long reads with offsets)
+    rpc   - one RPC call, until its answer arrives as a notification
+    scan  - write "start" to Scan Control, until a scan result is notified
+
+Per operation it reports throughput and latency percentiles of the
+successful ones; answers that came back empty or as an error ("failed")
+and operations that raised or timed out ("err") are counted separately,
+as are notifications received, messages that could not be reassembled
+and lost connections. Without --connect it starts the offline service itself
+(scripts/bench_netcfg.py --serve: fake nmcli & co, no adapter needed):
+
+    python3 scripts/loadgen_netcfg.py -n 20 --duration 10
+    RPI_BLE_LOOPBACK=127.0.0.1:8765 python3 -m rpi_ble.netcfg &   # on a Pi, real tools
+    python3 scripts/loadgen_netcfg.py --connect 127.0.0.1:8765 -n 5 --mix read=90,rpc=10
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "srv"))
+
+from rpi_ble import loopback  # noqa: E402
+
+READ_CHARS = ("devinfo", "scan_result", "wifi_cfg", "lan_cfg", "status", "versions")
+RPC_METHODS = ("devinfo", "status", "versions", "wifi.get", "lan.get", "scan.get")
+# subscribed unless --no-subscribe (rpc / scan_result always when the mix needs them)
+NOTIFY_CHARS = ("devinfo", "scan_result", "wifi_cfg", "lan_cfg", "status", "versions", "rpc")
+MAX_MESSAGE = 256 * 1024
+OP_TIMEOUT = 60.0
+
+
+def valid(name: str, msg: Any) -> bool:
+    """A value of characteristic / RPC method `name` that carries data, not an empty or failed answer."""
+    if not isinstance(msg, dict):
+        return False
+    if name in ("scan_result", "scan.get"):
+        return bool(msg.get("aps"))
+    if name in ("wifi_cfg", "wifi.get"):
+        return bool(msg.get("ssid"))
+    if name in ("lan_cfg", "lan.get"):
+        return bool(msg.get("ifaces"))
+    if name == "devinfo":
+        return bool(msg.get("hostname"))
+    if name == "status":
+        return "stage" in msg
+    if name == "versions":
+        return "boot" in msg
+    return bool(msg)
+
+
+class Assembler:
+    """Unframed JSON notifications: chunks are appended until the buffer parses."""
+
+    def __init__(self) -> None:
+        self.buf = b""
+        self.garbled = 0
+
+    def feed(self, chunk: bytes) -> Optional[Any]:
+        self.buf = chunk if not self.buf and chunk[:1] in (b"{", b"[") else self.buf + chunk
+        if self.buf[:1] not in (b"{", b"["):
+            self.buf = b""
+            self.garbled += 1
+            return None
+        try:
+            msg = json.loads(self.buf)
+        except ValueError:
+            if len(self.buf) > MAX_MESSAGE:
+                self.buf = b""
+                self.garbled += 1
+            return None
+        self.buf = b""
+        return msg
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = {}
+        self.failed: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.notifications = 0
+        self.notify_bytes = 0
+        self.garbled = 0
+        self.lost = 0
+
+    def ok(self, op: str, ms: float) -> None:
+        with self.lock:
+            self.lat.setdefault(op, []).append(ms)
+
+    def fail(self, op: str) -> None:
+        with self.lock:
+            self.failed[op] = self.failed.get(op, 0) + 1
+
+    def error(self, op: str) -> None:
+        with self.lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+
+class VirtualCentral:
+    def __init__(self, idx: int, address: str, args: argparse.Namespace, stats: Stats):
+        self.idx = idx
+        self.args = args
+        self.stats = stats
+        self.central = loopback.Central(address, mtu=args.mtu, timeout=OP_TIMEOUT)
+        self.cond = threading.Condition()
+        self.answers: Dict[str, Any] = {}  # rpc id -> the answer
+        self.scans = 0  # complete scan results received
+        self.last_scan: Any = None
+        self.seq = 0
+        self.asm: Dict[str, Assembler] = {}
+
+    def subscribe(self, names: List[str]) -> None:
+        for name in names:
+            asm = self.asm[name] = Assembler()
+            self.central.subscribe(name, lambda chunk, name=name, asm=asm: self._on_notify(name, asm, chunk))
+
+    def _on_notify(self, name: str, asm: Assembler, chunk: bytes) -> None:
+        with self.stats.lock:
+            self.stats.notifications += 1
+            self.stats.notify_bytes += len(chunk)
+        msg = asm.feed(chunk)
+        if msg is None:
+            return
+        with self.cond:
+            if name == "rpc":
+                for ans in msg if isinstance(msg, list) else [msg]:
+                    if isinstance(ans, dict) and str(ans.get("id", "")).startswith(f"{self.idx}-"):
+                        self.answers[ans["id"]] = ans
+            elif name == "scan_result" and isinstance(msg, dict) and "aps" in msg:
+                self.scans += 1
+                self.last_scan = msg
+            else:
+                return
+            self.cond.notify_all()
+
+    # every op returns whether the answer carried data
+
+    def op_read(self) -> bool:
+        name = random.choice(READ_CHARS)
+        return valid(name, json.loads(self.central.read(name)))
+
+    def op_rpc(self) -> bool:
+        self.seq += 1
+        rid = f"{self.idx}-{self.seq}"
+        method = random.choice(RPC_METHODS)
+        self.central.write("rpc", json.dumps({"id": rid, "method": method}).encode())
+        with self.cond:
+            if not self.cond.wait_for(lambda: rid in self.answers, OP_TIMEOUT):
+                raise TimeoutError(f"no answer to {rid}")
+            ans = self.answers.pop(rid)
+        return "error" not in ans and valid(method, ans.get("result"))
+
+    def op_scan(self) -> bool:
+        with self.cond:
+            seen = self.scans
+        self.central.write("scan_ctrl", b"start")
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.scans > seen, OP_TIMEOUT):
+                raise TimeoutError("no scan result")
+            return valid("scan_result", self.last_scan)
+
+    def run(self, mix: Dict[str, int], deadline: float) -> None:
+        ops = list(mix)
+        weights = [mix[o] for o in ops]
+        while time.monotonic() < deadline and not self.central.closed.is_set():
+            op = random.choices(ops, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                good = getattr(self, f"op_{op}")()
+            except Exception:
+                if self.central.closed.is_set():
+                    break
+                self.stats.error(op)
+                continue
+            if good:
+                self.stats.ok(op, (time.perf_counter() - t0) * 1000.0)
+            else:
+                self.stats.fail(op)
+        if self.central.closed.is_set() and time.monotonic() < deadline:
+            with self.stats.lock:
+                self.stats.lost += 1
+        with self.stats.lock:
+            self.stats.garbled += sum(a.garbled for a in self.asm.values())
+        self.central.close()
+
+
+def pct(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    s = sorted(samples)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 3)
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    mix: Dict[str, int] = {}
+    for part in spec.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in ("read", "rpc", "scan"):
+            raise SystemExit(f"unknown operation in --mix: {op!r}")
+        mix[op] = int(weight or 1)
+    return {op: w for op, w in mix.items() if w > 0}
+
+
+def start_offline(address: str, delays: List[str], log: Any) -> subprocess.Popen:
+    argv = [sys.executable, os.path.join(HERE, "bench_netcfg.py"), "--serve", address]
+    for d in delays:
+        argv += ["--delay", d]
+    proc = subprocess.Popen(argv, stdout=log, stderr=subprocess.STDOUT)
+    end = time.monotonic() + 30
+    while time.monotonic() < end:
+        if proc.poll() is not None:
+            raise SystemExit(f"offline service exited with {proc.returncode}")
+        try:
+            loopback.Central(address, timeout=2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("offline service did not start listening within 30 s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", "--centrals", type=int, default=10, help="concurrent virtual centrals")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    ap.add_argument("--mix", default="read=80,rpc=15,scan=5", help="operation weights")
+    ap.add_argument("--mtu", type=int, default=247, help="ATT MTU every central announces (0: none)")
+    ap.add_argument("--no-subscribe", action="store_true",
+                    help="subscribe only where the mix needs it (rpc, scan_result)")
+    ap.add_argument("--connect", metavar="ADDR", help="running service: Unix socket path or host:port")
+    ap.add_argument("--delay", action="append", default=[], metavar="TOOL=SECS",
+                    help="offline service: latency of a fake tool (see bench_netcfg.py)")
+    ap.add_argument("--server-log", help="offline service: write its output here")
+    ap.add_argument("--json", help="write the result to this file")
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    proc = None
+    tmp = None
+    address = args.connect
+    if address is None:
+        tmp = tempfile.mkdtemp(prefix="loadgen-netcfg-")
+        address = os.path.join(tmp, "netcfg.sock")
+        log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+        proc = start_offline(address, args.delay, log)
+    try:
+        stats = Stats()
+        subs = [] if args.no_subscribe else list(NOTIFY_CHARS)
+        subs += [n for op, n in (("rpc", "rpc"), ("scan", "scan_result")) if op in mix and n not in subs]
+        centrals = []
+        for i in range(args.centrals):
+            vc = VirtualCentral(i, address, args, stats)
+            vc.subscribe(subs)
+            centrals.append(vc)
+        if centrals and "scan_result" in subs:
+            # a scan result to read: an empty one before the first scan would count as failed
+            try:
+                centrals[0].op_scan()
+            except Exception as e:
+                print(f"warm-up scan failed: {e}")
+        t0 = time.monotonic()
+        deadline = t0 + args.duration
+        threads = [threading.Thread(target=vc.run, args=(mix, deadline), daemon=True) for vc in centrals]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(args.duration + OP_TIMEOUT + 5)
+        wall = time.monotonic() - t0
+
+        server: Dict[str, Any] = {}
+        try:
+            probe = loopback.Central(address)
+            snap = json.loads(probe.read("metrics"))
+            probe.close()
+            server = {k: snap.get(k) for k in ("notify", "subscriptions", "value_cache", "rpc", "spawns")}
+        except (OSError, ValueError, KeyError, loopback.LoopbackError):
+            pass
+
+        res: Dict[str, Any] = {}
+        total = 0
+        print(f"{args.centrals} centrals, {wall:.1f} s, mix {args.mix}, mtu {args.mtu}")
+        print(f"{'op':8s} {'ok':>7s} {'failed':>7s} {'err':>5s} {'ops/s':>8s} "
+              f"{'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>9s}  ms")
+        for op in mix:
+            lat = stats.lat.get(op, [])
+            total += len(lat)
+            r = {"n": len(lat), "failed": stats.failed.get(op, 0), "errors": stats.errors.get(op, 0),
+                 "ops_s": round(len(lat) / wall, 1),
+                 "p50": pct(lat, 0.5), "p90": pct(lat, 0.9), "p99": pct(lat, 0.99),
+                 "max": round(max(lat), 3) if lat else None}
+            res[op] = r
+            cells = ["-" if r[k] is None else f"{r[k]:.2f}" for k in ("p50", "p90", "p99", "max")]
+            print(f"{op:8s} {r['n']:7d} {r['failed']:7d} {r['errors']:5d} {r['ops_s']:8.1f} "
+                  f"{cells[0]:>8s} {cells[1]:>8s} {cells[2]:>8s} {cells[3]:>9s}")
+        print(f"total {total / wall:.1f} successful ops/s; notifications {stats.notifications} "
+              f"({stats.notify_bytes} bytes), garbled {stats.garbled}, lost connections {stats.lost}")
+        if server:
+            print(f"service: {json.dumps(server)}")
+        if args.json:
+            doc = {"meta": {"centrals": args.centrals, "duration_s": args.duration, "wall_s": round(wall, 2),
+                            "mix": mix, "mtu": args.mtu, "subscribed": subs, "offline": proc is not None,
+                            "delays": args.delay, "ts": int(time.time())},
+                   "ops": res, "notifications": stats.notifications, "notify_bytes": stats.notify_bytes,
+                   "garbled": stats.garbled, "lost": stats.lost, "service": server}
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=1)
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if tmp is not None:
+            try:
+                os.unlink(os.path.join(tmp, "netcfg.sock"))
+            except OSError:
+                pass
+            os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    main()
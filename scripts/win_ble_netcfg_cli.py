@@ -3,14 +3,26 @@
 
 import asyncio
 import argparse
+import csv
 import json
-from typing import Any, Dict, Optional
+import os
+import shlex
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
 
 from bleak import BleakScanner, BleakClient
 
+try:
+    import cbor2  # нужен только для --enc cbor/packed
+except ImportError:
+    cbor2 = None
+
 # ====== UUIDs (должны совпадать с сервером на Raspberry Pi) ======
 SVC_UUID = 'd84a0001-4f6f-4e10-8b27-2d9f2d6e0001'
-def UUID(n): return f'd84a000{n}-4f6f-4e10-8b27-2d9f2d6e000{n}'
+def UUID(n): return f'd84a00{n:02x}-4f6f-4e10-8b27-2d9f2d6e00{n:02x}'
 
 
 CHR_DEVINFO = UUID(2)   # read/notify
@@ -20,6 +32,9 @@ CHR_WIFI_CFG = UUID(5)   # read/write
 CHR_LAN_CFG = UUID(6)   # read/write
 CHR_ACTION = UUID(7)   # write
 CHR_STATUS = UUID(8)   # read/notify
+CHR_VERSIONS = UUID(9)   # read/notify: {"boot", "<значение>": версия}
+CHR_RPC = UUID(10)   # write/notify: {"id", "method", "params"} -> {"id", "result"|"error"}
+CHR_METRICS = UUID(11)   # read: счётчики и задержки колбэков, notify, внешних команд
 
 
 def jb(obj: Any) -> bytes:
@@ -29,52 +44,256 @@ def jb(obj: Any) -> bytes:
 def pj(data: bytes) -> Any:
     return json.loads(data.decode("utf-8"))
 
+# ---------- Компактные кодировки и сжатие (см. srv/rpi_ble/wire.py) ----------
+
+
+ENCODINGS = ("json", "cbor", "packed")
+PACKED_SCAN = 0x53
+SECURITY_BITS = ("WEP", "WPA1", "WPA2", "WPA3", "OWE", "802.1X")
+
+
+# Словарь deflate — байт в байт как wire.ZDICT на сервере
+ZDICT = (
+    b'{"ifaces": [{"method": "static", "ip": "192.168.", "mask": "255.255.255.0", "gw": "192.168.'
+    b'1.1", "dns": ["1.1.1.1", "8.8.8.8"], "device": "eth0"}, {"method": "dhcp", "ip": "10.0.0.'
+    b'", "device": "wlan0"}]}'
+    b'\xa1fifaces\x81\xa6fmethodfstaticbipdmaskm255.255.255.0bgwcdns\x82fdevicedeth0ddhcpewlan0'
+    b'caps\xa3dssiddsigndsecua?dWPA2iWPA2 WPA3iWPA1 WPA2k WPA2 802.1X'
+    b'{"ts": 17, "aps": [{"ssid": "", "sign": 5, "secu": "WPA1 WPA2"}, {"ssid": "'
+    b'", "sign": 6, "secu": "WPA2 802.1X"}, {"ssid": "", "sign": 7, "secu": "?"}, {"ssid": "'
+    b'", "sign": 8, "secu": "WPA2 WPA3"}, {"ssid": "", "sign": 7, "secu": "WPA2"}, {"ssid": "'
+)
+
+
+def inflate(data: bytes) -> bytes:
+    d = zlib.decompressobj(-15, zdict=ZDICT)
+    return d.decompress(data) + d.flush()
+
+
+def unpack_scan(data: bytes) -> Dict[str, Any]:
+    """Packed-скан: словарь SSID + по 3 байта на точку доступа."""
+    _, ts = struct.unpack_from("<BI", data)
+    i = 5
+    ssids = []
+    for _ in range(data[i]):
+        ln = data[i + 1]
+        ssids.append(data[i + 2:i + 2 + ln].decode("utf-8"))
+        i += 1 + ln
+    i += 1
+    aps = []
+    for _ in range(data[i]):
+        idx, sign, bits = struct.unpack_from("<BBB", data, i + 1)
+        i += 3
+        secu = " ".join(t for k, t in enumerate(SECURITY_BITS) if bits & (1 << k))
+        aps.append({"ssid": ssids[idx], "sign": sign, "secu": secu or "?"})
+    return {"ts": ts, "aps": aps}
+
+
+def dv(data: bytes) -> Any:
+    """Декодировать значение характеристики: JSON, CBOR или packed-скан (по первому байту)."""
+    data = bytes(data)
+    if data and data[0] == PACKED_SCAN:
+        return unpack_scan(data)
+    if not data or data[:1] in (b"{", b"[", b'"'):
+        return pj(data)
+    if cbor2 is None:
+        raise RuntimeError("Получен CBOR, но модуль cbor2 не установлен (pip install cbor2)")
+    return cbor2.loads(data)
+
+# ---------- Кадры notify (формат см. srv/rpi_ble/framing.py) ----------
+
+
+FLAG_START = 0x01
+FLAG_END = 0x02
+FLAG_COMPRESSED = 0x04  # сообщение сжато deflate со словарём ZDICT
+_HDR = struct.Struct("<BB")          # flags, seq
+_START_HDR = struct.Struct("<BBI")   # flags, seq, общая длина
+
+
+class FrameReader:
+    """Собирает сообщение из кадров: буфер выделяется на START, готово на END."""
+
+    def __init__(self) -> None:
+        self._buf: Optional[bytearray] = None
+        self._total = 0
+        self._seq = 0
+        self._compressed = False
+        self.dropped = 0
+
+    def feed(self, frame: bytes) -> Optional[bytes]:
+        if len(frame) < _HDR.size:
+            return None
+        flags, seq = _HDR.unpack_from(frame)
+        if flags & FLAG_START:
+            if len(frame) < _START_HDR.size:
+                return None
+            if self._buf is not None:
+                self.dropped += 1
+            _, _, self._total = _START_HDR.unpack_from(frame)
+            self._buf = bytearray(frame[_START_HDR.size:])
+            self._seq = 0
+            self._compressed = bool(flags & FLAG_COMPRESSED)
+        elif self._buf is None:
+            return None  # подписались посреди сообщения — ждём START
+        elif seq != (self._seq + 1) & 0xFF:
+            self._buf = None  # пропущен кадр — сообщение потеряно
+            self.dropped += 1
+            return None
+        else:
+            self._buf += frame[_HDR.size:]
+            self._seq = seq
+        if not flags & FLAG_END:
+            return None
+        buf, self._buf = self._buf, None
+        if len(buf) != self._total:
+            self.dropped += 1
+            return None
+        return inflate(bytes(buf)) if self._compressed else bytes(buf)
+
+
+def json_notify_cb(on_msg: Callable[[Any], None], framed: bool):
+    """Notify-callback: собирает JSON-сообщения (кадры или сырые чанки) и отдаёт их в on_msg."""
+    if framed:
+        reader = FrameReader()
+
+        def cb(_h, data: bytearray):
+            msg = reader.feed(bytes(data))
+            if msg is not None:
+                on_msg(dv(msg))
+        return cb
+
+    buf = bytearray()
+
+    def raw_cb(_h, data: bytearray):
+        nonlocal buf
+        buf += bytes(data)
+        try:
+            msg = json.loads(buf.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return  # ждём следующий чанк
+        buf = bytearray()
+        on_msg(msg)
+    return raw_cb
+
+
+async def start_session(client: BleakClient, framed: bool, enc: str = "json", compress: bool = False) -> None:
+    """Включить кадры (кодировку, сжатие) на сервере и сообщить ему ATT MTU соединения."""
+    if framed:
+        opts: Dict[str, Any] = {"cmd": "opts", "framed": True, "mtu": client.mtu_size}
+        if enc != "json":
+            opts["enc"] = enc
+        if compress:
+            opts["compress"] = "zlib"
+        await client.write_gatt_char(CHR_SCAN_CTRL, jb(opts), response=True)
+
 # ---------- Поиск устройства ----------
 
 
+def matches(name_hint: str, device, adv) -> bool:
+    """Наше устройство: имя начинается с подсказки (rpi-netcfg-<hostname>); без имени — по SVC_UUID."""
+    hint = (name_hint or "").strip().lower()
+    name = ((adv.local_name if adv is not None else None) or device.name or "").strip().lower()
+    if name:
+        return name.startswith(hint)
+    uuids = {str(u).lower() for u in (getattr(adv, "service_uuids", None) or [])}
+    return SVC_UUID.lower() in uuids
+
+
 async def find_device(name_hint: str = "rpi-netcfg", timeout: float = 6.0):
-    """Ищем устройство по имени (предпочтительно) или по сервису, если платформа отдаёт UUID'ы."""
-    devices = await BleakScanner.discover(timeout=timeout)
-    name_hint_l = (name_hint or "").strip().lower()
-
-    for d in devices:
-        # матч по имени
-        if (d.name or "").strip().lower() == name_hint_l:
-            return d
-
-    # если не нашли по имени — пробуем по сервису, если содержит uuids
-    for d in devices:
-        uuids = set()
-        m = getattr(d, "metadata", None)
-        if isinstance(m, dict):
-            try:
-                uuids = {str(u).lower() for u in (m.get("uuids") or [])}
-            except Exception:
-                uuids = set()
-        if SVC_UUID.lower() in uuids:
-            return d
+    """Ищем устройство по имени или по сервису; возвращаем первое подходящее, не дожидаясь конца скана."""
+    return await BleakScanner.find_device_by_filter(
+        lambda d, adv: matches(name_hint, d, adv), timeout=timeout)
 
-    return None
 
+# ---------- Кэш адресов ----------
+# Последний адрес по подсказке имени: следующий запуск пробует подключиться сразу, без скана
 
-async def connect(address: Optional[str], name: Optional[str] = None):
-    """Возвращает подключённый BleakClient. address > name > автопоиск."""
-    dev = None
+def cache_path() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "rpi-netcfg", "addresses.json")
+
+
+def cache_load() -> Dict[str, Any]:
+    try:
+        with open(cache_path(), encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def cache_store(name_hint: str, address: Optional[str]) -> None:
+    """address=None — забыть адрес."""
+    data = cache_load()
+    key = name_hint.strip().lower()
     if address:
-        dev = address  # Bleak принимает строковый адрес
-    elif name:
-        dev = await find_device(name_hint=name)
-    else:
-        dev = await find_device()
-
-    if not dev:
-        raise RuntimeError(
-            "BLE устройство не найдено. Включите Raspberry Pi и Bluetooth на ПК.")
-
-    client = BleakClient(dev)
-    await client.connect()
+        data[key] = {"address": address, "ts": int(time.time())}
+    elif data.pop(key, None) is None:
+        return
+    path = cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # кэш — только ускорение
+
+
+# Соединение сессии (shell/batch): connect() возвращает его же, release() не закрывает
+_session: Dict[str, Any] = {"keep": False, "client": None, "cache": True}
+# Подключение по адресу из кэша: если устройство не отвечает, быстрее пересканировать
+CACHED_CONNECT_TIMEOUT = 4.0
+# Время поиска и подключения последнего connect(), мс
+_timing: Dict[str, float] = {"scan_ms": 0.0, "connect_ms": 0.0}
+
+
+async def connect(address: Optional[str], name: Optional[str] = None):
+    """Возвращает подключённый BleakClient. address > адрес из кэша > поиск по имени/сервису."""
+    _timing.update(scan_ms=0.0, connect_ms=0.0)
+    client = _session["client"]
+    if client is not None and client.is_connected:
+        return client
+
+    hint = name or "rpi-netcfg"
+    client = None
+    if not address and _session.get("cache", True):
+        cached = (cache_load().get(hint.lower()) or {}).get("address")
+        if cached:
+            t0 = time.perf_counter()
+            try:
+                client = BleakClient(cached)
+                await client.connect(timeout=CACHED_CONNECT_TIMEOUT)
+            except Exception:
+                client = None
+                cache_store(hint, None)  # устарел: ищем заново
+            _timing["connect_ms"] = (time.perf_counter() - t0) * 1000.0
+
+    if client is None:
+        t0 = time.perf_counter()
+        dev = address or await find_device(name_hint=hint)  # Bleak принимает и строковый адрес
+        _timing["scan_ms"] = (time.perf_counter() - t0) * 1000.0
+        if not dev:
+            raise RuntimeError(
+                "BLE устройство не найдено. Включите Raspberry Pi и Bluetooth на ПК.")
+
+        t0 = time.perf_counter()
+        client = BleakClient(dev)
+        await client.connect()
+        _timing["connect_ms"] += (time.perf_counter() - t0) * 1000.0
+        if not address and _session.get("cache", True):
+            cache_store(hint, client.address)
+    if _session["keep"]:
+        _session["client"] = client
     return client
 
+
+async def release(client: BleakClient) -> None:
+    """Конец команды: отключиться, если это не соединение сессии."""
+    if client is not _session["client"]:
+        await client.disconnect()
+
 # ---------- Команды ----------
 
 
@@ -89,21 +308,84 @@ async def cmd_devinfo(address: Optional[str], name: Optional[str]) -> None:
     try:
         raw = await client.read_gatt_char(CHR_DEVINFO)
         print(f"Device Info: {raw}")
-        print(json.dumps(pj(raw), ensure_ascii=False, indent=2))
+        print(json.dumps(dv(raw), ensure_ascii=False, indent=2))
     finally:
-        await client.disconnect()
+        await release(client)
 
 
-async def cmd_status_watch(address: Optional[str], name: Optional[str]) -> None:
+async def cmd_versions(address: Optional[str], name: Optional[str]) -> None:
+    """Версии значений: если boot и версия не изменились, значение можно не перечитывать."""
     client = await connect(address, name)
+    try:
+        raw = await client.read_gatt_char(CHR_VERSIONS)
+        print(json.dumps(dv(raw), ensure_ascii=False, indent=2))
+    finally:
+        await release(client)
+
 
-    async def cb(_h, data: bytearray):
+async def cmd_metrics(address: Optional[str], name: Optional[str], raw_json: bool = False) -> None:
+    """Метрики сервера: число вызовов, p50/p95/p99/max (мс) и байты по каждому колбэку."""
+    client = await connect(address, name)
+    try:
+        data = dv(await client.read_gatt_char(CHR_METRICS))
+    finally:
+        await release(client)
+    if raw_json:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+        return
+    print(f"uptime {data.get('uptime_s')} с")
+    print(f"{'series':28s} {'n':>6s} {'p50':>7s} {'p95':>7s} {'p99':>7s} {'max':>8s} {'bytes':>8s} {'err':>4s}")
+    for key, st in (data.get("series") or {}).items():
+        q = ["-" if st.get(k) is None else f"{st[k]:g}" for k in ("p50", "p95", "p99", "max")]
+        print(f"{key:28s} {st.get('n', 0):6d} {q[0]:>7s} {q[1]:>7s} {q[2]:>7s} {q[3]:>8s} "
+              f"{st.get('bytes', 0):8d} {st.get('err', 0):4d}")
+    for key, val in data.items():
+        if key not in ("uptime_s", "series"):
+            print(f"{key}: {json.dumps(val, ensure_ascii=False)}")
+
+
+async def cmd_devinfo_watch(address: Optional[str], name: Optional[str],
+                            framed: bool = True, enc: str = "json", compress: bool = False) -> None:
+    """Подписка на Device Info: сервер шлёт полный снимок, затем только изменения."""
+    client = await connect(address, name)
+    info: Dict[str, Any] = {}
+
+    def on_msg(msg: Dict[str, Any]):
+        if msg.get("full"):
+            info.clear()
+            info.update(msg.get("info") or {})
+            print(f"[DEVINFO #{msg.get('seq')} full]",
+                  json.dumps(info, ensure_ascii=False))
+        else:
+            delta = msg.get("delta") or {}
+            info.update(delta)
+            print(f"[DEVINFO #{msg.get('seq')}]",
+                  json.dumps(delta, ensure_ascii=False))
+    try:
+        await start_session(client, framed, enc, compress)
+        await client.start_notify(CHR_DEVINFO, json_notify_cb(on_msg, framed))
+        print("Подписан на Device Info. Нажмите Ctrl+C для выхода.")
+        while True:
+            await asyncio.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
         try:
-            print("[STATUS]", json.dumps(pj(bytes(data)), ensure_ascii=False))
+            await client.stop_notify(CHR_DEVINFO)
         except Exception:
             pass
+        await release(client)
+
+
+async def cmd_status_watch(address: Optional[str], name: Optional[str],
+                           framed: bool = True, enc: str = "json", compress: bool = False) -> None:
+    client = await connect(address, name)
+
+    def on_msg(msg: Any):
+        print("[STATUS]", json.dumps(msg, ensure_ascii=False))
     try:
-        await client.start_notify(CHR_STATUS, cb)
+        await start_session(client, framed, enc, compress)
+        await client.start_notify(CHR_STATUS, json_notify_cb(on_msg, framed))
         print("Подписан на STATUS. Нажмите Ctrl+C для выхода.")
         while True:
             await asyncio.sleep(1)
@@ -114,33 +396,23 @@ async def cmd_status_watch(address: Optional[str], name: Optional[str]) -> None:
             await client.stop_notify(CHR_STATUS)
         except Exception:
             pass
-        await client.disconnect()
+        await release(client)
 
 
-async def cmd_scan(address: Optional[str], name: Optional[str], wait: float) -> None:
+async def cmd_scan(address: Optional[str], name: Optional[str], wait: float,
+                   framed: bool = True, enc: str = "json", compress: bool = False) -> None:
     client = await connect(address, name)
 
-    buf = bytearray()
     got_full = asyncio.Event()
 
-    def try_parse_full() -> bool:
-        # Пытаемся распарсить то, что накопилось
-        try:
-            obj = json.loads(buf.decode("utf-8"))
-            print(json.dumps(obj, ensure_ascii=False, indent=2))
-            got_full.set()
-            return True
-        except json.JSONDecodeError:
-            return False
-
-    def scan_cb(_h, data: bytearray):
-        nonlocal buf
-        buf += bytes(data)
-        try_parse_full()
+    def on_msg(obj: Any):
+        print(json.dumps(obj, ensure_ascii=False, indent=2))
+        got_full.set()
 
     try:
         # 1) подписка на результат
-        await client.start_notify(CHR_SCAN_RESULT, scan_cb)
+        await start_session(client, framed, enc, compress)
+        await client.start_notify(CHR_SCAN_RESULT, json_notify_cb(on_msg, framed))
         # 2) триггер скана
         await client.write_gatt_char(CHR_SCAN_CTRL, b"start", response=True)
 
@@ -148,7 +420,7 @@ async def cmd_scan(address: Optional[str], name: Optional[str], wait: float) ->
             # Быстрый путь: чуть подождать, затем просто READ (на сервере READ отдаёт полный JSON)
             await asyncio.sleep(0.8)
             raw = await client.read_gatt_char(CHR_SCAN_RESULT)
-            print(json.dumps(json.loads(raw.decode("utf-8")),
+            print(json.dumps(dv(raw),
                   ensure_ascii=False, indent=2))
         else:
             # Ждём валидный JSON из чанков; если не успели — fallback на READ
@@ -157,7 +429,7 @@ async def cmd_scan(address: Optional[str], name: Optional[str], wait: float) ->
             except asyncio.TimeoutError:
                 try:
                     raw = await client.read_gatt_char(CHR_SCAN_RESULT)
-                    print(json.dumps(json.loads(raw.decode("utf-8")),
+                    print(json.dumps(dv(raw),
                           ensure_ascii=False, indent=2))
                 except Exception:
                     print(
@@ -167,16 +439,52 @@ async def cmd_scan(address: Optional[str], name: Optional[str], wait: float) ->
             await client.stop_notify(CHR_SCAN_RESULT)
         except Exception:
             pass
-        await client.disconnect()
+        await release(client)
+
+
+async def cmd_scan_stream(address: Optional[str], name: Optional[str], wait: float,
+                          framed: bool = True, enc: str = "json", compress: bool = False) -> None:
+    """Потоковый скан: сервер шлёт {"ap": ...} по мере обнаружения, затем {"done": true}."""
+    client = await connect(address, name)
+
+    done = asyncio.Event()
+    aps = []
+
+    def on_msg(msg: Dict[str, Any]):
+        if "ap" in msg:
+            aps.append(msg["ap"])
+            ap = msg["ap"]
+            print(f"  {ap.get('sign', 0):3d}%  {ap.get('secu', ''):12s} {ap.get('ssid', '')}")
+        elif msg.get("done"):
+            if msg.get("ok", True):
+                print(f"Скан завершён: {len(aps)} из {msg.get('n')} сетей.")
+            else:
+                print(f"Скан завершился с ошибкой: {msg.get('err')}")
+            done.set()
+
+    try:
+        await start_session(client, framed, enc, compress)
+        await client.start_notify(CHR_SCAN_RESULT, json_notify_cb(on_msg, framed))
+        await client.write_gatt_char(CHR_SCAN_CTRL, jb({"cmd": "start", "stream": True}), response=True)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            print("Не дождались маркера завершения скана.")
+    finally:
+        try:
+            await client.stop_notify(CHR_SCAN_RESULT)
+        except Exception:
+            pass
+        await release(client)
 
 
 async def cmd_wifi_get(address: Optional[str], name: Optional[str]) -> None:
     client = await connect(address, name)
     try:
         raw = await client.read_gatt_char(CHR_WIFI_CFG)
-        print(json.dumps(pj(raw), ensure_ascii=False, indent=2))
+        print(json.dumps(dv(raw), ensure_ascii=False, indent=2))
     finally:
-        await client.disconnect()
+        await release(client)
 
 
 async def cmd_wifi_set(address: Optional[str], name: Optional[str], ssid: str, psk: Optional[str]) -> None:
@@ -188,16 +496,16 @@ async def cmd_wifi_set(address: Optional[str], name: Optional[str], ssid: str, p
         await client.write_gatt_char(CHR_WIFI_CFG, jb(cfg), response=True)
         print("Wi-Fi конфиг отправлен.")
     finally:
-        await client.disconnect()
+        await release(client)
 
 
 async def cmd_lan_get(address: Optional[str], name: Optional[str]) -> None:
     client = await connect(address, name)
     try:
         raw = await client.read_gatt_char(CHR_LAN_CFG)
-        print(json.dumps(pj(raw), ensure_ascii=False, indent=2))
+        print(json.dumps(dv(raw), ensure_ascii=False, indent=2))
     finally:
-        await client.disconnect()
+        await release(client)
 
 
 async def cmd_lan_set(address: Optional[str], name: Optional[str],
@@ -226,7 +534,7 @@ async def cmd_lan_set(address: Optional[str], name: Optional[str],
         await client.write_gatt_char(CHR_LAN_CFG, jb(cfg), response=True)
         print("LAN конфиг отправлен.")
     finally:
-        await client.disconnect()
+        await release(client)
 
 
 async def cmd_action(address: Optional[str], name: Optional[str], action_cmd: str) -> None:
@@ -237,28 +545,271 @@ async def cmd_action(address: Optional[str], name: Optional[str], action_cmd: st
         await client.write_gatt_char(CHR_ACTION, action_cmd.encode("utf-8"), response=True)
         print(f"Команда '{action_cmd}' отправлена.")
     finally:
-        await client.disconnect()
+        await release(client)
+
+
+def parse_rpc_call(spec: str) -> Dict[str, Any]:
+    """'wifi.get' или 'wifi.set={"ssid": "x"}' -> {"method", "params"}."""
+    method, sep, params = spec.partition("=")
+    call: Dict[str, Any] = {"method": method}
+    if sep:
+        call["params"] = json.loads(params)
+    return call
+
+
+async def rpc_exchange(client: BleakClient, reqs: List[Dict[str, Any]], timeout: float, framed: bool,
+                       on_resp: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[Any, Dict[str, Any]]:
+    """Отправить запросы одной записью и ждать ответы (не дольше timeout): {id: ответ}."""
+    pending = {r["id"] for r in reqs}
+    got: Dict[Any, Dict[str, Any]] = {}
+    done = asyncio.Event()
+
+    def on_msg(msg: Any):
+        for resp in (msg if isinstance(msg, list) else [msg]):
+            if not isinstance(resp, dict):
+                continue
+            got[resp.get("id")] = resp
+            pending.discard(resp.get("id"))
+            if on_resp is not None:
+                on_resp(resp)
+        if not pending:
+            done.set()
+
+    await client.start_notify(CHR_RPC, json_notify_cb(on_msg, framed))
+    try:
+        await client.write_gatt_char(CHR_RPC, jb(reqs if len(reqs) > 1 else reqs[0]), response=True)
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        try:
+            await client.stop_notify(CHR_RPC)
+        except Exception:
+            pass
+    return got
+
+
+async def cmd_rpc(address: Optional[str], name: Optional[str], calls: List[str], timeout: float,
+                  framed: bool = True, enc: str = "json", compress: bool = False) -> None:
+    """Несколько RPC-запросов одной записью (batch); ответы печатаются по мере прихода."""
+    reqs = []
+    for i, spec in enumerate(calls, 1):
+        try:
+            reqs.append(dict(parse_rpc_call(spec), id=i))
+        except json.JSONDecodeError as e:
+            raise SystemExit(f"{spec}: params не JSON ({e})")
+    client = await connect(address, name)
+    t0 = time.perf_counter()
+
+    def show(resp: Dict[str, Any]):
+        rid = resp.get("id")
+        ms = (time.perf_counter() - t0) * 1000.0
+        label = next((r["method"] for r in reqs if r["id"] == rid), "?")
+        if "error" in resp:
+            print(f"[{rid} {label} +{ms:.0f} ms] ERROR", json.dumps(resp["error"], ensure_ascii=False))
+        else:
+            print(f"[{rid} {label} +{ms:.0f} ms]", json.dumps(resp.get("result"), ensure_ascii=False, indent=2))
+    try:
+        await start_session(client, framed, enc, compress)
+        t0 = time.perf_counter()
+        got = await rpc_exchange(client, reqs, timeout, framed, show)
+        missing = [r["id"] for r in reqs if r["id"] not in got]
+        if missing:
+            print(f"Нет ответа за {timeout:.0f} с на id {missing}")
+    finally:
+        await release(client)
+
+# ---------- Fleet: много устройств за один запуск ----------
+
+# Поля манифеста (CSV-заголовок или ключи JSON-объектов)
+FLEET_FIELDS = ("name", "hostname", "addr", "ssid", "psk", "method", "ip", "mask", "gw", "dns", "device")
+RPC_BUSY = 1  # rpc.BUSY на сервере: другое применение ещё идёт
+FLEET_RETRY_BACKOFF = 2.0  # с, растёт с номером попытки
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """CSV с заголовком или JSON-список объектов; одна строка — одно устройство."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = json.load(f) if path.lower().endswith(".json") else list(csv.DictReader(f))
+    entries = []
+    for n, row in enumerate(rows, 1):
+        e = {k.strip(): (v.strip() if isinstance(v, str) else v)
+             for k, v in row.items() if k and v not in (None, "")}
+        unknown = sorted(set(e) - set(FLEET_FIELDS))
+        if unknown:
+            raise SystemExit(f"{path}: запись {n}: неизвестные поля {unknown}")
+        if not (e.get("name") or e.get("hostname") or e.get("addr")):
+            raise SystemExit(f"{path}: запись {n}: нужно name, hostname или addr")
+        if not (e.get("ssid") or e.get("method")):
+            raise SystemExit(f"{path}: запись {n}: нечего применять (нужен ssid и/или method)")
+        if e.get("method") == "static" and not all(e.get(k) for k in ("ip", "mask", "gw")):
+            raise SystemExit(f"{path}: запись {n}: для static нужны ip, mask, gw")
+        entries.append(e)
+    return entries
+
+
+def fleet_calls(e: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """RPC-вызовы для записи манифеста: wifi.set, затем lan.set (сервер применяет по одному)."""
+    calls = []
+    if e.get("ssid"):
+        wifi: Dict[str, Any] = {"ssid": e["ssid"]}
+        if e.get("psk"):
+            wifi["psk"] = e["psk"]
+        calls.append({"method": "wifi.set", "params": wifi})
+    if e.get("method"):
+        lan: Dict[str, Any] = {k: e[k] for k in ("method", "ip", "mask", "gw", "device") if e.get(k)}
+        dns = e.get("dns")
+        if dns:
+            lan["dns"] = dns if isinstance(dns, list) else [x.strip() for x in str(dns).split(",") if x.strip()]
+        calls.append({"method": "lan.set", "params": lan})
+    return calls
+
+
+async def fleet_discover(prefix: str, wanted: set, timeout: float) -> Dict[str, str]:
+    """Один скан на всех: {имя (lower): адрес} для имён prefix*; выходим, как только нашлись все wanted."""
+    found: Dict[str, str] = {}
+    all_found = asyncio.Event()
+
+    def on_adv(d, adv):
+        name = (adv.local_name or d.name or "").strip().lower()
+        if name.startswith(prefix.lower()):
+            found[name] = d.address
+            if wanted and wanted <= set(found):
+                all_found.set()
+
+    scanner = BleakScanner(detection_callback=on_adv)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(all_found.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
+    return found
+
+
+async def fleet_one(e: Dict[str, Any], label: str, target: Optional[str], sem: asyncio.Semaphore,
+                    retries: int, timeout: float, framed: bool, enc: str, compress: bool) -> Dict[str, Any]:
+    res: Dict[str, Any] = {"name": label, "address": target, "ok": False, "attempts": 0,
+                           "steps": {}, "error": None, "wait_ms": 0.0, "connect_ms": [], "total_ms": 0.0}
+    if target is None:
+        res["error"] = "not found"
+        return res
+    pending = fleet_calls(e)
+    t_queue = time.perf_counter()
+    async with sem:
+        t0 = time.perf_counter()
+        res["wait_ms"] = round((t0 - t_queue) * 1000.0)
+        for attempt in range(1, retries + 2):
+            res["attempts"] = attempt
+            client = BleakClient(target)
+            try:
+                tc = time.perf_counter()
+                await client.connect()
+                res["connect_ms"].append(round((time.perf_counter() - tc) * 1000.0))
+                await start_session(client, framed, enc, compress)
+                while pending:
+                    call = pending[0]
+                    resp = (await rpc_exchange(client, [dict(call, id=attempt)], timeout, framed)).get(attempt)
+                    if resp is None:
+                        raise TimeoutError(f"{call['method']}: нет ответа за {timeout:.0f} с")
+                    err = resp.get("error")
+                    if err and err.get("code") == RPC_BUSY:
+                        raise RuntimeError(f"{call['method']}: busy")
+                    # ошибка применения — результат, а не повод повторять
+                    res["steps"][call["method"]] = {"ok": err is None, "err": err and err.get("message")}
+                    pending.pop(0)
+                res["error"] = None
+                break
+            except Exception as ex:
+                res["error"] = f"{type(ex).__name__}: {ex}"
+                if attempt <= retries:
+                    await asyncio.sleep(FLEET_RETRY_BACKOFF * attempt)
+            finally:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+        res["total_ms"] = round((time.perf_counter() - t0) * 1000.0)
+    res["ok"] = res["error"] is None and all(s["ok"] for s in res["steps"].values())
+    return res
+
+
+async def cmd_fleet(manifest: str, prefix: str, concurrency: int, scan: float, retries: int,
+                    timeout: float, report: Optional[str],
+                    framed: bool = True, enc: str = "json", compress: bool = False) -> None:
+    """Один скан, затем конфиги из манифеста параллельно (не больше concurrency соединений)."""
+    entries = load_manifest(manifest)
+    labels = [e.get("name") or (f"{prefix}-{e['hostname']}" if e.get("hostname") else e["addr"])
+              for e in entries]
+    wanted = {lb.lower() for e, lb in zip(entries, labels) if not e.get("addr")}
+    t0 = time.perf_counter()
+    found = await fleet_discover(prefix, wanted, scan) if wanted else {}
+    scan_ms = (time.perf_counter() - t0) * 1000.0
+    print(f"Скан: найдено {len(found)} устройств {prefix}*, нужно {len(wanted)}, {scan_ms:.0f} мс")
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+    results = await asyncio.gather(*(
+        fleet_one(e, lb, e.get("addr") or found.get(lb.lower()), sem, retries, timeout, framed, enc, compress)
+        for e, lb in zip(entries, labels)))
+    wall = time.perf_counter() - t0
+
+    for r in results:
+        notes = [f"{m}=ok" if st["ok"] else f"{m}=FAIL ({st['err']})" for m, st in r["steps"].items()]
+        if r["error"]:
+            notes.append(r["error"])
+        print(f"{'OK  ' if r['ok'] else 'FAIL'} {r['name']:28s} {r['address'] or '-':17s} "
+              f"попыток {r['attempts']}  {r['total_ms'] / 1000.0:5.1f} с  {'; '.join(notes)}".rstrip())
+    n_ok = sum(r["ok"] for r in results)
+    print(f"Готово: {n_ok}/{len(results)} за {wall:.1f} с (параллельно до {concurrency})")
+
+    if report:
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump({"ts": int(time.time()), "manifest": manifest, "concurrency": concurrency,
+                       "scan_ms": round(scan_ms), "wall_s": round(wall, 2), "ok": n_ok,
+                       "devices": results}, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт: {report}")
+    if n_ok != len(results):
+        raise SystemExit(f"Не настроено устройств: {len(results) - n_ok}")
 
 # ---------- CLI ----------
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Windows BLE CLI для rpi-netcfg")
     ap.add_argument(
         "--addr", help="BLE-адрес (если не указан — поиск по имени/сервису)")
     ap.add_argument(
         "--name", help="Имя BLE-устройства для поиска (по умолчанию rpi-netcfg)")
+    ap.add_argument("--no-framed", dest="framed", action="store_false",
+                    help="Не включать кадры в notify (для старых версий сервера)")
+    ap.add_argument("--enc", choices=ENCODINGS, default="json",
+                    help="Кодировка значений: json (по умолчанию), cbor или packed (скан); нужен cbor2")
+    ap.add_argument("--compress", action="store_true",
+                    help="Сжимать длинные notify (deflate со словарём)")
+    ap.add_argument("--no-cache", dest="cache", action="store_false",
+                    help="Не использовать кэш адресов (всегда искать устройство сканом)")
+    ap.add_argument("--timing", action="store_true",
+                    help="Печатать время поиска, подключения и команды (в shell/batch — всегда)")
 
     sub = ap.add_subparsers(dest="cmd", required=True)
 
     sub.add_parser("list", help="Показать найденные BLE-устройства")
-    sub.add_parser("devinfo", help="Показать Device Info")
+    p_devinfo = sub.add_parser("devinfo", help="Показать Device Info")
+    p_devinfo.add_argument("--watch", action="store_true",
+                           help="Подписаться и печатать изменения (delta notify)")
     sub.add_parser("status", help="Подписка на статус")
+    sub.add_parser("versions", help="Версии значений (ETag) — что изменилось с прошлого чтения")
     sub.add_parser("lan-get", help="Прочитать текущий LAN конфиг")
+    p_metrics = sub.add_parser("metrics", help="Метрики сервера: задержки колбэков, notify, внешних команд")
+    p_metrics.add_argument("--json", dest="raw_json", action="store_true", help="Печатать как есть (JSON)")
 
     p_scan = sub.add_parser("scan", help="Скан Wi-Fi (с подпиской)")
-    p_scan.add_argument("--wait", type=float, default=2.0,
-                        help="Ждать уведомления N секунд (0 — только read)")
+    p_scan.add_argument("--wait", type=float, default=None,
+                        help="Ждать уведомления N секунд (0 — только read; по умолчанию 2 с, с --stream 20 с)")
+    p_scan.add_argument("--stream", action="store_true",
+                        help="Печатать сети по мере обнаружения (ждать до --wait)")
 
     sub.add_parser("wifi-get", help="Прочитать текущий Wi-Fi конфиг")
 
@@ -267,7 +818,14 @@ def main():
     p_wset.add_argument("--psk", default=None)
 
     p_act = sub.add_parser("action", help="Команда apply или reboot")
-    p_act.add_argument("cmd", choices=["apply", "reboot"])
+    p_act.add_argument("action_cmd", metavar="cmd", choices=["apply", "reboot"])
+
+    p_rpc = sub.add_parser("rpc", help="RPC-запросы одной записью: rpc devinfo wifi.get lan.get")
+    p_rpc.add_argument("calls", nargs="+", metavar="METHOD[=PARAMS_JSON]",
+                       help="devinfo, status, versions, wifi.get, lan.get, scan.get, scan.start, "
+                            "wifi.set, lan.set, action")
+    p_rpc.add_argument("--timeout", type=float, default=30.0,
+                       help="Ждать ответы не дольше N секунд")
 
     p_lanset = sub.add_parser("lan-set", help="Отправить LAN конфиг")
     p_lanset.add_argument(
@@ -277,28 +835,182 @@ def main():
     p_lanset.add_argument("--gw")
     p_lanset.add_argument("--dns", help="Список DNS через запятую")
 
-    args = ap.parse_args()
-
+    p_fleet = sub.add_parser("fleet", help="Настроить много устройств по манифесту (CSV/JSON) параллельно")
+    p_fleet.add_argument("manifest", help="CSV или .json: name|hostname|addr, ssid, psk, method, ip, mask, gw, dns, device")
+    p_fleet.add_argument("--concurrency", type=int, default=3, help="Одновременных соединений (по умолчанию 3)")
+    p_fleet.add_argument("--scan", type=float, default=15.0, help="Скан не дольше N секунд")
+    p_fleet.add_argument("--retries", type=int, default=2, help="Повторов на устройство при ошибке связи")
+    p_fleet.add_argument("--timeout", type=float, default=90.0, help="Ждать результат применения N секунд")
+    p_fleet.add_argument("--report", help="Записать отчёт (JSON) в файл")
+
+    sub.add_parser("shell", help="Интерактивный режим: одно соединение на все команды")
+    p_batch = sub.add_parser("batch", help="Выполнить команды из файла (по одной в строке) через одно соединение")
+    p_batch.add_argument("file", help="Файл команд ('-' — stdin); пустые строки и # комментарии пропускаются")
+    p_batch.add_argument("--keep-going", action="store_true",
+                         help="Не останавливаться на первой ошибке")
+    return ap
+
+
+def check_args(args: argparse.Namespace) -> None:
+    if args.enc != "json" and not args.framed:
+        raise SystemExit("--enc cbor/packed работает только с кадрами (без --no-framed)")
+    if args.compress and not args.framed:
+        raise SystemExit("--compress работает только с кадрами (без --no-framed)")
+    if args.enc != "json" and cbor2 is None:
+        raise SystemExit("Для --enc cbor/packed установите cbor2: pip install cbor2")
+
+
+async def run_command(args: argparse.Namespace) -> None:
+    name = args.name or "rpi-netcfg"
     if args.cmd == "list":
-        asyncio.run(cmd_list())
+        await cmd_list()
+    elif args.cmd == "devinfo" and args.watch:
+        await cmd_devinfo_watch(args.addr, name, args.framed, args.enc, args.compress)
     elif args.cmd == "devinfo":
-        asyncio.run(cmd_devinfo(args.addr, args.name or "rpi-netcfg"))
+        await cmd_devinfo(args.addr, name)
+    elif args.cmd == "versions":
+        await cmd_versions(args.addr, name)
+    elif args.cmd == "metrics":
+        await cmd_metrics(args.addr, name, args.raw_json)
     elif args.cmd == "status":
-        asyncio.run(cmd_status_watch(args.addr, args.name or "rpi-netcfg"))
+        await cmd_status_watch(args.addr, name, args.framed, args.enc, args.compress)
+    elif args.cmd == "scan" and args.stream:
+        await cmd_scan_stream(args.addr, name, 20.0 if args.wait is None else args.wait,
+                              args.framed, args.enc, args.compress)
     elif args.cmd == "scan":
-        asyncio.run(cmd_scan(args.addr, args.name or "rpi-netcfg", args.wait))
+        await cmd_scan(args.addr, name, 2.0 if args.wait is None else args.wait,
+                       args.framed, args.enc, args.compress)
     elif args.cmd == "wifi-get":
-        asyncio.run(cmd_wifi_get(args.addr, args.name or "rpi-netcfg"))
+        await cmd_wifi_get(args.addr, name)
     elif args.cmd == "wifi-set":
-        asyncio.run(cmd_wifi_set(
-            args.addr, args.name or "rpi-netcfg", args.ssid, args.psk))
+        await cmd_wifi_set(args.addr, name, args.ssid, args.psk)
     elif args.cmd == "lan-get":
-        asyncio.run(cmd_lan_get(args.addr, args.name or "rpi-netcfg"))
+        await cmd_lan_get(args.addr, name)
     elif args.cmd == "lan-set":
-        asyncio.run(cmd_lan_set(args.addr, args.name or "rpi-netcfg",
-                                args.method, args.ip, args.mask, args.gw, args.dns))
+        await cmd_lan_set(args.addr, name, args.method, args.ip, args.mask, args.gw, args.dns)
+    elif args.cmd == "rpc":
+        await cmd_rpc(args.addr, name, args.calls, args.timeout, args.framed, args.enc, args.compress)
+    elif args.cmd == "fleet":
+        await cmd_fleet(args.manifest, name, args.concurrency, args.scan, args.retries, args.timeout,
+                        args.report, args.framed, args.enc, args.compress)
     elif args.cmd == "action":
-        asyncio.run(cmd_action(args.addr, args.name or "rpi-netcfg", args.cmd))
+        await cmd_action(args.addr, name, args.action_cmd)
+
+
+def print_timing(label: str, total_ms: float) -> None:
+    print(f"[time] {label}: поиск {_timing['scan_ms']:.0f} мс, подключение {_timing['connect_ms']:.0f} мс, "
+          f"всего {total_ms:.0f} мс", file=sys.stderr)
+
+
+async def run_timed(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    try:
+        await run_command(args)
+    finally:
+        if args.timing:
+            print_timing(args.cmd, (time.perf_counter() - t0) * 1000.0)
+
+
+def global_argv(args: argparse.Namespace) -> List[str]:
+    """Глобальные опции сессии — подставляются перед каждой командой."""
+    argv: List[str] = []
+    if args.addr:
+        argv += ["--addr", args.addr]
+    if args.name:
+        argv += ["--name", args.name]
+    if not args.framed:
+        argv.append("--no-framed")
+    if args.enc != "json":
+        argv += ["--enc", args.enc]
+    if args.compress:
+        argv.append("--compress")
+    if not args.cache:
+        argv.append("--no-cache")
+    return argv
+
+
+async def run_line(ap: argparse.ArgumentParser, base: List[str], line: str) -> bool:
+    """Одна команда сессии; False — ошибка (разбор, устройство, сама команда)."""
+    try:
+        args = ap.parse_args(base + shlex.split(line))
+        check_args(args)
+    except (SystemExit, ValueError) as e:
+        if not isinstance(e, SystemExit) or not isinstance(e.code, int):
+            print(f"Ошибка: {e}")
+        return False
+    if args.cmd in ("shell", "batch"):
+        print("Вложенные shell/batch не поддерживаются.")
+        return False
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        await run_command(args)
+    except SystemExit as e:
+        print(e)
+        ok = False
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        ok = False
+    print_timing(line, (time.perf_counter() - t0) * 1000.0)
+    return ok
+
+
+async def run_session(ap: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    """shell / batch: все команды через одно соединение (переподключение, если оно упало)."""
+    _session["keep"] = True
+    base = global_argv(args)
+    failed = 0
+    t0 = time.perf_counter()
+    n = 0
+    try:
+        if args.cmd == "batch":
+            if args.file == "-":
+                lines = sys.stdin.read().splitlines()
+            else:
+                with open(args.file, encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                print(f"> {line}")
+                n += 1
+                if not await run_line(ap, base, line):
+                    failed += 1
+                    if not args.keep_going:
+                        break
+        else:
+            print("Команды как в командной строке (без глобальных опций), exit — выход.\n"
+                  "status и devinfo --watch работают до Ctrl+C, который закрывает и сессию.")
+            loop = asyncio.get_running_loop()
+            while True:
+                try:
+                    line = (await loop.run_in_executor(None, input, "rpi-netcfg> ")).strip()
+                except EOFError:
+                    break
+                if line in ("exit", "quit"):
+                    break
+                if not line or line.startswith("#"):
+                    continue
+                n += 1
+                if not await run_line(ap, base, line):
+                    failed += 1
+    finally:
+        client = _session["client"]
+        if client is not None:
+            await client.disconnect()
+    print(f"[time] сессия: {n} команд, ошибок {failed}, {(time.perf_counter() - t0):.1f} с", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main():
+    ap = build_parser()
+    args = ap.parse_args()
+    check_args(args)
+    _session["cache"] = args.cache
+    if args.cmd in ("shell", "batch"):
+        raise SystemExit(asyncio.run(run_session(ap, args)))
+    asyncio.run(run_timed(args))
 
 
 if __name__ == "__main__":
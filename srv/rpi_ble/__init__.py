@@ -1,4 +1,4 @@
 """Raspberry Pi BLE network configuration service."""
 
-__all__ = ["autoagent", "netcfg"]
+__all__ = ["autoagent", "cmdexec", "framing", "gatt", "loopback", "metrics", "netcfg", "netstate", "nmdbus", "probes", "refresher", "rpc", "scanpipe", "subscriptions", "sysinfo", "wire", "worker"]
 __version__ = "0.1.0"
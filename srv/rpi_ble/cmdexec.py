@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Run external tools (nmcli, ping, curl): argv lists, bounded time and concurrency.
+
+run(argv, timeout) starts the tool directly, without a shell, and kills it
+when the timeout expires (returncode TIMEOUT_RC, like timeout(1)). At most
+MAX_CONCURRENT commands run at once; further callers wait for a slot, and
+the wait counts against their timeout. Connectivity probes take their
+slots from a pool of their own (pool="probes", MAX_PROBES), so they never
+queue behind long scans and applies.
+
+The service runs as root and then nothing else is involved. Started as
+an ordinary user (development), commands need root and go through one
+long-lived helper, the equivalent of `sudo -n python3 -m rpi_ble.cmdexec
+--serve`, which runs them on request: sudo and its PAM session are paid
+once instead of per call. A command the helper cannot take (it could not
+be started, or died under the call) gets its own `sudo -n`.
+
+Every call is counted per tool (stats()): calls, processes spawned,
+timeouts, failures to start, total and maximum duration.
+"""
+from __future__ import annotations
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+MAX_CONCURRENT = 4
+# short connectivity checks (ping, getent, curl, ip route): one check_internet() runs about ten
+MAX_PROBES = 10
+DEFAULT_TIMEOUT = 15.0
+TIMEOUT_RC = 124   # as timeout(1)
+NOT_FOUND_RC = 127  # as sh for a missing command
+
+_slots = {"tools": threading.BoundedSemaphore(MAX_CONCURRENT),
+          "probes": threading.BoundedSemaphore(MAX_PROBES)}
+# Helper entry point; sudo's env_reset drops PYTHONPATH, so the package path goes on the command line
+_SERVE_CODE = 'import sys; sys.path.insert(0, {!r}); from rpi_ble import cmdexec; cmdexec._serve()'
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(tool: str, ms: float, spawned: int, rc: int) -> None:
+    with _stats_lock:
+        st = _stats.setdefault(tool, {"calls": 0, "spawns": 0, "timeouts": 0, "not_found": 0,
+                                      "total_ms": 0.0, "max_ms": 0.0})
+        st["calls"] += 1
+        st["spawns"] += spawned
+        st["timeouts"] += rc == TIMEOUT_RC
+        st["not_found"] += rc == NOT_FOUND_RC
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Per-tool counters (a copy)."""
+    with _stats_lock:
+        return {tool: dict(st) for tool, st in _stats.items()}
+
+
+def _spawn(argv: Sequence[str], timeout: float) -> subprocess.CompletedProcess:
+    """One process, own process group, killed with the group on timeout."""
+    try:
+        p = subprocess.Popen(list(argv), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, text=True, start_new_session=True)
+    except OSError as e:
+        return subprocess.CompletedProcess(list(argv), NOT_FOUND_RC, '', str(e))
+    try:
+        out, err = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            p.kill()
+        out, err = p.communicate()
+        return subprocess.CompletedProcess(list(argv), TIMEOUT_RC, out or '',
+                                           f'timeout after {timeout:g}s')
+    return subprocess.CompletedProcess(list(argv), p.returncode, out, err)
+
+
+# ---- privileged helper (only when not root) ----
+
+class _Helper:
+    """Client side of `--serve`: JSON lines {"id", "argv", "timeout"} -> {"id", "rc", "out", "err"}."""
+
+    def __init__(self) -> None:
+        pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._proc = subprocess.Popen(
+            ['sudo', '-n', sys.executable, '-c', _SERVE_CODE.format(pkg_root)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1)
+        self._lock = threading.Lock()
+        self._waiting: Dict[int, List[Any]] = {}  # id -> [Event, response]
+        self._next = 0
+        self._dead = False
+        first = self._proc.stdout.readline()  # "ready", or EOF if sudo refused
+        if first.strip() != '{"ready": true}':
+            self._proc.kill()
+            raise OSError('cmdexec helper did not start')
+        threading.Thread(target=self._reader, name='cmdexec-helper', daemon=True).start()
+
+    def alive(self) -> bool:
+        return not self._dead and self._proc.poll() is None
+
+    def _reader(self) -> None:
+        for line in self._proc.stdout:
+            try:
+                resp = json.loads(line)
+            except ValueError:
+                continue
+            with self._lock:
+                slot = self._waiting.pop(resp.get("id"), None)
+            if slot is not None:
+                slot[1] = resp
+                slot[0].set()
+        with self._lock:  # helper gone (EOF): wake everybody
+            self._dead = True
+            for slot in self._waiting.values():
+                slot[0].set()
+            self._waiting.clear()
+
+    def run(self, argv: Sequence[str], timeout: float) -> Optional[subprocess.CompletedProcess]:
+        """None if the helper is gone (it may die between alive() and here): the caller falls back."""
+        slot: List[Any] = [threading.Event(), None]
+        with self._lock:
+            if self._dead:
+                return None
+            self._next += 1
+            rid = self._next
+            self._waiting[rid] = slot
+            try:
+                self._proc.stdin.write(json.dumps({"id": rid, "argv": list(argv), "timeout": timeout}) + '\n')
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError, ValueError):  # ValueError: stdin already closed
+                self._dead = True
+                self._waiting.pop(rid, None)
+                return None
+        slot[0].wait(timeout + 5.0)
+        resp = slot[1]
+        if resp is None:
+            with self._lock:
+                self._waiting.pop(rid, None)
+                if self._dead:
+                    return None
+            return subprocess.CompletedProcess(list(argv), TIMEOUT_RC, '', 'cmdexec helper did not answer')
+        return subprocess.CompletedProcess(list(argv), resp["rc"], resp["out"], resp["err"])
+
+
+_helper: Optional[_Helper] = None
+_helper_failed = False
+_helper_lock = threading.Lock()
+
+
+def _get_helper() -> Optional[_Helper]:
+    global _helper, _helper_failed
+    with _helper_lock:
+        if _helper is not None and not _helper.alive():
+            _helper = None
+        if _helper is None and not _helper_failed:
+            try:
+                _helper = _Helper()
+            except OSError:
+                _helper_failed = True  # no passwordless sudo for it: per-call sudo
+        return _helper
+
+
+def _serve() -> None:
+    """Helper process: run requests from stdin concurrently, answer on stdout."""
+    out_lock = threading.Lock()
+
+    def answer(req: Dict[str, Any]) -> None:
+        r = _spawn(req["argv"], float(req.get("timeout") or DEFAULT_TIMEOUT))
+        line = json.dumps({"id": req["id"], "rc": r.returncode, "out": r.stdout, "err": r.stderr})
+        with out_lock:
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+    print('{"ready": true}', flush=True)
+    for line in sys.stdin:
+        try:
+            req = json.loads(line)
+        except ValueError:
+            continue
+        threading.Thread(target=answer, args=(req,), daemon=True).start()
+
+
+# ---- public ----
+
+def run(argv: Sequence[str], timeout: float = DEFAULT_TIMEOUT, pool: str = "tools") -> subprocess.CompletedProcess:
+    """Run argv as root, no shell; stdout/stderr as text, never raises for the tool's failures."""
+    argv = [str(a) for a in argv]
+    spawned = 1
+    slots = _slots[pool]
+    t0 = time.monotonic()
+    if not slots.acquire(timeout=timeout):
+        _record(os.path.basename(argv[0]), (time.monotonic() - t0) * 1000.0, 0, TIMEOUT_RC)
+        return subprocess.CompletedProcess(argv, TIMEOUT_RC, '', f'no free slot within {timeout:g}s')
+    try:
+        # the tool gets what the wait for a slot left of the budget
+        timeout = max(0.1, timeout - (time.monotonic() - t0))
+        t0 = time.monotonic()  # the wait for a slot is not the tool's time
+        if os.geteuid() == 0:
+            r = _spawn(argv, timeout)
+            spawned = int(r.returncode != NOT_FOUND_RC)
+        else:
+            helper = _get_helper()
+            r = helper.run(argv, timeout) if helper is not None else None
+            if r is None:
+                # no helper, or it died under us: _get_helper() starts a new one next time
+                timeout = max(0.1, timeout - (time.monotonic() - t0))
+                r = _spawn(['sudo', '-n'] + argv, timeout)
+                spawned = 2
+    finally:
+        slots.release()
+    _record(os.path.basename(argv[0]), (time.monotonic() - t0) * 1000.0, spawned, r.returncode)
+    return r
+
+
+def shutdown() -> None:
+    global _helper
+    with _helper_lock:
+        if _helper is not None:
+            _helper._proc.stdin.close()
+            _helper = None
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['--serve']:
+    _serve()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Framed transfer of large values over GATT notifications.
+
+A message is split into frames that each fit one ATT notification
+(negotiated MTU minus the 3-byte ATT header):
+
+    byte 0     flags: START (first frame of a message), END (last frame),
+               COMPRESSED (START only: the message is deflated, see wire.deflate)
+    byte 1     seq: frame index within the message, mod 256
+    bytes 2-5  total message length, u32 little-endian (START frame only)
+    ...        payload
+
+The receiver allocates the buffer on START, appends each frame and has the
+complete message on END: reassembly is linear and needs no retry parsing.
+A gap in seq drops the message; the receiver waits for the next START.
+"""
+from __future__ import annotations
+
+import struct
+from typing import Callable, List, Optional
+
+ATT_MTU_MIN = 23
+ATT_NOTIFY_OVERHEAD = 3  # opcode + handle
+
+FLAG_START = 0x01
+FLAG_END = 0x02
+FLAG_COMPRESSED = 0x04
+
+_HDR = struct.Struct('<BB')
+_START_HDR = struct.Struct('<BBI')
+
+
+def chunk_size(mtu: int) -> int:
+    """Bytes of one notification value for the given ATT MTU."""
+    return max(ATT_MTU_MIN, int(mtu)) - ATT_NOTIFY_OVERHEAD
+
+
+def frame_count(length: int, mtu: int) -> int:
+    """Number of frames frames() produces for a payload of `length` bytes."""
+    first = chunk_size(mtu) - _START_HDR.size
+    if length <= first:
+        return 1
+    step = chunk_size(mtu) - _HDR.size
+    return 1 + -(-(length - first) // step)
+
+
+def frames(payload: bytes, mtu: int, compressed: bool = False) -> List[bytes]:
+    """Split payload into notification-sized frames."""
+    size = chunk_size(mtu)
+    out: List[bytes] = []
+    total = len(payload)
+    pos = size - _START_HDR.size
+    flags = FLAG_START | (FLAG_END if pos >= total else 0) | (FLAG_COMPRESSED if compressed else 0)
+    out.append(_START_HDR.pack(flags, 0, total) + payload[:pos])
+    seq = 1
+    step = size - _HDR.size
+    while pos < total:
+        end = pos + step
+        out.append(_HDR.pack(FLAG_END if end >= total else 0, seq & 0xFF) + payload[pos:end])
+        pos = end
+        seq += 1
+    return out
+
+
+class Reassembler:
+    """Receiving side: feed() frames, get the message back once it is complete.
+
+    Compressed messages are passed through `inflate` (dropped without one).
+    """
+
+    def __init__(self, inflate: Optional[Callable[[bytes], bytes]] = None) -> None:
+        self._inflate = inflate
+        self._buf: Optional[bytearray] = None
+        self._total = 0
+        self._seq = 0
+        self._compressed = False
+        self.dropped = 0  # messages lost to a gap or a bad length
+
+    def feed(self, frame: bytes) -> Optional[bytes]:
+        if len(frame) < _HDR.size:
+            return None
+        flags, seq = _HDR.unpack_from(frame)
+        if flags & FLAG_START:
+            if len(frame) < _START_HDR.size:
+                return None
+            if self._buf is not None:
+                self.dropped += 1
+            _, _, self._total = _START_HDR.unpack_from(frame)
+            self._buf = bytearray(frame[_START_HDR.size:])
+            self._seq = 0
+            self._compressed = bool(flags & FLAG_COMPRESSED)
+        elif self._buf is None:
+            return None  # joined mid-message: wait for the next START
+        elif seq != (self._seq + 1) & 0xFF:
+            self._buf = None
+            self.dropped += 1
+            return None
+        else:
+            self._buf += frame[_HDR.size:]
+            self._seq = seq
+        if not flags & FLAG_END:
+            return None
+        buf, self._buf = self._buf, None
+        if len(buf) != self._total or (self._compressed and self._inflate is None):
+            self.dropped += 1
+            return None
+        return self._inflate(bytes(buf)) if self._compressed else bytes(buf)
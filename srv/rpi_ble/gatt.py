@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Thin layer over bluezero's local GATT characteristic: values stay bytes.
+
+bluezero 0.9 moves every value as a Python list of ints (one object per
+byte) and wraps it into a dbus.Array of dbus.Byte again on the way out.
+ByteCharacteristic hands bytes / dbus.ByteArray straight through instead:
+
+- read_callback(options) returns bytes, which go out as one 'ay' buffer;
+- write_callback(value, options) gets the written value as bytes;
+- set_value(value) takes bytes and notifies subscribers.
+
+Unlike the bluezero class, reads and writes do not emit PropertiesChanged:
+that signal is a notification, and subscribers must only get what
+set_value() sends (framed, see framing.py).
+
+Long reads: a value longer than one ATT PDU is fetched with Read Blob
+requests, which BlueZ forwards as ReadValue with an "offset" option. The
+value is produced once, on offset 0, and later offsets of the same central
+are served from that snapshot until its last byte went out, so the
+fragments are consistent and read_callback is not run for every blob.
+
+ValueCache keeps the encoded value per state version, so repeated reads
+of unchanged state reuse one buffer.
+
+Every read, write and notification is recorded in rpi_ble.metrics under
+the characteristic's name (read:<name>, write:<name>, notify:<name>);
+reads answered from a long-read snapshot count as read_blob:<name>.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import dbus
+import dbus.service
+from bluezero import constants, dbus_tools, localGATT, peripheral
+
+from rpi_ble import metrics
+
+# A long read not continued within this time starts over from read_callback
+LONG_READ_TTL_SECS = 30
+
+
+def byte_array(value: Any) -> dbus.ByteArray:
+    """bytes / bytearray / list[int] -> dbus.ByteArray (no copy if it already is one)."""
+    if isinstance(value, dbus.ByteArray):
+        return value
+    return dbus.ByteArray(bytes(value))
+
+
+class ByteCharacteristic(localGATT.Characteristic):
+    def __init__(self, *args: Any, name: Optional[str] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.name = name or str(self.props[constants.GATT_CHRC_IFACE]['UUID'])
+        # device path -> (monotonic time, value) of long reads in progress
+        self._long_reads: Dict[str, Tuple[float, dbus.ByteArray]] = {}
+
+    def set_value(self, value: Any) -> None:
+        value = byte_array(value)
+        t0 = time.perf_counter()
+        self.Set(constants.GATT_CHRC_IFACE, 'Value', value)
+        metrics.observe('notify', self.name, (time.perf_counter() - t0) * 1000.0, len(value))
+
+    @dbus.service.method(constants.GATT_CHRC_IFACE,
+                         in_signature='a{sv}', out_signature='ay')
+    def ReadValue(self, options):  # pylint: disable=invalid-name
+        t0 = time.perf_counter()
+        try:
+            value, blob = self._read(options)
+        except Exception:
+            metrics.observe('read', self.name, (time.perf_counter() - t0) * 1000.0, error=True)
+            raise
+        metrics.observe('read_blob' if blob else 'read', self.name,
+                        (time.perf_counter() - t0) * 1000.0, len(value))
+        return value
+
+    def _read(self, options: Any) -> Tuple[dbus.ByteArray, bool]:
+        """(value from `offset` on, whether it came from a long-read snapshot)"""
+        props = self.props[constants.GATT_CHRC_IFACE]
+        opts = dbus_tools.dbus_to_python(options)
+        offset = int(opts.get('offset', 0))
+        dev = str(opts.get('device', ''))
+        now = time.monotonic()
+        snap = self._long_reads.get(dev)
+        blob = bool(offset and snap is not None and now - snap[0] <= LONG_READ_TTL_SECS)
+        if blob:
+            value = snap[1]
+        else:
+            if self.read_callback:
+                props['Value'] = byte_array(self.read_callback(opts))
+            value = props['Value']
+        if offset > len(value):
+            self._long_reads.pop(dev, None)
+            raise dbus.exceptions.DBusException('offset past the end of the value',
+                                                name='org.bluez.Error.InvalidOffset')
+        mtu = int(opts.get('mtu', 0))
+        # ATT Read (Blob) Response carries up to MTU - 1 bytes
+        if mtu and offset + mtu - 1 >= len(value):
+            self._long_reads.pop(dev, None)
+        else:
+            self._long_reads[dev] = (now, value)
+        return (value if not offset else byte_array(value[offset:])), blob
+
+    @dbus.service.method(constants.GATT_CHRC_IFACE,
+                         in_signature='aya{sv}', out_signature='', byte_arrays=True)
+    def WriteValue(self, value, options):  # pylint: disable=invalid-name
+        t0 = time.perf_counter()
+        error = False
+        try:
+            if self.write_callback:
+                self.write_callback(bytes(value), dbus_tools.dbus_to_python(options))
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe('write', self.name, (time.perf_counter() - t0) * 1000.0, len(value), error)
+
+
+class CharDef(NamedTuple):
+    """One characteristic of the service, independent of the transport serving it
+    (add_characteristic for BlueZ, rpi_ble.loopback for a local socket)."""
+    chr_id: int
+    uuid: str
+    name: str
+    flags: List[str]
+    value: Any = b''
+    read_callback: Optional[Callable[[Dict[str, Any]], Any]] = None
+    write_callback: Optional[Callable[[bytes, Dict[str, Any]], None]] = None
+    notify_callback: Optional[Callable[[bool, Any], None]] = None
+
+
+def add_characteristic(app: peripheral.Peripheral, srv_id: int, chr_id: int, uuid: str,
+                       value: Any, notifying: bool, flags: list,
+                       read_callback: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                       write_callback: Optional[Callable[[bytes, Dict[str, Any]], None]] = None,
+                       notify_callback: Optional[Callable[[bool, Any], None]] = None,
+                       name: Optional[str] = None) -> ByteCharacteristic:
+    """Peripheral.add_characteristic() with a ByteCharacteristic; `name` labels its metrics."""
+    chrc = ByteCharacteristic(srv_id, chr_id, uuid, byte_array(value), notifying, flags,
+                              read_callback, write_callback, notify_callback, name=name)
+    app.characteristics.append(chrc)
+    return chrc
+
+
+class ValueCache:
+    """Encoded values by name and encoding variant, keyed by the state version.
+
+    encode(obj, variant) produces the bytes. The owner bumps the version
+    whenever the state behind a name changes. The source object is kept
+    too and must be the same one: a snapshot replaced without a bump is
+    re-encoded rather than served stale.
+    """
+
+    def __init__(self, encode: Callable[[Any, Any], bytes]):
+        self._encode = encode
+        self._slots: Dict[Tuple[str, Any], Tuple[int, Any, dbus.ByteArray]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, version: int, obj: Any, variant: Any = None) -> dbus.ByteArray:
+        slot = self._slots.get((name, variant))
+        if slot is not None and slot[0] == version and slot[1] is obj:
+            self.hits += 1
+            return slot[2]
+        self.misses += 1
+        data = byte_array(self._encode(obj, variant))
+        self._slots[(name, variant)] = (version, obj, data)
+        return data
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""GATT over a local socket: the netcfg service without BlueZ or an adapter.
+
+Server serves the same characteristic definitions as the BlueZ transport
+(gatt.CharDef) on a Unix socket path or host:port, and Central is the
+client side. Every socket connection is one central, with what BlueZ
+does for a real one:
+
+- on_connect / on_disconnect(adapter_addr, device_addr) per connection,
+  with a made-up address (02:00:00:00:xx:xx, locally administered);
+- read_callback / write_callback get {"device": <Device1 path>, "mtu"},
+  and reads continue past MTU - 1 bytes with an offset (Read Blob),
+  served from a per-central snapshot as gatt.ByteCharacteristic does;
+- notify_callback(True, chrc) when the first central subscribes and
+  (False, chrc) when the last one unsubscribes or disconnects;
+  chrc.set_value() goes to every subscribed central, or only to the
+  addresses given as `devices`.
+
+Requests of one connection are handled one at a time, in order, through
+schedule(fn), which must run fn on the thread that owns the service state
+(netcfg: GLib.idle_add on the main loop). Outgoing messages are queued
+per connection; a central that stops reading is disconnected once
+MAX_QUEUED messages are waiting, instead of holding the main loop.
+
+Every message is <op u8, chr_id u8, length u32 LE> + payload:
+
+    central -> service               service -> central
+    LIST                             OK   JSON [{"id", "uuid", "name", "flags"}]
+    MTU     u16 LE                   OK
+    READ    u32 LE offset            OK   value (up to MTU - 1 bytes if MTU is set)
+    WRITE   value                    OK
+    WRITE_CMD value                  (no answer: write-without-response)
+    SUB / UNSUB                      OK
+                                     ERR  message (utf-8), instead of OK
+                                     NOTIFY value, at any time
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from rpi_ble import metrics
+
+HEADER = struct.Struct('<BBI')
+OP_LIST, OP_MTU, OP_READ, OP_WRITE, OP_WRITE_CMD, OP_SUB, OP_UNSUB = 1, 2, 3, 4, 5, 6, 7
+OP_OK, OP_ERR, OP_NOTIFY = 0x80, 0x81, 0x82
+MAX_PAYLOAD = 1 << 20
+MAX_QUEUED = 1024
+# A long read not continued within this time starts over (gatt.LONG_READ_TTL_SECS)
+LONG_READ_TTL_SECS = 30
+ADAPTER_ADDR = '02:00:00:00:00:00'
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """"host:port" -> TCP, anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            return None
+        buf += part
+    return bytes(buf)
+
+
+def recv_msg(sock: socket.socket) -> Optional[Tuple[int, int, bytes]]:
+    """(op, chr_id, payload), or None when the peer closed the connection."""
+    head = _recv_exact(sock, HEADER.size)
+    if head is None:
+        return None
+    op, chr_id, size = HEADER.unpack(head)
+    if size > MAX_PAYLOAD:
+        raise OSError(f'message of {size} bytes')
+    payload = _recv_exact(sock, size) if size else b''
+    if payload is None:
+        return None
+    return op, chr_id, payload
+
+
+def pack_msg(op: int, chr_id: int, payload: bytes = b'') -> bytes:
+    return HEADER.pack(op, chr_id, len(payload)) + payload
+
+
+# ==============================
+# Service side
+# ==============================
+
+
+class Characteristic:
+    """A characteristic served over loopback; set_value() notifies the subscribed centrals."""
+
+    def __init__(self, spec: Any):
+        self.chr_id: int = spec.chr_id
+        self.uuid: str = spec.uuid
+        self.name: str = spec.name or spec.uuid
+        self.flags: List[str] = list(spec.flags)
+        self.value = bytes(spec.value or b'')
+        self.read_callback = spec.read_callback
+        self.write_callback = spec.write_callback
+        self.notify_callback = spec.notify_callback
+        self.subscribers: Set["_Conn"] = set()
+        # device address -> (monotonic time, value) of long reads in progress
+        self._long_reads: Dict[str, Tuple[float, bytes]] = {}
+
+    @property
+    def devices(self) -> Set[str]:
+        """Addresses of the subscribed centrals (see subscriptions.Registry)."""
+        return {conn.addr for conn in self.subscribers}
+
+    def set_value(self, value: Any, devices: Optional[Set[str]] = None) -> None:
+        value = bytes(value)
+        t0 = time.perf_counter()
+        self.value = value
+        msg = pack_msg(OP_NOTIFY, self.chr_id, value)
+        for conn in list(self.subscribers):
+            if devices is None or conn.addr in devices:
+                conn.send(msg)
+        metrics.observe('notify', self.name, (time.perf_counter() - t0) * 1000.0, len(value))
+
+    def read(self, conn: "_Conn", offset: int) -> bytes:
+        if 'read' not in self.flags:
+            raise PermissionError('read not permitted')
+        t0 = time.perf_counter()
+        try:
+            now = time.monotonic()
+            snap = self._long_reads.get(conn.addr)
+            blob = bool(offset and snap is not None and now - snap[0] <= LONG_READ_TTL_SECS)
+            if blob:
+                value = snap[1]
+            else:
+                if self.read_callback:
+                    self.value = bytes(self.read_callback(conn.options()))
+                value = self.value
+            if offset > len(value):
+                self._long_reads.pop(conn.addr, None)
+                raise ValueError('offset past the end of the value')
+            end = offset + conn.mtu - 1 if conn.mtu else len(value)
+            if end >= len(value):
+                self._long_reads.pop(conn.addr, None)
+            else:
+                self._long_reads[conn.addr] = (now, value)
+        except Exception:
+            metrics.observe('read', self.name, (time.perf_counter() - t0) * 1000.0, error=True)
+            raise
+        metrics.observe('read_blob' if blob else 'read', self.name,
+                        (time.perf_counter() - t0) * 1000.0, len(value))
+        return value[offset:end]
+
+    def write(self, conn: "_Conn", value: bytes, response: bool) -> None:
+        if ('write' if response else 'write-without-response') not in self.flags:
+            raise PermissionError('write not permitted')
+        t0 = time.perf_counter()
+        error = False
+        try:
+            if self.write_callback:
+                self.write_callback(value, conn.options())
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe('write', self.name, (time.perf_counter() - t0) * 1000.0, len(value), error)
+
+    def subscribe(self, conn: "_Conn", on: bool) -> None:
+        if 'notify' not in self.flags:
+            raise PermissionError('notify not permitted')
+        before = bool(self.subscribers)
+        if on:
+            self.subscribers.add(conn)
+        else:
+            self.subscribers.discard(conn)
+        if bool(self.subscribers) != before and self.notify_callback:
+            self.notify_callback(bool(self.subscribers), self)
+
+
+class _Conn:
+    """One connected central: a reader thread, a writer thread and its outgoing queue."""
+
+    def __init__(self, server: "Server", sock: socket.socket, addr: str):
+        self.server = server
+        self.sock = sock
+        self.addr = addr
+        self.path = f'/org/bluez/hci0/dev_{addr.replace(":", "_")}'
+        self.mtu = 0
+        self._out: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._closed = False
+
+    def options(self) -> Dict[str, Any]:
+        """What BlueZ passes to ReadValue / WriteValue."""
+        opts: Dict[str, Any] = {"device": self.path}
+        if self.mtu:
+            opts["mtu"] = self.mtu
+        return opts
+
+    def send(self, msg: bytes) -> None:
+        if self._closed:
+            return
+        if self._out.qsize() >= MAX_QUEUED:
+            print(f'loopback: {self.addr} is not reading, disconnecting')
+            self.close()
+            return
+        self._out.put(msg)
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._out.put(None)
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self) -> None:
+        threading.Thread(target=self._writer, name=f'loopback-out-{self.addr}', daemon=True).start()
+        threading.Thread(target=self._reader, name=f'loopback-in-{self.addr}', daemon=True).start()
+
+    def _writer(self) -> None:
+        while True:
+            msg = self._out.get()
+            if msg is None:
+                return
+            try:
+                self.sock.sendall(msg)
+            except OSError:
+                self.close()
+                return
+
+    def _reader(self) -> None:
+        srv = self.server
+        srv.schedule(lambda: srv._connected(self))
+        try:
+            while True:
+                msg = recv_msg(self.sock)
+                if msg is None:
+                    break
+                op, chr_id, payload = msg
+                if op == OP_WRITE_CMD:
+                    srv.schedule(lambda chr_id=chr_id, payload=payload: srv._handle(self, OP_WRITE_CMD, chr_id, payload))
+                    continue
+                # one request at a time, as over ATT
+                done = threading.Event()
+
+                def job(op=op, chr_id=chr_id, payload=payload) -> None:
+                    try:
+                        srv._handle(self, op, chr_id, payload)
+                    finally:
+                        done.set()
+                srv.schedule(job)
+                done.wait()
+        except OSError:
+            pass
+        finally:
+            self.close()
+            self.sock.close()
+            srv.schedule(lambda: srv._disconnected(self))
+
+
+class Server:
+    """Serve characteristic definitions (gatt.CharDef) on `address` for any number of centrals."""
+
+    def __init__(self, address: str, chars: Sequence[Any], schedule: Callable[[Callable[[], None]], Any],
+                 on_connect: Optional[Callable[[str, str], None]] = None,
+                 on_disconnect: Optional[Callable[[str, str], None]] = None):
+        self.address = address
+        self.chars: Dict[int, Characteristic] = {c.chr_id: Characteristic(c) for c in chars}
+        self._schedule = schedule
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.centrals: Dict[str, _Conn] = {}
+        self._listener: Optional[socket.socket] = None
+        self._ids = itertools.count(1)
+
+    def schedule(self, fn: Callable[[], None]) -> None:
+        def once() -> bool:
+            try:
+                fn()
+            except Exception:
+                traceback.print_exc()
+            return False
+        self._schedule(once)
+
+    def characteristic(self, name: str) -> Characteristic:
+        return next(c for c in self.chars.values() if c.name == name)
+
+    def start(self) -> None:
+        family, sockaddr = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(sockaddr):
+            os.unlink(sockaddr)
+        lsock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        lsock.bind(sockaddr)
+        lsock.listen(64)
+        self._listener = lsock
+        threading.Thread(target=self._accept, name='loopback-accept', daemon=True).start()
+        print(f'loopback GATT transport on {self.address}')
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        for conn in list(self.centrals.values()):
+            conn.close()
+
+    def _accept(self) -> None:
+        while self._listener is not None:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return  # closed
+            n = next(self._ids)
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _Conn(self, sock, f'02:00:00:00:{n >> 8 & 0xff:02X}:{n & 0xff:02X}').start()
+
+    # ---- on the service thread ----
+
+    def _connected(self, conn: _Conn) -> None:
+        self.centrals[conn.addr] = conn
+        if self.on_connect:
+            self.on_connect(ADAPTER_ADDR, conn.addr)
+
+    def _disconnected(self, conn: _Conn) -> None:
+        for chrc in self.chars.values():
+            chrc._long_reads.pop(conn.addr, None)
+            if conn in chrc.subscribers:
+                chrc.subscribe(conn, False)
+        if self.centrals.pop(conn.addr, None) is not None and self.on_disconnect:
+            self.on_disconnect(ADAPTER_ADDR, conn.addr)
+
+    def _handle(self, conn: _Conn, op: int, chr_id: int, payload: bytes) -> None:
+        try:
+            if op == OP_LIST:
+                out = json.dumps([{"id": c.chr_id, "uuid": c.uuid, "name": c.name, "flags": c.flags}
+                                  for c in self.chars.values()]).encode()
+            elif op == OP_MTU:
+                conn.mtu = struct.unpack('<H', payload)[0]
+                out = b''
+            else:
+                chrc = self.chars.get(chr_id)
+                if chrc is None:
+                    raise LookupError(f'no characteristic {chr_id}')
+                if op == OP_READ:
+                    out = chrc.read(conn, struct.unpack('<I', payload)[0] if payload else 0)
+                elif op in (OP_WRITE, OP_WRITE_CMD):
+                    chrc.write(conn, payload, op == OP_WRITE)
+                    out = b''
+                elif op in (OP_SUB, OP_UNSUB):
+                    chrc.subscribe(conn, op == OP_SUB)
+                    out = b''
+                else:
+                    raise ValueError(f'unknown op {op}')
+        except Exception as e:
+            if op != OP_WRITE_CMD:
+                conn.send(pack_msg(OP_ERR, chr_id, f'{type(e).__name__}: {e}'.encode()))
+            return
+        if op != OP_WRITE_CMD:
+            conn.send(pack_msg(OP_OK, chr_id, out))
+
+
+# ==============================
+# Central side
+# ==============================
+
+
+class LoopbackError(Exception):
+    """The service answered ERR."""
+
+
+class Central:
+    """A client of Server: reads, writes and subscriptions, usable from several threads."""
+
+    def __init__(self, address: str, mtu: int = 0, timeout: float = 10.0):
+        family, sockaddr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(sockaddr)
+        self.sock.settimeout(None)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timeout = timeout
+        self._lock = threading.Lock()  # one request at a time
+        self._send_lock = threading.Lock()
+        self._answers: "queue.Queue[Tuple[int, bytes]]" = queue.Queue()
+        self._handlers: Dict[int, Callable[[bytes], None]] = {}
+        self.closed = threading.Event()
+        threading.Thread(target=self._reader, name='loopback-central', daemon=True).start()
+        self.chars: Dict[str, Dict[str, Any]] = {c["name"]: c for c in json.loads(self._request(OP_LIST, 0))}
+        self.mtu = 0
+        if mtu:
+            self._request(OP_MTU, 0, struct.pack('<H', mtu))
+            self.mtu = mtu
+
+    def _id(self, name: str) -> int:
+        if name in self.chars:
+            return self.chars[name]["id"]
+        for c in self.chars.values():
+            if c["uuid"] == name:
+                return c["id"]
+        raise KeyError(name)
+
+    def _reader(self) -> None:
+        try:
+            while True:
+                msg = recv_msg(self.sock)
+                if msg is None:
+                    break
+                op, chr_id, payload = msg
+                if op == OP_NOTIFY:
+                    handler = self._handlers.get(chr_id)
+                    if handler is not None:
+                        handler(payload)
+                else:
+                    self._answers.put((op, payload))
+        except OSError:
+            pass
+        finally:
+            self.closed.set()
+            self._answers.put((OP_ERR, b'connection closed'))
+
+    def _send(self, op: int, chr_id: int, payload: bytes = b'') -> None:
+        with self._send_lock:
+            self.sock.sendall(pack_msg(op, chr_id, payload))
+
+    def _request(self, op: int, chr_id: int, payload: bytes = b'') -> bytes:
+        with self._lock:
+            if self.closed.is_set():
+                raise LoopbackError('connection closed')
+            self._send(op, chr_id, payload)
+            try:
+                rop, data = self._answers.get(timeout=self.timeout)
+            except queue.Empty:
+                # answers carry no request id: a late one would be taken as the answer to the
+                # next request, so the link is dropped, as an ATT transaction timeout does
+                self.close()
+                raise TimeoutError(f'no answer to op {op} within {self.timeout:g}s') from None
+        if rop == OP_ERR:
+            raise LoopbackError(data.decode(errors='replace'))
+        return data
+
+    def read(self, name: str) -> bytes:
+        """The whole value, continuing with offsets while a response is full (MTU - 1 bytes)."""
+        chr_id = self._id(name)
+        value = self._request(OP_READ, chr_id, struct.pack('<I', 0))
+        while self.mtu and len(value) % (self.mtu - 1) == 0 and value:
+            part = self._request(OP_READ, chr_id, struct.pack('<I', len(value)))
+            if not part:
+                break
+            value += part
+        return value
+
+    def write(self, name: str, value: bytes, response: bool = True) -> None:
+        if response:
+            self._request(OP_WRITE, self._id(name), value)
+        else:
+            self._send(OP_WRITE_CMD, self._id(name), value)
+
+    def subscribe(self, name: str, handler: Callable[[bytes], None]) -> None:
+        """handler(value) runs on the receiving thread for every notification."""
+        chr_id = self._id(name)
+        self._handlers[chr_id] = handler
+        self._request(OP_SUB, chr_id)
+
+    def unsubscribe(self, name: str) -> None:
+        chr_id = self._id(name)
+        self._request(OP_UNSUB, chr_id)
+        self._handlers.pop(chr_id, None)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.closed.set()
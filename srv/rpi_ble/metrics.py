@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""In-process counters and latency histograms for the hot paths.
+
+Series are named "<kind>:<name>" — read:devinfo, write:scan_ctrl,
+notify:status, run:nmcli, probe:dns — and each keeps a call count, a
+fixed-bucket latency histogram (milliseconds) and a byte total. Recording
+is a dict lookup and a few additions under one lock, cheap enough for
+every GATT callback.
+
+snapshot() is what the Metrics characteristic serves (per series: n, p50,
+p95, p99, max ms, bytes); snapshot(detail=True) adds the bucket counts and
+is what the Unix socket (serve_unix) returns, one JSON document per
+connection:
+
+    socat - UNIX-CONNECT:/run/rpi-ble-netcfg/metrics.sock
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+# Upper bounds of the latency buckets, ms; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_series: Dict[str, "Series"] = {}
+_sources: Dict[str, Callable[[], Any]] = {}
+_started = time.monotonic()
+
+
+class Series:
+    __slots__ = ("n", "sum_ms", "max_ms", "bytes", "errors", "buckets")
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.bytes = 0
+        self.errors = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile, capped at the maximum seen."""
+        if not self.n:
+            return None
+        top = round(self.max_ms, 2)
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.buckets):
+            seen += c
+            if seen >= rank:
+                return min(BUCKETS_MS[i], top) if i < len(BUCKETS_MS) else top
+        return top
+
+    def as_dict(self, detail: bool) -> Dict[str, Any]:
+        d: Dict[str, Any] = {"n": self.n, "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+                             "p99": self.quantile(0.99), "max": round(self.max_ms, 2)}
+        if self.bytes:
+            d["bytes"] = self.bytes
+        if self.errors:
+            d["err"] = self.errors
+        if detail:
+            d["sum_ms"] = round(self.sum_ms, 2)
+            d["buckets"] = self.buckets[:]
+        return d
+
+
+def observe(kind: str, name: str, ms: Optional[float] = None, nbytes: int = 0, error: bool = False) -> None:
+    """One event: a duration (ms) and/or bytes moved."""
+    key = f"{kind}:{name}"
+    with _lock:
+        s = _series.get(key)
+        if s is None:
+            s = _series[key] = Series()
+        s.n += 1
+        s.bytes += nbytes
+        s.errors += error
+        if ms is not None:
+            s.sum_ms += ms
+            if ms > s.max_ms:
+                s.max_ms = ms
+            s.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+
+def add_source(name: str, fn: Callable[[], Any]) -> None:
+    """Extra counters kept elsewhere (cache hits, notify stats...), read at snapshot time."""
+    _sources[name] = fn
+
+
+def snapshot(detail: bool = False) -> Dict[str, Any]:
+    with _lock:
+        series = {k: s.as_dict(detail) for k, s in sorted(_series.items())}
+    out: Dict[str, Any] = {"uptime_s": int(time.monotonic() - _started), "series": series}
+    for name, fn in _sources.items():
+        try:
+            out[name] = fn()
+        except Exception as e:
+            out[name] = {"error": str(e)}
+    return out
+
+
+# ---- local Unix socket ----
+
+def serve_unix(path: str) -> Optional[socket.socket]:
+    """Answer every connection on `path` with snapshot(detail=True) as JSON; None if it cannot bind."""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(path)
+        os.chmod(path, 0o660)
+        srv.listen(4)
+    except OSError as e:
+        print(f"metrics socket {path} unavailable: {e}")
+        return None
+
+    def loop() -> None:
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return  # closed
+            try:
+                with conn:
+                    conn.sendall(json.dumps(snapshot(detail=True), ensure_ascii=False).encode() + b"\n")
+            except Exception:
+                traceback.print_exc()
+
+    threading.Thread(target=loop, name="metrics-socket", daemon=True).start()
+    return srv
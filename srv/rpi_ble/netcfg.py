@@ -3,19 +3,25 @@
 from __future__ import annotations
 
 import json
+import os
+import shlex
 import subprocess
 import time
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, Dict, Optional, List, Set, Tuple
 import urllib.request
 
+import dbus
 from gi.repository import GLib
 from bluezero import adapter, peripheral
 
+from rpi_ble import (cmdexec, framing, gatt, loopback, metrics, netstate, nmdbus, probes, refresher, rpc, scanpipe,
+                     subscriptions, sysinfo, wire, worker)
+
 # ==============================
 # UUIDs
 # ==============================
 SVC_UUID = 'd84a0001-4f6f-4e10-8b27-2d9f2d6e0001'
-def UUID(n): return f'd84a000{n}-4f6f-4e10-8b27-2d9f2d6e000{n}'
+def UUID(n): return f'd84a00{n:02x}-4f6f-4e10-8b27-2d9f2d6e00{n:02x}'
 
 
 # ==============================
@@ -27,42 +33,233 @@ _state: Dict[str, Any] = {
     "status": {"op": None, "stage": None, "ok": True, "err": None},
     "last_scan": {"ts": 0, "aps": []},
     "net": {"ts": 0, "status": {}},
+    "devinfo": {"ts": 0, "info": {}},
 }
 WIFI_SCAN_STALE_SECS = 10
 NET_CHECK_STALE_SECS = 15
+# Overall wall-time budget for one check_internet() run
+NET_CHECK_DEADLINE_SECS = 4.0
+# Unframed notify chunk when no central has reported its ATT MTU
 WIFI_NOTIFY_CHUNK = 360
-# Handles to characteristic objects for sending notifications when enabled
-_status_chr_obj = None  # type: Optional[peripheral.Characteristic]
-_wifi_scan_chr_obj = None  # type: Optional[peripheral.Characteristic]
+CFG_STALE_SECS = 5
+DEVINFO_STALE_SECS = 5
+# Background Device Info refresh cadence: nobody connected / connected / subscribed
+REFRESH_IDLE_SECS = 60
+REFRESH_CONNECTED_SECS = 10
+REFRESH_SUBSCRIBED_SECS = 3
+# Device Info notify: deltas in between, a full snapshot every N pushes / seconds
+DEVINFO_FULL_EVERY = 20
+DEVINFO_FULL_SECS = 60
+# Kill limits for external tools (default: cmdexec.DEFAULT_TIMEOUT)
+SCAN_TIMEOUT_SECS = 30
+APPLY_TIMEOUT_SECS = 60
+# When the "wifi"/"lan" snapshots in _state were last refreshed
+_snapshot_ts: Dict[str, float] = {"wifi": 0, "lan": 0}
+# A central asked for the running scan via Scan Control: report it in Status
+_scan_report_status = False
+# Session options a central sets via Scan Control, kept per central until it disconnects:
+# "stream" - scan results AP by AP, "framed" - framing.frames() instead of raw chunks,
+# "mtu" - ATT MTU announced by the client, "enc" - wire encoding of read values and
+# notifications (wire.ENCODINGS), "compress" - deflate notifications that span several
+# frames (wire.COMPRESSIONS or None). The defaults are what a legacy client expects.
+SESSION_DEFAULTS: Dict[str, Any] = {"stream": False, "framed": False, "mtu": None, "enc": "json", "compress": None}
+# The options that change the bytes of a notification
+_ENCODING_OPTS = ("framed", "enc", "compress")
+# ATT MTU per connected central, from the "mtu" option of GATT reads/writes
+_mtu: Dict[str, int] = {}
+# What _notify_json_chunks sent: messages, notify packets, bytes, packets deflate saved
+_notify_stats: Dict[str, int] = {"msgs": 0, "packets": 0, "bytes": 0, "deflate_saved_packets": 0}
+# Characteristics a message is being notified on -> messages queued behind it
+_notify_sending: Dict[str, List[Any]] = {}
+_apply_running = False
+# Local metrics socket (see rpi_ble.metrics); empty disables it
+METRICS_SOCK = os.environ.get('RPI_BLE_METRICS_SOCK', '/run/rpi-ble-netcfg/metrics.sock')
+# Network backend: 'auto' (D-Bus if NetworkManager answers, else nmcli), 'dbus' or 'nmcli'
+NET_BACKEND = os.environ.get('RPI_BLE_NET_BACKEND', 'auto')
+# Serve over a local socket instead of BlueZ: a Unix socket path or host:port (see rpi_ble.loopback)
+LOOPBACK = os.environ.get('RPI_BLE_LOOPBACK', '')
+# Connected centrals and the characteristics they get notifications from, by name
+# (gatt.ByteCharacteristic, or loopback.Characteristic with RPI_BLE_LOOPBACK)
+_subs = subscriptions.Registry(SESSION_DEFAULTS)
+# Last options conflict reported in Status: (name, options, centrals left out)
+_options_conflict: Optional[Tuple[Any, ...]] = None
+# What the Device Info subscriber last received (for deltas)
+_devinfo_push: Dict[str, Any] = {"seq": 0, "last": {}, "full_ts": 0}
+# Version of every served value, bumped by _set_state() when it changes.
+# {"boot", key: version} is the ETag a central compares before reading again.
+_versions: Dict[str, int] = {"devinfo": 0, "last_scan": 0, "wifi": 0, "lan": 0, "status": 0}
+_BOOT_ID = int(time.time())
+_versions_push_pending = False
 
 # ==============================
 # Helpers
 # ==============================
 
 
-def _notify_json_chunks(characteristic, obj: Any) -> None:
-    """Отправить JSON чанками через notify, чтобы не упереться в MTU."""
-    payload = json_bytes(obj)
-    for i in range(0, len(payload), WIFI_NOTIFY_CHUNK):
-        chunk = payload[i:i+WIFI_NOTIFY_CHUNK]
-        characteristic.set_value(to_le_list(chunk))
+def _notify_mtu(devices: Set[str]) -> Optional[int]:
+    """ATT MTU every one of `devices` can take: a notification goes to all of them."""
+    known = [_subs.options(d)["mtu"] or _mtu.get(d) for d in devices]
+    known = [m for m in known if m]
+    return min(known) if known else None
+
+
+def _central(options: Dict[str, Any]) -> Optional[str]:
+    """Address of the central a GATT read/write came from."""
+    dev = options.get('device')
+    return _device_addr(str(dev)) if dev else None
+
+
+def _notify_json_chunks(name: str, obj: Any, devices: Optional[Set[str]] = None) -> None:
+    """Отправить JSON (или согласованную кодировку) чанками через notify, чтобы не упереться в MTU.
+
+    One message to every central subscribed to characteristic `name` (or to
+    those of `devices`): it is encoded and chunked once per set of session
+    options among them and every chunk is handed to the transport once.
+    Nothing is encoded if nobody would get it.
+
+    The main loop runs between chunks; a message for the same characteristic
+    produced meanwhile waits for this one, so chunks of two messages never mix.
+    """
+    if _subs.get(name) is None:
+        return
+    waiting = _notify_sending.get(name)
+    if waiting is not None:
+        waiting.append((obj, devices))
+        return
+    _notify_sending[name] = waiting = [(obj, devices)]
+    try:
+        while waiting:
+            characteristic = _subs.get(name)
+            if characteristic is None:
+                break  # the last subscriber left meanwhile
+            msg, only = waiting.pop(0)
+            for opts, group in _subs.groups(name, *_ENCODING_OPTS):
+                if only is not None:
+                    group &= only
+                if group and not _send_chunks(name, characteristic, msg, opts, group):
+                    break
+    finally:
+        del _notify_sending[name]
+
+
+def _send_chunks(name: str, characteristic, obj: Any, opts: Dict[str, Any], devices: Set[str]) -> bool:
+    """Notify `devices` (all subscribers with BlueZ) in encoding `opts`; False if the transport failed."""
+    t0 = time.perf_counter()
+    payload = _encode(obj, opts["enc"])
+    mtu = _notify_mtu(devices)
+    to = devices if _subs.per_device(name) else None
+    if opts["framed"] or opts["enc"] != "json" or opts["compress"]:
+        # binary encodings cannot be reassembled by retrying a parse: always framed
+        mtu = mtu or framing.ATT_MTU_MIN
+        compressed = False
+        if opts["compress"] and len(payload) > framing.chunk_size(mtu):
+            # only worth it when the message takes more than one notification
+            packed = wire.deflate(payload)
+            if len(packed) < len(payload):
+                _notify_stats["deflate_saved_packets"] += (
+                    framing.frame_count(len(payload), mtu) - framing.frame_count(len(packed), mtu))
+                payload, compressed = packed, True
+        chunks = framing.frames(payload, mtu, compressed)
+    else:
+        size = WIFI_NOTIFY_CHUNK if mtu is None else min(WIFI_NOTIFY_CHUNK, framing.chunk_size(mtu))
+        chunks = [payload[i:i+size] for i in range(0, len(payload), size)]
+    _notify_stats["msgs"] += 1
+    _notify_stats["packets"] += len(chunks)
+    _notify_stats["bytes"] += sum(len(c) for c in chunks)
+    for chunk in chunks:
+        try:
+            if to is None:
+                characteristic.set_value(chunk)
+            else:
+                characteristic.set_value(chunk, to)
+        except Exception as e:
+            _subs.drop(name, e)
+            return False
         context = GLib.main_context_default()
         while context and context.pending():
             context.iteration(False)
+    metrics.observe('notify_msg', characteristic.name, (time.perf_counter() - t0) * 1000.0, len(payload))
+    return True
+
+
+def _encode(obj: Any, enc: str = "json") -> bytes:
+    """Value in a wire encoding (JSON unless the client negotiated another)."""
+    if enc == "json":
+        return json_bytes(obj)
+    return wire.encode(obj, enc)
+
+
+def _read_enc(options: Dict[str, Any]) -> str:
+    """Encoding the reading central negotiated."""
+    return _subs.options(_central(options))["enc"]
 
 
-def _push_wifi_scan_result(data: Dict[str, Any]) -> None:
+# Encoded read values, reused while the snapshot object stays the same
+_values = gatt.ValueCache(_encode)
+
+
+def _device_addr(path: str) -> str:
+    """/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF -> AA:BB:CC:DD:EE:FF"""
+    return path.rsplit('/', 1)[-1].replace('dev_', '', 1).replace('_', ':')
+
+
+def _note_mtu(options: Dict[str, Any]) -> None:
+    """Remember the ATT MTU BlueZ reports with a GATT read/write."""
+    mtu, dev = options.get('mtu'), _central(options)
+    if mtu and dev:
+        _mtu[dev] = int(mtu)
+
+
+def _versions_msg() -> Dict[str, Any]:
+    return {"boot": _BOOT_ID, **_versions}
+
+
+def _push_versions() -> bool:
+    global _versions_push_pending
+    _versions_push_pending = False
+    _notify_json_chunks('versions', _versions_msg())
+    return False
+
+
+def _bump(key: str) -> None:
+    global _versions_push_pending
+    _versions[key] += 1
+    if _subs.get('versions') is not None and not _versions_push_pending:
+        # one Versions notification per main loop pass, however many values changed
+        _versions_push_pending = True
+        GLib.idle_add(_push_versions)
+
+
+def _set_state(key: str, value: Any) -> None:
+    """Replace a served snapshot; the version is bumped only if the value changed."""
+    if value == _state.get(key):
+        return
+    _state[key] = value
+    _bump(key)
+
+
+def _push_wifi_scan_result(data: Dict[str, Any], devices: Optional[Set[str]] = None) -> None:
     """Всегда обновляем кэш. Если есть подписчики — пушим чанками."""
-    global _wifi_scan_chr_obj
-    _state["last_scan"] = data
-    if _wifi_scan_chr_obj is not None:
-        _notify_json_chunks(_wifi_scan_chr_obj, data)
+    _set_state("last_scan", data)
+    _notify_json_chunks('scan_result', data, devices)
 
 
-def run(cmd: str) -> subprocess.CompletedProcess:
-    cmd = f'sudo {cmd}'
-    print(f'RUN: {cmd}')
-    return subprocess.run(cmd, shell=True, text=True, capture_output=True, check=False)
+def run(argv: List[str], timeout: float = cmdexec.DEFAULT_TIMEOUT) -> subprocess.CompletedProcess:
+    """Run a tool as root without a shell (see rpi_ble.cmdexec).
+
+    Within a connectivity probe the tool runs in the probes' own slots and
+    is killed at the probe deadline at the latest.
+    """
+    print(f'RUN: {shlex.join(argv)}')
+    t0 = time.perf_counter()
+    left = probes.time_left()
+    if left is None:
+        r = cmdexec.run(argv, timeout)
+    else:
+        r = cmdexec.run(argv, min(timeout, left), pool="probes")
+    metrics.observe('run', os.path.basename(argv[0]), (time.perf_counter() - t0) * 1000.0,
+                    error=r.returncode != 0)
+    return r
 
 
 def json_bytes(obj: Any) -> bytes:
@@ -77,36 +274,31 @@ def parse_json(b: bytes | bytearray | str) -> Any:
     return json.loads(s)
 
 
-def to_le_list(b: bytes | bytearray) -> List[int]:
-    """Bluezero expects list[int] for characteristic values."""
-    return list(b)
-
-
-def from_le_list(v: List[int]) -> bytes:
-    return bytes(v)
-
-
 def _read_uptime() -> tuple[str, int]:
-    pretty = run("uptime -p").stdout.strip() or "up ?"
-    try:
-        secs = int(float(run("cut -d' ' -f1 /proc/uptime").stdout.strip()))
-    except Exception:
-        secs = 0
-    return pretty, secs
+    secs = sysinfo.read_uptime_secs()
+    if secs is None:
+        # uptime(1) читает тот же /proc/uptime: запускать его незачем
+        return "up ?", 0
+    return sysinfo.format_uptime(secs), int(secs)
 
 
 def _read_disk_used_pct() -> float:
     # по корневому разделу
-    s = run("df -P / | tail -1 | awk '{print $5}'").stdout.strip().rstrip('%')
+    pct = sysinfo.read_disk_used_pct("/")
+    if pct is not None:
+        return pct
     try:
-        return float(s)
+        return float(run(["df", "-P", "/"]).stdout.splitlines()[-1].split()[4].rstrip('%'))
     except Exception:
         return 0.0
 
 
 def _read_mem_used_pct() -> float:
     # используем (total - available) / total
-    out = run("free -b").stdout.splitlines()
+    pct = sysinfo.read_mem_used_pct()
+    if pct is not None:
+        return pct
+    out = run(["free", "-b"]).stdout.splitlines()
     total = available = None
     for line in out:
         parts = line.split()
@@ -120,71 +312,57 @@ def _read_mem_used_pct() -> float:
 
 
 def _read_temp_c() -> Optional[float]:
-    # 1) vcgencmd (если доступен)
-    r = run("vcgencmd measure_temp 2>/dev/null")
+    # Порядок обратный исходному (был vcgencmd, потом sysfs): на Pi thermal_zone0 —
+    # тот же датчик SoC (cpu-thermal), что читает vcgencmd, только без процесса на
+    # каждый refresh devinfo; vcgencmd остаётся для систем без thermal_zone0.
+    # 1) sysfs (без процессов)
+    t = sysinfo.read_temp_c()
+    if t is not None:
+        return t
+    # 2) vcgencmd (если доступен)
+    r = run(["vcgencmd", "measure_temp"])
     if r.returncode == 0 and "temp=" in r.stdout:
         try:
             return float(r.stdout.strip().split("=", 1)[1].replace("'C", "").replace("C", ""))
         except Exception:
             pass
-    # 2) sysfs
-    r2 = run("cat /sys/class/thermal/thermal_zone0/temp 2>/dev/null")
-    if r2.stdout.strip().isdigit():
-        try:
-            return int(r2.stdout.strip()) / 1000.0
-        except Exception:
-            pass
     return None
 
 
 def _read_cpu_load1() -> float:
+    load = sysinfo.read_loadavg1()
+    if load is not None:
+        return load
     try:
         # первая колонка /proc/loadavg — loadavg(1m)
-        s = run("cat /proc/loadavg").stdout.strip().split()[0]
+        s = run(["cat", "/proc/loadavg"]).stdout.strip().split()[0]
         return float(s)
     except Exception:
         return 0.0
 
 
-def _read_arch() -> str:
-    return run("uname -m").stdout.strip() or "unknown"
-
-
-def _read_kernel() -> str:
-    return run("uname -r").stdout.strip() or "unknown"
-
-
-def _read_rpi_model() -> Optional[str]:
-    # Для Raspberry Pi модель лежит тут
-    cp = run("cat /proc/device-tree/model 2>/dev/null | tr -d '\\0'")
-    model = cp.stdout.strip()
-    return model or None
-
-
-def _read_pretty_name() -> str:
-    # OS: Debian GNU/Linux 12 (bookworm)
-    out = run(
-        "awk -F= '$1==\"PRETTY_NAME\"{gsub(/\"/,\"\");print $2}' /etc/os-release").stdout.strip()
-    return out or "Linux"
-
 # ==============================
 # Network operations (helpers)
 # ==============================
 
 
 def _get_default_gw() -> Optional[str]:
-    out = run("ip route | awk '/^default/{print $3; exit}'").stdout.strip()
-    return out or None
+    for line in run(["ip", "route", "show", "default"]).stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[0] == "default" and parts[1] == "via":
+            return parts[2]
+    return None
 
 
 def _active_iface_for(dest: str = "1.1.1.1") -> Optional[str]:
-    out = run(
-        f"ip route get {dest} 2>/dev/null | awk '{{for(i=1;i<=NF;i++) if($i==\"dev\"){{print $(i+1); exit}}}}'").stdout.strip()
-    return out or None
+    parts = run(["ip", "route", "get", dest]).stdout.split()
+    if "dev" in parts[:-1]:
+        return parts[parts.index("dev") + 1]
+    return None
 
 
 def _ping(host: str, timeout: float = 1.0) -> tuple[bool, Optional[float]]:
-    r = run(f"ping -c1 -W {int(timeout)} {host}")
+    r = run(["ping", "-c1", "-W", str(int(timeout)), host], timeout=timeout + 2)
     ok = (r.returncode == 0)
     ms = None
     if ok:
@@ -199,13 +377,13 @@ def _ping(host: str, timeout: float = 1.0) -> tuple[bool, Optional[float]]:
 
 
 def _dns_resolve(host: str = "example.com", timeout: float = 2.0) -> bool:
-    r = run(f"timeout {timeout:.0f}s getent hosts {host}")
+    r = run(["getent", "hosts", host], timeout=timeout)
     return r.returncode == 0 and bool(r.stdout.strip())
 
 
 def _http_204(url: str = "https://connectivitycheck.gstatic.com/generate_204", timeout: float = 3.0) -> tuple[bool, Optional[float], Optional[int]]:
-    r = run(
-        f"curl -I -m {int(timeout)} -s -o /dev/null -w '%{{http_code}} %{{time_total}}' {url}")
+    r = run(["curl", "-I", "-m", str(int(timeout)), "-s", "-o", "/dev/null",
+             "-w", "%{http_code} %{time_total}", url], timeout=timeout + 2)
     if r.returncode != 0:
         return False, None, None
     try:
@@ -217,57 +395,77 @@ def _http_204(url: str = "https://connectivitycheck.gstatic.com/generate_204", t
         return False, None, None
 
 
+PUBLIC_IP_URLS = ["https://ifconfig.me/ip", "https://api.ipify.org", "https://checkip.amazonaws.com", "https://icanhazip.com",]
+
+
+def _fetch_public_ip(url: str, timeout: float = 3.0) -> Optional[str]:
+    req = urllib.request.Request(url, headers={"User-Agent": "curl/8.6.0"})
+    left = probes.time_left()
+    with urllib.request.urlopen(req, timeout=timeout if left is None else max(0.1, min(timeout, left))) as resp:
+        return resp.read().decode().strip() or None
+
+
+def _public_ip_probes(timeout: float) -> List[probes.Probe]:
+    return [probes.Probe("public_ip", (lambda u=url: _fetch_public_ip(u, timeout)), url)
+            for url in PUBLIC_IP_URLS]
+
+
 def get_public_ip(timeout: float = 3.0) -> Optional[str]:
-    urls = ["https://ifconfig.me/ip", "https://api.ipify.org", "https://checkip.amazonaws.com", "https://icanhazip.com",]
-    for url in urls:
-        try:
-            req = urllib.request.Request(url, headers={"User-Agent": "curl/8.6.0"})
-            with urllib.request.urlopen(req, timeout=timeout) as resp:
-                ip = resp.read().decode().strip()
-                if ip:
-                    return ip
-        except Exception:
-            continue
+    """Race all lookup services; the first answer wins."""
+    return probes.run_probes(_public_ip_probes(timeout), timeout)["public_ip"]["value"]
 
-    return None
+
+def _gw_probe() -> tuple[Optional[str], bool, Optional[float]]:
+    gw = _get_default_gw()
+    if not gw:
+        return None, False, None
+    return (gw, *_ping(gw, timeout=1.0))
 
 
 def check_internet(force: bool = False) -> Dict[str, Any]:
-    """Комплексная проверка выхода в интернет с кэшем."""
+    """Комплексная проверка выхода в интернет с кэшем.
+
+    All probes run concurrently within NET_CHECK_DEADLINE_SECS; the two ping
+    targets and the public IP services race, first success wins.
+    """
     now = time.time()
     last = _state.get("net") or {"ts": 0, "status": {}}
     if not force and (now - float(last.get("ts", 0))) < NET_CHECK_STALE_SECS:
         return last["status"]
 
-    gw = _get_default_gw()
-    iface = _active_iface_for("1.1.1.1") or _active_iface_for(
-        "8.8.8.8") or _active_iface_for()
-    gw_ok, gw_ms = (False, None)
-    if gw:
-        gw_ok, gw_ms = _ping(gw, timeout=1.0)
+    def _first_ok(r: tuple) -> bool:
+        return bool(r[0])
 
-    ip_ok, ip_ms = _ping("1.1.1.1", timeout=1.0)
-    if not ip_ok:
-        ip_ok, ip_ms = _ping("8.8.8.8", timeout=1.0)
+    res = probes.run_probes([
+        probes.Probe("iface", lambda: _active_iface_for("1.1.1.1") or _active_iface_for(
+            "8.8.8.8") or _active_iface_for()),
+        probes.Probe("gw", _gw_probe, ok=lambda r: r[1]),
+        probes.Probe("ip_ping", lambda: _ping("1.1.1.1", timeout=1.0), "1.1.1.1", _first_ok),
+        probes.Probe("ip_ping", lambda: _ping("8.8.8.8", timeout=1.0), "8.8.8.8", _first_ok),
+        probes.Probe("dns", lambda: _dns_resolve("ya.ru", timeout=2.0)),
+        probes.Probe("http", lambda: _http_204(timeout=3.0), ok=_first_ok),
+        *_public_ip_probes(timeout=3.0),
+    ], timeout=NET_CHECK_DEADLINE_SECS)
 
-    dns_ok = _dns_resolve("ya.ru", timeout=2.0)
-    http_ok, http_s, http_code = _http_204(timeout=3.0)
-    
-    public_ip = get_public_ip(timeout=3.0)
+    gw, gw_ok, gw_ms = res["gw"]["value"] or (None, False, None)
+    ip_ok, ip_ms = res["ip_ping"]["value"] or (False, None)
+    http_ok, http_s, http_code = res["http"]["value"] or (False, None, None)
 
     status = {
-        "iface": iface,
+        "iface": res["iface"]["value"],
         "gw": gw,
         "gw_ping_ok": gw_ok,
         "gw_ping_ms": gw_ms,
         "ip_ping_ok": ip_ok,
         "ip_ping_ms": ip_ms,
-        "dns_ok": dns_ok,
+        "dns_ok": bool(res["dns"]["value"]),
         "http_ok": http_ok,
         "http_code": http_code,
         "http_time_s": http_s,
-        "public_ip": public_ip,
+        "public_ip": res["public_ip"]["value"],
         "online": (ip_ok and http_ok),
+        "probes": {name: {"ok": r["ok"], "ms": r["ms"], "timeout": r["timeout"], "by": r["by"]}
+                   for name, r in res.items()},
     }
 
     _state["net"] = {"ts": now, "status": status}
@@ -278,42 +476,70 @@ def check_internet(force: bool = False) -> Dict[str, Any]:
 # ==============================
 
 
-def read_device_info() -> Dict[str, Any]:
-    hostname = run("hostname -s").stdout.strip()
-    cpu_load = _read_cpu_load1()
-    cpu_temp = _read_temp_c()
-    mem_used = _read_mem_used_pct()
-    disk_used = _read_disk_used_pct()
-    uptime_h, uptime_s = _read_uptime()
+# Static fields (hostname, OS, arch, kernel, model): filled once, dropped on hostname change
+_identity = sysinfo.DeviceIdentity()
+
+
+def _on_hostname_changed(interface: str, changed: Dict[str, Any], invalidated: List[str]) -> None:
+    if "Hostname" in changed or "StaticHostname" in changed or "Hostname" in invalidated:
+        _identity.invalidate()
+
 
-    os_name = _read_pretty_name()
-    arch = _read_arch()
-    kernel = _read_kernel()
-    host_model = _read_rpi_model() or "Unknown"
+def _watch_hostname() -> None:
+    """Invalidate the identity cache when systemd-hostnamed reports a new name."""
+    try:
+        dbus.SystemBus().add_signal_receiver(
+            _on_hostname_changed,
+            dbus_interface='org.freedesktop.DBus.Properties',
+            signal_name='PropertiesChanged',
+            arg0='org.freedesktop.hostname1',
+            path='/org/freedesktop/hostname1',
+        )
+    except dbus.exceptions.DBusException as e:
+        print(f'hostname watch unavailable: {e}')
 
-    net_status = check_internet(force=False)
 
+def read_device_metrics() -> Dict[str, Any]:
+    """Volatile part of Device Info: load, temp, mem, disk, uptime."""
+    cpu_load = _read_cpu_load1()
+    cpu_temp = _read_temp_c()
+    uptime_h, uptime_s = _read_uptime()
     return {
-        "hostname": hostname,
         "cpu_load": round(cpu_load, 2),
         "cpu_temp_c": (round(cpu_temp, 1) if cpu_temp is not None else None),
-        "mem_used_pct": mem_used,
-        "disk_used_pct": disk_used,
+        "mem_used_pct": _read_mem_used_pct(),
+        "disk_used_pct": _read_disk_used_pct(),
         "uptime": uptime_h,
         "uptime_s": uptime_s,
-        "os": f"{os_name} {arch}",
-        "host": host_model,
-        "kernel": kernel,
+    }
+
+
+def read_device_info(net_status: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    ident = _identity.load()
+    dev_metrics = read_device_metrics()
+    if net_status is None:
+        net_status = check_internet(force=False)
+
+    return {
+        "hostname": ident["hostname"],
+        **dev_metrics,
+        "os": ident["os"],
+        "host": ident["host"],
+        "kernel": ident["kernel"],
         "online": net_status.get("online", False),
         "public_ip": net_status.get("public_ip", None),
     }
 
 
+def _nm_field(argv: List[str]) -> str:
+    """Value of the first `KEY:value` line of terse nmcli output."""
+    lines = run(argv).stdout.splitlines()
+    return lines[0].partition(':')[2].strip() if lines else ''
+
+
 def read_wifi_cfg() -> Dict[str, Any]:
-    ip = run(
-        "nmcli -t -f IP4.ADDRESS device show wlan0 | sed 's/IP4.ADDRESS\[1\]:\s*//'").stdout.strip()
-    ssid = run(
-        "nmcli -t -f GENERAL.CONNECTION dev show wlan0 | sed 's/GENERAL.CONNECTION:\s*//'").stdout.strip()
+    ip = _nm_field(["nmcli", "-t", "-f", "IP4.ADDRESS", "device", "show", "wlan0"])
+    ssid = _nm_field(["nmcli", "-t", "-f", "GENERAL.CONNECTION", "dev", "show", "wlan0"])
     return {"ssid": ssid or None, "ip": ip.split('/')[0] if ip else None, "connected": bool(ssid)}
 
 # --- LAN helpers ---
@@ -323,7 +549,7 @@ def list_nm_ifaces(include_wifi: bool = True) -> list[tuple[str, str, str]]:
     """
     Return list of (device, type, state) from nmcli. Filters ethernet and optional wifi.
     """
-    out = run("nmcli -t -f DEVICE,TYPE,STATE device").stdout.strip().splitlines()
+    out = run(["nmcli", "-t", "-f", "DEVICE,TYPE,STATE", "device"]).stdout.strip().splitlines()
     items: list[tuple[str, str, str]] = []
     for line in out:
         if not line:
@@ -346,9 +572,7 @@ def get_primary_eth_iface() -> Optional[str]:
 
 def get_connection_name(dev: str) -> Optional[str]:
     """Return active connection profile bound to device (if any)."""
-    val = run(
-        f"nmcli -t -f GENERAL.CONNECTION dev show {dev} | sed 's/GENERAL.CONNECTION:\s*//'").stdout.strip()
-    return val or None
+    return _nm_field(["nmcli", "-t", "-f", "GENERAL.CONNECTION", "dev", "show", dev]) or None
 
 
 def cidr_to_mask(bits: int) -> str:
@@ -358,26 +582,23 @@ def cidr_to_mask(bits: int) -> str:
 
 def _nm_get(dev: str, key: str) -> list[str]:
     """Return list of values for a given nmcli 'device show' key using -g for robustness."""
-    out = run(f"nmcli -g {key} device show {dev}").stdout
+    out = run(["nmcli", "-g", key, "device", "show", dev]).stdout
     return [line.strip() for line in out.splitlines() if line.strip()]
 
 
 def _con_get(con: str, key: str) -> Optional[str]:
-    out = run(f"nmcli -g {key} connection show '{con}'").stdout.strip()
+    out = run(["nmcli", "-g", key, "connection", "show", con]).stdout.strip()
     return out or None
 
 
-def read_iface_cfg(dev: str) -> Dict[str, Any]:
-    con = get_connection_name(dev)
-    # method comes from the *connection* profile
-    method_raw = _con_get(con, 'ipv4.method') if con else None
+def _iface_cfg(dev: str, method_raw: Optional[str], addr_list: list[str],
+               gw_list: list[str], dns_list: list[str]) -> Dict[str, Any]:
     method = None
     if method_raw:
         method = 'dhcp' if method_raw == 'auto' else (
             'static' if method_raw == 'manual' else method_raw)
 
-    # IP addresses (pick first IPv4)
-    addr_list = _nm_get(dev, 'IP4.ADDRESS')  # e.g. 192.168.31.26/24
+    # IP addresses (pick first IPv4), e.g. 192.168.31.26/24
     ip = None
     mask = None
     if addr_list:
@@ -393,12 +614,8 @@ def read_iface_cfg(dev: str) -> Dict[str, Any]:
             ip = first
 
     # Gateway (single value)
-    gw_list = _nm_get(dev, 'IP4.GATEWAY')
     gw = gw_list[0] if gw_list else None
 
-    # DNS (possibly multiple)
-    dns_list = _nm_get(dev, 'IP4.DNS')
-
     data = {k: v for k, v in {
         'method': method,
         'ip': ip,
@@ -410,8 +627,77 @@ def read_iface_cfg(dev: str) -> Dict[str, Any]:
     return data
 
 
+def read_iface_cfg(dev: str) -> Dict[str, Any]:
+    con = get_connection_name(dev)
+    # method comes from the *connection* profile
+    method_raw = _con_get(con, 'ipv4.method') if con else None
+    return _iface_cfg(dev, method_raw,
+                      _nm_get(dev, 'IP4.ADDRESS'),
+                      _nm_get(dev, 'IP4.GATEWAY'),
+                      _nm_get(dev, 'IP4.DNS'))
+
+
+def _nm_blocks(out: str, first_key: str) -> list[Dict[str, list[str]]]:
+    """Parse multi-record `nmcli -t ... show` output into [{key: [values]}].
+
+    Keys lose their `[n]` index suffix; a new record starts at `first_key`.
+    """
+    blocks: list[Dict[str, list[str]]] = []
+    for line in out.splitlines():
+        key, sep, val = line.partition(':')
+        if not sep:
+            continue
+        key = key.split('[', 1)[0]
+        if key == first_key or not blocks:
+            blocks.append({})
+        val = val.strip()
+        if val and val != '--':
+            blocks[-1].setdefault(key, []).append(val)
+    return blocks
+
+
+def _nm_con_methods(names: list[str]) -> Dict[str, str]:
+    """ipv4.method of every given connection profile in one nmcli call."""
+    if not names:
+        return {}
+    ids = [arg for n in names for arg in ("id", n)]
+    out = run(["nmcli", "-t", "-f", "connection.id,ipv4.method", "connection", "show"] + ids).stdout
+    methods: Dict[str, str] = {}
+    for blk in _nm_blocks(out, 'connection.id'):
+        name = (blk.get('connection.id') or [''])[0]
+        method = (blk.get('ipv4.method') or [''])[0]
+        if name and method:
+            methods[name] = method
+    return methods
+
+
 def read_lan_cfg_all() -> Dict[str, Any]:
-    """Return configs for all LAN-related interfaces (ethernet + wifi)."""
+    """Return configs for all LAN-related interfaces (ethernet + wifi).
+
+    Two nmcli calls in total: every device in one `device show`, every
+    bound profile's ipv4.method in one `connection show`.
+    """
+    out = run(["nmcli", "-t", "-f", "GENERAL.DEVICE,GENERAL.TYPE,GENERAL.CONNECTION,"
+               "IP4.ADDRESS,IP4.GATEWAY,IP4.DNS", "device", "show"]).stdout
+    devices = [blk for blk in _nm_blocks(out, 'GENERAL.DEVICE')
+               if (blk.get('GENERAL.TYPE') or [''])[0] in ('ethernet', 'wifi')
+               and blk.get('GENERAL.DEVICE')]
+    if not devices:
+        return _read_lan_cfg_all_per_iface()
+    cons = [blk['GENERAL.CONNECTION'][0] for blk in devices if blk.get('GENERAL.CONNECTION')]
+    methods = _nm_con_methods(cons)
+    lst = []
+    for blk in devices:
+        con = (blk.get('GENERAL.CONNECTION') or [None])[0]
+        lst.append(_iface_cfg(blk['GENERAL.DEVICE'][0], methods.get(con) if con else None,
+                              blk.get('IP4.ADDRESS', []),
+                              blk.get('IP4.GATEWAY', []),
+                              blk.get('IP4.DNS', [])))
+    return {"ifaces": [x for x in lst if x]}
+
+
+def _read_lan_cfg_all_per_iface() -> Dict[str, Any]:
+    """Fallback: one set of nmcli calls per interface."""
     ifaces = list_nm_ifaces(include_wifi=True)
     lst = [read_iface_cfg(dev) for dev, _typ, _state in ifaces]
     # filter empties
@@ -425,15 +711,33 @@ def read_lan_cfg() -> Dict[str, Any]:
     return read_iface_cfg(dev) if dev else {}
 
 
+def _nm_split(line: str, n: int) -> list[str]:
+    """Split a terse nmcli line into n fields, honouring `\\:` escapes."""
+    fields, cur, esc = [], [], False
+    for ch in line:
+        if esc:
+            cur.append(ch)
+            esc = False
+        elif ch == '\\':
+            esc = True
+        elif ch == ':' and len(fields) < n - 1:
+            fields.append(''.join(cur))
+            cur = []
+        else:
+            cur.append(ch)
+    fields.append(''.join(cur))
+    return (fields + [''] * n)[:n]
+
+
 def scan_wifi() -> Dict[str, Any]:
-    run("nmcli device wifi rescan")
-    lines = run(
-        "nmcli -t -f SSID,SIGNAL,SECURITY device wifi list").stdout.strip().splitlines()
+    # --rescan yes: nmcli waits for the new scan instead of listing the previous one
+    lines = run(["nmcli", "-t", "-f", "SSID,SIGNAL,SECURITY", "device", "wifi", "list", "--rescan", "yes"],
+                timeout=SCAN_TIMEOUT_SECS).stdout.strip().splitlines()
     aps: List[Dict[str, Any]] = []
     for line in lines:
         if not line:
             continue
-        ssid, signal, security = (line.split(':', 2) + ['', ''])[:3]
+        ssid, signal, security = _nm_split(line, 3)
         try:
             sig = int(signal)
         except Exception:
@@ -445,9 +749,7 @@ def scan_wifi() -> Dict[str, Any]:
             "sign": sig,
             "secu": security or "?"
         })
-    data = {"ts": time.time(), "aps": aps}
-    _state["last_scan"] = data
-    return data
+    return {"ts": time.time(), "aps": aps}
 
 
 def apply_wifi(cfg: Dict[str, Any]) -> tuple[bool, Optional[str]]:
@@ -455,9 +757,8 @@ def apply_wifi(cfg: Dict[str, Any]) -> tuple[bool, Optional[str]]:
     psk = cfg.get("psk")
     if not ssid:
         return False, "no_ssid"
-    cmd = f'nmcli dev wifi connect "{ssid}"' + \
-        (f' password "{psk}"' if psk else '') + ' ifname wlan0'
-    r = run(cmd)
+    argv = ["nmcli", "dev", "wifi", "connect", ssid] + (["password", psk] if psk else []) + ["ifname", "wlan0"]
+    r = run(argv, timeout=APPLY_TIMEOUT_SECS)
     ok = (r.returncode == 0)
     return ok, (None if ok else (r.stderr or r.stdout))
 
@@ -473,14 +774,12 @@ def apply_lan(cfg: Dict[str, Any]) -> tuple[bool, Optional[str]]:
         mask = cfg["mask"]
         gw = cfg["gw"]
         dns = " ".join(cfg.get("dns", []))
-        r1 = run(
-            f'nmcli con mod "{con}" '
-            f'ipv4.method manual ipv4.addresses "{ip}/{mask_to_cidr(mask)}" '
-            f'ipv4.gateway "{gw}" ipv4.dns "{dns}"'
-        )
+        r1 = run(["nmcli", "con", "mod", con,
+                  "ipv4.method", "manual", "ipv4.addresses", f"{ip}/{mask_to_cidr(mask)}",
+                  "ipv4.gateway", gw, "ipv4.dns", dns])
     else:
-        r1 = run(f'nmcli con mod "{con}" ipv4.method auto')
-    r2 = run(f'nmcli con up "{con}"')
+        r1 = run(["nmcli", "con", "mod", con, "ipv4.method", "auto"])
+    r2 = run(["nmcli", "con", "up", con], timeout=APPLY_TIMEOUT_SECS)
     ok = (r1.returncode == 0 and r2.returncode == 0)
     return ok, (None if ok else (r1.stderr or r2.stderr or r1.stdout or r2.stdout))
 
@@ -493,187 +792,745 @@ def mask_to_cidr(mask: str) -> int:
 # ==============================
 
 
+def _on_options_conflict(name: str, opts: Dict[str, Any], left_out: Set[str]) -> None:
+    """BlueZ subscribers of `name` negotiated different options: say so in Status, once per conflict."""
+    global _options_conflict
+    conflict = (name, tuple(sorted(opts.items())), frozenset(left_out))
+    if conflict == _options_conflict:
+        return
+    _options_conflict = conflict  # before _set_status: its own notification gets here again
+    shown = ' '.join(f'{k}={v}' for k, v in sorted(opts.items()))
+    _set_status('notify', 'options_conflict', False,
+                f'{name} sent with {shown} (negotiated last); {", ".join(sorted(left_out))} must renegotiate')
+
+
+_subs.on_conflict = _on_options_conflict
+
+
 def _set_status(op: str, stage: str, ok: bool = True, err: Optional[str] = None) -> None:
-    global _status_chr_obj
-    _state["status"] = {"op": op, "stage": stage, "ok": ok, "err": err}
-    # Update value for reads
-    if _status_chr_obj is not None:
-        _status_chr_obj.set_value(to_le_list(json_bytes(_state["status"])))
+    _set_state("status", {"op": op, "stage": stage, "ok": ok, "err": err})
+    # Notify subscribers (reads are served from _state)
+    _notify_json_chunks('status', _state["status"])
+
 
 # ==============================
-# GATT setup with bluezero 0.9 API
+# Network backends
 # ==============================
 
 
-def main() -> None:
-    # Get adapter
-    adapters = list(adapter.Adapter.available())
-    if not adapters:
-        raise RuntimeError('No Bluetooth adapter found')
-    adapter_address = adapters[0].address
+class NmcliBackend:
+    """Network backend built on the nmcli helpers above.
+
+    Interface shared with nmdbus.NMDBusBackend:
+      read_wifi_cfg(), read_lan_cfg_all(), list_ifaces() — blocking reads,
+      safe to call from worker threads;
+      scan(on_done), apply_wifi(cfg, on_done), apply_lan(cfg, on_done) —
+      return at once, on_done(data, err) / on_done(ok, err) runs on the main loop.
+    """
+    name = 'nmcli'
 
-    hostname = run("hostname -s").stdout.strip()
+    def read_wifi_cfg(self) -> Dict[str, Any]:
+        return read_wifi_cfg()
 
-    app = peripheral.Peripheral(
-        adapter_address, local_name=f'rpi-netcfg-{hostname}')
+    def read_lan_cfg_all(self) -> Dict[str, Any]:
+        return read_lan_cfg_all()
 
-    # Create one service
-    app.add_service(srv_id=1, uuid=SVC_UUID, primary=True)
+    def list_ifaces(self, include_wifi: bool = True) -> list[tuple[str, str, str]]:
+        return list_nm_ifaces(include_wifi)
 
-    # ---- Device Info (read, notify) ----
-    def devinfo_read() -> List[int]:
-        return to_le_list(json_bytes(read_device_info()))
+    def scan(self, on_done, on_ap=None) -> None:
+        # nmcli prints the whole list at once; the scan pipeline streams it from the result
+        worker.submit(scan_wifi, on_done=on_done, key='wifi_scan')
+
+    def apply_wifi(self, cfg: Dict[str, Any], on_done) -> None:
+        self._apply(apply_wifi, cfg, on_done)
+
+    def apply_lan(self, cfg: Dict[str, Any], on_done) -> None:
+        self._apply(apply_lan, cfg, on_done)
+
+    @staticmethod
+    def _apply(fn, cfg: Dict[str, Any], on_done) -> None:
+        def _done(res, exc: Optional[BaseException]) -> None:
+            ok, err = res if exc is None else (False, str(exc))
+            on_done(ok, err)
+        worker.submit(fn, cfg, on_done=_done, key='apply')
+
+
+_backend: Any = NmcliBackend()
+
+
+# Signal-driven network state; only with the D-Bus backend
+_netstate: Optional[netstate.NetState] = None
+
+
+def _select_backend() -> None:
+    """Prefer NetworkManager over D-Bus, keep nmcli as the fallback."""
+    global _backend, _netstate
+    if NET_BACKEND in ('auto', 'dbus'):
+        backend = nmdbus.NMDBusBackend.available()
+        if backend is not None:
+            _backend = backend
+            try:
+                _netstate = netstate.NetState(backend)
+                _netstate.start()
+                _netstate.add_listener(_on_netstate_change)
+            except dbus.exceptions.DBusException as e:
+                print(f'network state cache unavailable: {e}')
+                _netstate = None
+    print(f'network backend: {_backend.name}' + (' (signal-driven cache)' if _netstate else ''))
+
+
+def _wifi_cfg() -> Dict[str, Any]:
+    if _netstate is not None:
+        return _state['wifi']  # kept in sync by _on_netstate_change
+    return _snapshot('wifi', _backend.read_wifi_cfg)
+
+
+def _lan_cfg() -> Dict[str, Any]:
+    if _netstate is not None:
+        return _state['lan']
+    return _snapshot('lan', _backend.read_lan_cfg_all)
+
+
+def _on_netstate_change(kind: str) -> None:
+    """NetworkManager changed something: update snapshots and push to subscribers."""
+    if kind == 'aps':
+        _set_state('last_scan', _netstate.scan())
+        return
+    if kind == 'wifi':
+        _set_state('wifi', _netstate.wifi())
+        _notify_json_chunks('wifi_cfg', _state['wifi'])
+    elif kind == 'lan':
+        _set_state('lan', _netstate.lan())
+        _notify_json_chunks('lan_cfg', _state['lan'])
+    _snapshot_ts[kind] = time.time()
+    # connectivity may have changed with it
+    _state['net']['ts'] = 0
+    _devinfo_refresher.kick()
+
+# ==============================
+# Background jobs (see rpi_ble.worker)
+# ==============================
+
+
+def _refresh_snapshot(key: str, reader) -> None:
+    """Re-read the wifi/lan config off the main loop; reads keep the old snapshot meanwhile."""
+    def _done(data: Dict[str, Any], err: Optional[BaseException]) -> None:
+        if err is None:
+            _set_state(key, data)
+            _snapshot_ts[key] = time.time()
+    worker.submit(reader, on_done=_done, key=f'read_{key}')
+
+
+def _snapshot(key: str, reader) -> Dict[str, Any]:
+    if (time.time() - _snapshot_ts[key]) > CFG_STALE_SECS:
+        _refresh_snapshot(key, reader)
+    return _state[key]
+
+
+def _scan_receivers() -> Tuple[Set[str], Set[str]]:
+    """Scan Result subscribers in stream mode, and those that get the whole result."""
+    stream: Set[str] = set()
+    whole: Set[str] = set()
+    for opts, devices in _subs.groups('scan_result', 'stream'):
+        (stream if opts["stream"] else whole).update(devices)
+    return stream, whole
+
+
+def _on_scan_event(kind: str, *args: Any) -> None:
+    """Scan pipeline listener: stream APs to centrals in stream mode, then finish the scan."""
+    global _scan_report_status
+    stream, whole = _scan_receivers()
+    if kind == "ap":
+        if stream:
+            _notify_json_chunks('scan_result', {"ap": args[0]}, stream)
+        return
+    data, err = args
+    report, _scan_report_status = _scan_report_status, False
+    if err is None:
+        _set_state("last_scan", data)
+        if stream:
+            # complete marker; the APs have already been streamed
+            _notify_json_chunks('scan_result', {"done": True, "ts": data["ts"], "n": len(data["aps"])}, stream)
+        if whole:
+            _push_wifi_scan_result(data, whole)
+    elif stream:
+        _notify_json_chunks('scan_result', {"done": True, "ok": False, "err": str(err)}, stream)
+    if report:
+        _set_status('wifi_scan', 'done', err is None, None if err is None else str(err))
+
+
+# One radio scan at a time, shared by every central that asks for it
+_scan_pipeline = scanpipe.ScanPipeline(lambda on_ap, on_done: _backend.scan(on_done, on_ap=on_ap))
+_scan_pipeline.add_listener(_on_scan_event)
+
+
+def _start_wifi_scan(report_status: bool) -> None:
+    """Scan in the background; concurrent requests join the scan already running."""
+    global _scan_report_status
+    if report_status:
+        _scan_report_status = True
+        _set_status('wifi_scan', 'start', True, None)
+    _scan_pipeline.request()
+
+
+def _start_apply(stage: str, op: str, cfg: Dict[str, Any], key: str, reader,
+                 on_done: Optional[Callable[[bool, Optional[str]], None]] = None) -> None:
+    """Run the backend's apply_wifi/apply_lan and report `<stage>_done` in Status.
+
+    The wifi/lan snapshot is re-read before the final status goes out;
+    `on_done(ok, err)` is called right after it.
+    """
+    global _apply_running
+
+    def _reread(data: Dict[str, Any], exc: Optional[BaseException], ok: bool, err: Optional[str]) -> None:
+        global _apply_running
+        if exc is None:
+            _set_state(key, data)
+            _snapshot_ts[key] = time.time()
+        _apply_running = False
+        _set_status('apply', f'{stage}_done', ok, None if ok else err)
+        if on_done is not None:
+            on_done(ok, None if ok else err)
+
+    def _applied(ok: bool, err: Optional[str]) -> None:
+        worker.submit(reader, on_done=lambda data, exc: _reread(data, exc, ok, err))
+
+    if _apply_running:
+        _set_status('apply', stage, False, 'busy')
+        if on_done is not None:
+            on_done(False, 'busy')
+        return
+    _apply_running = True
+    try:
+        getattr(_backend, op)(cfg, _applied)
+    except Exception as e:
+        # a raise here would leave every later apply answered "busy"
+        _apply_running = False
+        _set_status('apply', f'{stage}_done', False, str(e))
+        if on_done is not None:
+            on_done(False, str(e))
+
+
+def _refresh_interval() -> float:
+    if _subs.active('status', 'scan_result', 'devinfo'):
+        return REFRESH_SUBSCRIBED_SECS
+    if _subs.centrals:
+        return REFRESH_CONNECTED_SECS
+    return REFRESH_IDLE_SECS
+
+
+def _devinfo_message(info: Dict[str, Any], force_full: bool = False) -> Optional[Dict[str, Any]]:
+    """Next Device Info notification: {"seq", "full": true, "info"} or {"seq", "delta"}.
+
+    Returns None when nothing changed and no full resync is due.
+    """
+    push = _devinfo_push
+    now = time.time()
+    full = (force_full or not push["last"]
+            or push["seq"] % DEVINFO_FULL_EVERY == 0
+            or (now - push["full_ts"]) > DEVINFO_FULL_SECS)
+    if full:
+        msg: Dict[str, Any] = {"seq": push["seq"] + 1, "full": True, "info": info}
+        push["full_ts"] = now
+    else:
+        delta = {k: v for k, v in info.items() if push["last"].get(k) != v}
+        if not delta:
+            return None
+        msg = {"seq": push["seq"] + 1, "delta": delta}
+    push["seq"] += 1
+    push["last"] = dict(info)
+    return msg
+
+
+def _push_devinfo(info: Dict[str, Any], force_full: bool = False) -> None:
+    if _subs.get('devinfo') is None or not info:
+        return
+    msg = _devinfo_message(info, force_full)
+    if msg is not None:
+        _notify_json_chunks('devinfo', msg)
+
+
+def _on_devinfo(info: Dict[str, Any]) -> None:
+    prev = _state["devinfo"]["info"]
+    # an unchanged snapshot keeps its object (and version): reads stay cache hits
+    _state["devinfo"] = {"ts": time.time(), "info": info if info != prev else prev}
+    if info != prev:
+        _bump("devinfo")
+    _push_devinfo(info)
+
+
+# Keeps Device Info (metrics + cached check_internet) fresh off the main loop
+_devinfo_refresher = refresher.Refresher('devinfo', read_device_info, _on_devinfo, _refresh_interval)
+
+
+def _devinfo_snapshot() -> Dict[str, Any]:
+    """Stale-while-revalidate: always answer from memory, refresh in the background."""
+    snap = _state["devinfo"]
+    if (time.time() - snap["ts"]) > DEVINFO_STALE_SECS:
+        _devinfo_refresher.kick()
+    return snap["info"]
+
+
+def _on_central_connect(adapter_addr: Any, device_addr: Optional[str] = None) -> None:
+    if device_addr is None:
+        # bluezero passes a Device for one that appeared already connected (InterfacesAdded)
+        device_addr = str(adapter_addr.address)
+    _subs.connect(device_addr)
+    _devinfo_refresher.kick()
+
+
+def _on_central_disconnect(adapter_addr: str, device_addr: str) -> None:
+    global _options_conflict
+    if not _subs.disconnect(device_addr):
+        return
+    _options_conflict = None
+    _mtu.pop(device_addr, None)
+    _rpc.forget(device_addr)
+    _devinfo_refresher.reschedule()
+
+
+def _on_interfaces_removed(path: str, interfaces: List[str]) -> None:
+    # a device BlueZ forgot (or bluetoothd going away) sends no "Connected" change
+    if 'org.bluez.Device1' in interfaces:
+        _on_central_disconnect('', _device_addr(str(path)))
+
+
+def _track_centrals(adapter_path: str) -> None:
+    """Centrals already connected to the adapter, and devices removed without a disconnect.
+
+    Either part may fail on its own; without them a subscriber still gets
+    notifications (see subscriptions.UNKNOWN).
+    """
+    try:
+        bus = dbus.SystemBus()
+    except dbus.exceptions.DBusException as e:
+        print(f'device tracking unavailable: {e}')
+        return
+    try:
+        objects = dbus.Interface(bus.get_object('org.bluez', '/'),
+                                 'org.freedesktop.DBus.ObjectManager').GetManagedObjects()
+        for path, ifaces in objects.items():
+            dev = ifaces.get('org.bluez.Device1')
+            if dev and dev.get('Connected') and str(dev.get('Adapter')) == adapter_path:
+                _on_central_connect('', str(dev['Address']))
+    except dbus.exceptions.DBusException as e:
+        print(f'connected centrals unknown: {e}')
+    try:
+        bus.add_signal_receiver(
+            _on_interfaces_removed,
+            dbus_interface='org.freedesktop.DBus.ObjectManager',
+            signal_name='InterfacesRemoved',
+        )
+    except dbus.exceptions.DBusException as e:
+        print(f'device removal tracking unavailable: {e}')
+
+
+def _do_action(cmd: str) -> bool:
+    """Action characteristic commands; False for an unknown one."""
+    if cmd == 'apply':
+        _set_status('apply', 'done', True, None)
+    elif cmd == 'reboot':
+        _set_status('reboot', 'now', True, None)
+        worker.submit(run, ['reboot'])
+    else:
+        return False
+    return True
+
+
+# ==============================
+# RPC characteristic (see rpi_ble.rpc)
+# ==============================
+
+
+def _rpc_send(msg: Any, device: str) -> None:
+    # only the requester; with BlueZ every RPC subscriber gets the Value change anyway
+    to = {device} if device and _subs.per_device('rpc') else None
+    _notify_json_chunks('rpc', msg, to)
+
+
+_rpc = rpc.RpcServer(_rpc_send)
+# scan.start calls waiting for the running scan
+_rpc_scan_waiters: List[rpc.Reply] = []
 
-    app.add_characteristic(
-        srv_id=1, chr_id=1, uuid=UUID(2),
-        value=[], notifying=False,
+
+def _rpc_action(params: Dict[str, Any]) -> Dict[str, Any]:
+    if not _do_action(str(params.get('cmd', '')).lower()):
+        raise rpc.RpcError(rpc.INVALID_PARAMS, "cmd must be 'apply' or 'reboot'")
+    return {"ok": True}
+
+
+def _rpc_scan_start(params: Dict[str, Any], reply: rpc.Reply) -> None:
+    _rpc_scan_waiters.append(reply)
+    try:
+        _start_wifi_scan(report_status=bool(params.get('status', False)))
+    except Exception:
+        # answered with the error by RpcServer: not again on the next scan's done event
+        _rpc_scan_waiters.remove(reply)
+        raise
+
+
+def _on_rpc_scan_event(kind: str, *args: Any) -> None:
+    if kind != "done":
+        return
+    data, err = args
+    waiters = _rpc_scan_waiters[:]
+    _rpc_scan_waiters.clear()
+    for reply in waiters:
+        if err is None:
+            reply(data)
+        else:
+            reply(error=(rpc.FAILED, str(err)))
+
+
+def _rpc_apply_done(reply: rpc.Reply, key: str) -> Callable[[bool, Optional[str]], None]:
+    def done(ok: bool, err: Optional[str]) -> None:
+        if ok:
+            reply(_state[key])  # the re-read config
+        else:
+            reply(error=(rpc.BUSY if err == 'busy' else rpc.FAILED, err or 'failed'))
+    return done
+
+
+def _rpc_wifi_set(params: Dict[str, Any], reply: rpc.Reply) -> None:
+    _set_status('apply', 'wifi_connect', True, None)
+    _start_apply('wifi_connect', 'apply_wifi', params, 'wifi', _backend.read_wifi_cfg,
+                 _rpc_apply_done(reply, 'wifi'))
+
+
+def _rpc_lan_set(params: Dict[str, Any], reply: rpc.Reply) -> None:
+    _set_status('apply', 'lan_config', True, None)
+    _start_apply('lan_config', 'apply_lan', params, 'lan', _backend.read_lan_cfg_all,
+                 _rpc_apply_done(reply, 'lan'))
+
+
+_scan_pipeline.add_listener(_on_rpc_scan_event)
+_rpc.method('devinfo', lambda params: _devinfo_snapshot())
+_rpc.method('status', lambda params: _state['status'])
+_rpc.method('versions', lambda params: _versions_msg())
+_rpc.method('wifi.get', lambda params: _wifi_cfg())
+_rpc.method('lan.get', lambda params: _lan_cfg())
+_rpc.method('scan.get', lambda params: _state['last_scan'])
+_rpc.method('action', _rpc_action)
+_rpc.method('scan.start', _rpc_scan_start, is_async=True)
+_rpc.method('wifi.set', _rpc_wifi_set, is_async=True)
+_rpc.method('lan.set', _rpc_lan_set, is_async=True)
+
+# ==============================
+# GATT service: characteristics and their callbacks, whatever transport serves them
+# ==============================
+
+
+def build_service() -> List[gatt.CharDef]:
+    chars: List[gatt.CharDef] = []
+
+    # ---- Device Info (read, notify) ----
+    def devinfo_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        return _values.get('devinfo', _versions['devinfo'], _devinfo_snapshot(), _read_enc(options))
+
+    def devinfo_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('devinfo', characteristic, notifying)
+        if notifying:
+            # новый подписчик — начинаем с полного снимка
+            _devinfo_push["last"] = {}
+            _push_devinfo(_state["devinfo"]["info"], force_full=True)
+        _devinfo_refresher.reschedule()
+
+    chars.append(gatt.CharDef(
+        chr_id=1, uuid=UUID(2), name='devinfo',
         flags=['read', 'notify'],
+        value=b'',
         read_callback=devinfo_read,
         write_callback=None,
-        notify_callback=None,
-    )
+        notify_callback=devinfo_notify_cb,
+    ))
 
     # ---- WiFi Scan Control (write) ----
-    def scan_write(value: List[int], options: Dict[str, Any]) -> None:
-        cmd = from_le_list(value).decode().strip().lower()
+    def scan_write(value: bytes, options: Dict[str, Any]) -> None:
+        # "start" (full result when done) or {"cmd": "start"|"opts", "stream": true,
+        # "framed": true, "mtu": 247, "enc": "cbor", "compress": "zlib"};
+        # the options stay for the rest of this central's session
+        global _options_conflict
+        _note_mtu(options)
+        dev = _central(options)
+        changes: Dict[str, Any] = {}
+        raw = value.decode().strip()
+        if raw.startswith('{'):
+            try:
+                req = parse_json(raw)
+                mtu = int(req.get('mtu') or 0)
+                if req.get('enc', 'json') not in wire.ENCODINGS:
+                    raise ValueError(f"unknown enc {req['enc']!r}")
+                if req.get('compress') not in (None, *wire.COMPRESSIONS):
+                    raise ValueError(f"unknown compress {req['compress']!r}")
+            except Exception as e:
+                _set_status('wifi_scan', 'start', False, f'bad_json: {e}')
+                return
+            cmd = str(req.get('cmd', '')).lower()
+            if cmd == 'start' or 'stream' in req:
+                changes["stream"] = bool(req.get('stream', False))
+            if 'framed' in req:
+                changes["framed"] = bool(req['framed'])
+            if mtu:
+                changes["mtu"] = max(framing.ATT_MTU_MIN, mtu)
+            if 'enc' in req:
+                changes["enc"] = req['enc']
+            if 'compress' in req:
+                changes["compress"] = req['compress']
+        else:
+            cmd = raw.lower()
+            changes["stream"] = False
+        if dev is not None:
+            _subs.set_options(dev, **changes)
+            _options_conflict = None  # a conflict that remains is reported again
         if cmd == 'start':
-            _set_status('wifi_scan', 'start', True, None)
-            data = scan_wifi()
-
-            def _do_push():
-                _push_wifi_scan_result(data)
-                _set_status('wifi_scan', 'done', True, None)
-                return False
-            GLib.idle_add(_do_push)
-
-    app.add_characteristic(
-        srv_id=1, chr_id=2, uuid=UUID(3),
-        value=[], notifying=False,
+            _start_wifi_scan(report_status=True)
+
+    chars.append(gatt.CharDef(
+        chr_id=2, uuid=UUID(3), name='scan_ctrl',
         flags=['write', 'write-without-response'],
-        write_callback=scan_write,
+        value=b'',
         read_callback=None,
+        write_callback=scan_write,
         notify_callback=None,
-    )
+    ))
 
     # ---- WiFi Scan Result (read, notify) ----
-    def wifi_scan_read() -> List[int]:
-        # Return last_scan cached; caller can trigger a fresh scan via control
+    def wifi_scan_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        # Return last_scan cached; a stale cache is refreshed in the background
+        # (with the signal-driven cache NetworkManager keeps it current itself)
         last = _state.get('last_scan') or {"ts": 0, "aps": []}
-        if not last["aps"] or (time.time() - float(last["ts"])) > WIFI_SCAN_STALE_SECS:
-            last = scan_wifi()
-            _state["last_scan"] = last
-        return to_le_list(json_bytes(last))
-
-    def wifi_scan_notify_cb(notifying: bool, characteristic: peripheral.Characteristic) -> None:
-        global _wifi_scan_chr_obj
-        _wifi_scan_chr_obj = characteristic if notifying else None
-
-    app.add_characteristic(
-        srv_id=1, chr_id=3, uuid=UUID(4),
-        value=to_le_list(json_bytes(_state['last_scan'])), notifying=False,
+        if _netstate is None and (time.time() - float(last["ts"])) > WIFI_SCAN_STALE_SECS:
+            _start_wifi_scan(report_status=False)
+        return _values.get('last_scan', _versions['last_scan'], last, _read_enc(options))
+
+    def wifi_scan_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('scan_result', characteristic, notifying)
+        _devinfo_refresher.reschedule()
+
+    chars.append(gatt.CharDef(
+        chr_id=3, uuid=UUID(4), name='scan_result',
         flags=['read', 'notify'],
+        value=json_bytes(_state['last_scan']),
         read_callback=wifi_scan_read,
         write_callback=None,
         notify_callback=wifi_scan_notify_cb,
-    )
+    ))
 
     # ---- WiFi Config (read, write) ----
-    def wifi_cfg_read() -> List[int]:
-        return to_le_list(json_bytes(read_wifi_cfg()))
+    def wifi_cfg_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        return _values.get('wifi', _versions['wifi'], _wifi_cfg(), _read_enc(options))
+
+    def wifi_cfg_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('wifi_cfg', characteristic, notifying)
 
-    def wifi_cfg_write(value: List[int], options: Dict[str, Any]) -> None:
+    def wifi_cfg_write(value: bytes, options: Dict[str, Any]) -> None:
+        _note_mtu(options)
         try:
-            cfg = parse_json(from_le_list(value))
+            cfg = parse_json(value)
         except Exception as e:
             _set_status('apply', 'wifi_connect', False, f'bad_json: {e}')
             return
         _set_status('apply', 'wifi_connect', True, None)
-        ok, err = apply_wifi(cfg)
-        _set_status('apply', 'wifi_connect_done', ok, None if ok else err)
+        _start_apply('wifi_connect', 'apply_wifi', cfg, 'wifi', _backend.read_wifi_cfg)
 
-    app.add_characteristic(
-        srv_id=1, chr_id=4, uuid=UUID(5),
-        value=[], notifying=False,
-        flags=['read', 'write'],
+    chars.append(gatt.CharDef(
+        chr_id=4, uuid=UUID(5), name='wifi_cfg',
+        flags=['read', 'write', 'notify'],
+        value=b'',
         read_callback=wifi_cfg_read,
         write_callback=wifi_cfg_write,
-        notify_callback=None,
-    )
+        notify_callback=wifi_cfg_notify_cb,
+    ))
 
     # ---- LAN Config (read, write) ----
-    def lan_cfg_read() -> List[int]:
+    def lan_cfg_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
         # возвращаем все интерфейсы (ethernet + wifi)
-        return to_le_list(json_bytes(read_lan_cfg_all()))
+        return _values.get('lan', _versions['lan'], _lan_cfg(), _read_enc(options))
+
+    def lan_cfg_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('lan_cfg', characteristic, notifying)
 
-    def lan_cfg_write(value: List[int], options: Dict[str, Any]) -> None:
+    def lan_cfg_write(value: bytes, options: Dict[str, Any]) -> None:
+        _note_mtu(options)
         try:
-            cfg = parse_json(from_le_list(value))
+            cfg = parse_json(value)
         except Exception as e:
             _set_status('apply', 'lan_config', False, f'bad_json: {e}')
             return
-        # если указан конкретный интерфейс — применяем к нему, иначе к primary ethernet
-        dev = cfg.get('device') or get_primary_eth_iface()
-        con = get_connection_name(dev) if dev else None
-        if not con:
-            con = 'Wired connection 1'
-        # соберём минимальный словарь для apply_lan (он теперь сам найдёт con)
-        ok, err = apply_lan(cfg)
-        _set_status('apply', 'lan_config_done', ok, None if ok else err)
-        if ok:
-            _state['lan'] = read_lan_cfg_all()
-
-    app.add_characteristic(
-        srv_id=1, chr_id=5, uuid=UUID(6),
-        value=to_le_list(json_bytes(read_lan_cfg_all())), notifying=False,
-        flags=['read', 'write'],
+        # если указан конкретный интерфейс — apply_lan применит к нему, иначе к primary ethernet
+        _set_status('apply', 'lan_config', True, None)
+        _start_apply('lan_config', 'apply_lan', cfg, 'lan', _backend.read_lan_cfg_all)
+
+    chars.append(gatt.CharDef(
+        chr_id=5, uuid=UUID(6), name='lan_cfg',
+        flags=['read', 'write', 'notify'],
+        value=json_bytes(_state['lan']),
         read_callback=lan_cfg_read,
         write_callback=lan_cfg_write,
-        notify_callback=None,
-    )
+        notify_callback=lan_cfg_notify_cb,
+    ))
 
     # ---- Action (write) ----
-    def action_write(value: List[int], options: Dict[str, Any]) -> None:
-        import os
-        cmd = from_le_list(value).decode().strip().lower()
-        if cmd == 'apply':
-            _set_status('apply', 'done', True, None)
-        elif cmd == 'reboot':
-            _set_status('reboot', 'now', True, None)
-            run('reboot')
-
-    app.add_characteristic(
-        srv_id=1, chr_id=6, uuid=UUID(7),
-        value=[], notifying=False,
+    def action_write(value: bytes, options: Dict[str, Any]) -> None:
+        _note_mtu(options)
+        _do_action(value.decode().strip().lower())
+
+    chars.append(gatt.CharDef(
+        chr_id=6, uuid=UUID(7), name='action',
         flags=['write', 'write-without-response'],
-        write_callback=action_write,
+        value=b'',
         read_callback=None,
+        write_callback=action_write,
         notify_callback=None,
-    )
+    ))
 
     # ---- Status (read, notify) ----
-    def status_read() -> List[int]:
-        return to_le_list(json_bytes(_state['status']))
+    def status_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        return _values.get('status', _versions['status'], _state['status'], _read_enc(options))
 
-    def status_notify_cb(notifying: bool, characteristic: peripheral.Characteristic) -> None:
-        global _status_chr_obj
-        _status_chr_obj = characteristic if notifying else None
+    def status_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('status', characteristic, notifying)
+        _devinfo_refresher.reschedule()
 
-    app.add_characteristic(
-        srv_id=1, chr_id=7, uuid=UUID(8),
-        value=to_le_list(json_bytes(_state['status'])), notifying=False,
+    chars.append(gatt.CharDef(
+        chr_id=7, uuid=UUID(8), name='status',
         flags=['read', 'notify'],
+        value=json_bytes(_state['status']),
         read_callback=status_read,
         write_callback=None,
         notify_callback=status_notify_cb,
-    )
+    ))
+
+    # ---- Versions (read, notify) ----
+    # {"boot": id, "<value>": version}: a central that holds these versions can skip reading
+    def versions_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        return _encode(_versions_msg(), _read_enc(options))
+
+    def versions_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('versions', characteristic, notifying)
+
+    chars.append(gatt.CharDef(
+        chr_id=8, uuid=UUID(9), name='versions',
+        flags=['read', 'notify'],
+        value=json_bytes(_versions_msg()),
+        read_callback=versions_read,
+        write_callback=None,
+        notify_callback=versions_notify_cb,
+    ))
+
+    # ---- RPC (write, notify) ----
+    # {"id", "method", "params"} (or a list of them) in, {"id", "result"|"error"} out
+    def rpc_write(value: bytes, options: Dict[str, Any]) -> None:
+        _note_mtu(options)
+        _rpc.feed(value, _device_addr(str(options.get('device', ''))))
+
+    def rpc_notify_cb(notifying: bool, characteristic: gatt.ByteCharacteristic) -> None:
+        _subs.set_notifying('rpc', characteristic, notifying)
+
+    chars.append(gatt.CharDef(
+        chr_id=9, uuid=UUID(10), name='rpc',
+        flags=['write', 'write-without-response', 'notify'],
+        value=b'',
+        read_callback=None,
+        write_callback=rpc_write,
+        notify_callback=rpc_notify_cb,
+    ))
+
+    # ---- Metrics (read) ----
+    # counts and latency percentiles per callback / notify / tool (see rpi_ble.metrics)
+    def metrics_read(options: Dict[str, Any]) -> bytes:
+        _note_mtu(options)
+        return _encode(metrics.snapshot(), _read_enc(options))
+
+    chars.append(gatt.CharDef(
+        chr_id=10, uuid=UUID(11), name='metrics',
+        flags=['read'],
+        value=b'',
+        read_callback=metrics_read,
+        write_callback=None,
+        notify_callback=None,
+    ))
+    return chars
+
 
-    # Publish and run GLib main loop
+def _serve_bluez(chars: List[gatt.CharDef]) -> None:
+    """Publish the service on the first Bluetooth adapter; runs the main loop until Ctrl+C."""
+    adapters = list(adapter.Adapter.available())
+    if not adapters:
+        raise RuntimeError('No Bluetooth adapter found')
+    app = peripheral.Peripheral(adapters[0].address, local_name=_identity.local_name)
+    app.on_connect = _on_central_connect
+    app.on_disconnect = _on_central_disconnect
+    _track_centrals(adapters[0].path)
+    app.add_service(srv_id=1, uuid=SVC_UUID, primary=True)
+    for c in chars:
+        gatt.add_characteristic(
+            app, srv_id=1, chr_id=c.chr_id, uuid=c.uuid,
+            value=c.value, notifying=False, flags=c.flags,
+            read_callback=c.read_callback,
+            write_callback=c.write_callback,
+            notify_callback=c.notify_callback,
+            name=c.name,
+        )
+    # bluezero's publish() runs the GLib main loop itself and returns on Ctrl+C
     app.publish()
+
+
+def _serve_loopback(address: str, chars: List[gatt.CharDef]) -> None:
+    """Serve the same characteristics on a local socket (see rpi_ble.loopback), no adapter needed."""
+    server = loopback.Server(address, chars, GLib.idle_add,
+                             on_connect=_on_central_connect, on_disconnect=_on_central_disconnect)
+    server.start()
+    loop = GLib.MainLoop()
     try:
-        GLib.MainLoop().run()
+        loop.run()
     except KeyboardInterrupt:
-        app.unpublish()
+        pass
+    finally:
+        server.close()
+
 
+def main() -> None:
+    _watch_hostname()
+
+    # Prime the snapshots that reads are served from
+    _select_backend()
+    _set_state('wifi', _netstate.wifi() if _netstate else _backend.read_wifi_cfg())
+    _set_state('lan', _netstate.lan() if _netstate else _backend.read_lan_cfg_all())
+    _snapshot_ts['wifi'] = _snapshot_ts['lan'] = time.time()
+    _on_devinfo(read_device_info(net_status={}))
+
+    chars = build_service()
+    metrics.add_source('notify', lambda: dict(_notify_stats))
+    metrics.add_source('value_cache', lambda: {"hits": _values.hits, "misses": _values.misses})
+    metrics.add_source('rpc', lambda: {"calls": _rpc.calls, "inflight": _rpc.inflight})
+    metrics.add_source('subscriptions', _subs.stats)
+    metrics.add_source('scan', _scan_pipeline.stats)
+    metrics.add_source('spawns', lambda: {tool: st["spawns"] for tool, st in cmdexec.stats().items()})
+    metrics_sock = metrics.serve_unix(METRICS_SOCK) if METRICS_SOCK else None
+
+    # everything on the main loop is started before the transport runs it
+    _devinfo_refresher.start()
+    try:
+        if LOOPBACK:
+            _serve_loopback(LOOPBACK, chars)
+        else:
+            _serve_bluez(chars)
+    finally:
+        _devinfo_refresher.stop()
+        if _netstate is not None:
+            _netstate.stop()
+        worker.shutdown()
+        cmdexec.shutdown()
+        if metrics_sock is not None:
+            metrics_sock.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""In-memory network state fed by NetworkManager signals.
+
+NetState loads the Wi-Fi config, LAN config and access point list once
+through an nmdbus.NMDBusBackend and then keeps them current from
+PropertiesChanged, StateChanged, DeviceAdded/Removed and
+AccessPointAdded/Removed signals on the system bus. Only the device or
+access point a signal refers to is re-read. Getters return prebuilt dicts,
+so GATT reads are plain memory lookups.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import dbus
+from gi.repository import GLib
+
+from rpi_ble import nmdbus
+
+# Coalesce signal bursts (activation emits dozens) into one re-read
+DEBOUNCE_MS = 150
+# RSSI wobbles constantly: strength-only changes are published at most this often
+STRENGTH_REFRESH_SECS = 30
+
+Listener = Callable[[str], None]  # called with 'wifi', 'lan' or 'aps'
+
+
+class NetState:
+    def __init__(self, backend: nmdbus.NMDBusBackend, wifi_iface: str = 'wlan0'):
+        self.backend = backend
+        self.bus = backend.bus
+        self.wifi_iface = wifi_iface
+        self._devices: Dict[str, Dict[str, Any]] = {}   # device path -> nmdbus.devices() entry
+        self._lan: Dict[str, Dict[str, Any]] = {}       # device path -> iface cfg
+        self._aps: Dict[str, Dict[str, Any]] = {}       # AP path -> access_point()
+        self._owner: Dict[str, str] = {}                # Ip4Config / active connection path -> device path
+        self._dirty: Set[str] = set()
+        self._dirty_aps: Set[str] = set()
+        self._full_reload = False
+        self._timer: Optional[int] = None
+        self._strength_timer: Optional[int] = None
+        self._listeners: List[Listener] = []
+        self._matches: List[Any] = []
+        self._wifi: Dict[str, Any] = {"ssid": None, "ip": None, "connected": False}
+        self._lan_all: Dict[str, Any] = {"ifaces": []}
+        self._scan: Dict[str, Any] = {"ts": 0, "aps": []}
+
+    # ---- public ----
+
+    def start(self) -> None:
+        self._reload()
+        nm = nmdbus.NM_BUS
+        self._matches = [
+            self.bus.add_signal_receiver(
+                self._on_props, signal_name='PropertiesChanged',
+                dbus_interface=nmdbus.PROPS_IFACE, bus_name=nm, path_keyword='path'),
+            self.bus.add_signal_receiver(
+                self._on_nm_state, signal_name='StateChanged',
+                dbus_interface=nmdbus.NM_IFACE, bus_name=nm, path=nmdbus.NM_PATH),
+            self.bus.add_signal_receiver(
+                self._on_device_list, signal_name='DeviceAdded',
+                dbus_interface=nmdbus.NM_IFACE, bus_name=nm, path=nmdbus.NM_PATH),
+            self.bus.add_signal_receiver(
+                self._on_device_list, signal_name='DeviceRemoved',
+                dbus_interface=nmdbus.NM_IFACE, bus_name=nm, path=nmdbus.NM_PATH),
+            self.bus.add_signal_receiver(
+                self._on_ap_added, signal_name='AccessPointAdded',
+                dbus_interface=nmdbus.NM_WIRELESS_IFACE, bus_name=nm, path_keyword='path'),
+            self.bus.add_signal_receiver(
+                self._on_ap_removed, signal_name='AccessPointRemoved',
+                dbus_interface=nmdbus.NM_WIRELESS_IFACE, bus_name=nm, path_keyword='path'),
+        ]
+
+    def stop(self) -> None:
+        for m in self._matches:
+            m.remove()
+        self._matches = []
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        if self._strength_timer is not None:
+            GLib.source_remove(self._strength_timer)
+            self._strength_timer = None
+
+    def add_listener(self, fn: Listener) -> None:
+        self._listeners.append(fn)
+
+    def wifi(self) -> Dict[str, Any]:
+        return self._wifi
+
+    def lan(self) -> Dict[str, Any]:
+        return self._lan_all
+
+    def scan(self) -> Dict[str, Any]:
+        return self._scan
+
+    # ---- loading ----
+
+    def _reload(self) -> None:
+        self._devices = {d['path']: d for d in self.backend.devices()}
+        self._lan = {}
+        self._owner = {}
+        for path in self._devices:
+            self._load_device(path)
+        self._aps = {}
+        wdev = self._wifi_device()
+        if wdev is not None:
+            for ap in self.backend.access_points(wdev['path']):
+                self._aps[ap['path']] = ap
+        self._rebuild({'wifi', 'lan', 'aps'})
+
+    def _load_device(self, path: str) -> None:
+        dev = self._devices[path]
+        for key in ('ip4', 'active'):
+            if dev[key] and dev[key] != '/':
+                self._owner[dev[key]] = path
+        if dev['type'] in (nmdbus.DEVICE_TYPE_ETHERNET, nmdbus.DEVICE_TYPE_WIFI):
+            self._lan[path] = self.backend.iface_cfg(dev)
+
+    def _reload_device(self, path: str) -> None:
+        try:
+            fresh: Optional[Dict[str, Any]] = self.backend.device_at(path)
+        except dbus.exceptions.DBusException:
+            fresh = None
+        if fresh is None:
+            self._devices.pop(path, None)
+            self._lan.pop(path, None)
+            return
+        old = self._devices.get(path)
+        if old:
+            for key in ('ip4', 'active'):
+                self._owner.pop(old[key], None)
+        self._devices[path] = fresh
+        self._load_device(path)
+
+    def _wifi_device(self) -> Optional[Dict[str, Any]]:
+        for dev in self._devices.values():
+            if dev['iface'] == self.wifi_iface:
+                return dev
+        return None
+
+    def _rebuild(self, kinds: Set[str]) -> None:
+        if 'wifi' in kinds:
+            wdev = self._wifi_device()
+            cfg = self._lan.get(wdev['path'], {}) if wdev else {}
+            ac = self.backend.active_connection(wdev['active']) if wdev else None
+            ssid = ac['id'] if ac else None
+            self._wifi = {"ssid": ssid or None, "ip": cfg.get('ip'), "connected": bool(ssid)}
+        if 'lan' in kinds:
+            self._lan_all = {"ifaces": [cfg for cfg in self._lan.values() if cfg]}
+        if 'aps' in kinds:
+            aps = [{"ssid": ap['ssid'], "sign": ap['sign'], "secu": ap['secu'] or "?"}
+                   for ap in self._aps.values()
+                   if ap['ssid'] and ap['sign'] >= nmdbus.SCAN_MIN_SIGNAL]
+            if aps == self._scan["aps"]:
+                # ts is when the list last changed: an equal list is not a new snapshot
+                kinds = kinds - {'aps'}
+            else:
+                self._scan = {"ts": time.time(), "aps": aps}
+        for fn in self._listeners:
+            for kind in sorted(kinds):
+                fn(kind)
+
+    # ---- signal handling ----
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = GLib.timeout_add(DEBOUNCE_MS, self._flush)
+
+    def _flush(self) -> bool:
+        self._timer = None
+        kinds: Set[str] = set()
+        try:
+            if self._full_reload:
+                self._full_reload = False
+                self._dirty.clear()
+                self._dirty_aps.clear()
+                self._reload()
+                return False
+            for path in self._dirty:
+                self._reload_device(path)
+                kinds.update(('wifi', 'lan'))
+            for path in self._dirty_aps:
+                try:
+                    self._aps[path] = self.backend.access_point(path)
+                except dbus.exceptions.DBusException:
+                    self._aps.pop(path, None)
+                kinds.add('aps')
+        except dbus.exceptions.DBusException as e:
+            print(f'netstate refresh failed: {e}')
+        self._dirty.clear()
+        self._dirty_aps.clear()
+        if kinds:
+            self._rebuild(kinds)
+        return False
+
+    def _on_props(self, interface: str, changed: Dict[str, Any], invalidated: List[str], path: str = '') -> None:
+        path = str(path)
+        if path in self._devices or path in self._owner:
+            self._dirty.add(self._owner.get(path, path))
+        elif path in self._aps:
+            if 'Strength' in changed and len(changed) == 1:
+                # the most frequent signal: no D-Bus round trip needed
+                self._on_strength(self._aps[path], int(changed['Strength']))
+                return
+            self._dirty_aps.add(path)
+        else:
+            return
+        self._schedule()
+
+    def _on_strength(self, ap: Dict[str, Any], sign: int) -> None:
+        """Publish at once only if the AP crosses the list cut-off, otherwise batch."""
+        crossed = (ap['sign'] >= nmdbus.SCAN_MIN_SIGNAL) != (sign >= nmdbus.SCAN_MIN_SIGNAL)
+        ap['sign'] = sign
+        if crossed:
+            self._rebuild({'aps'})
+        elif self._strength_timer is None:
+            self._strength_timer = GLib.timeout_add_seconds(STRENGTH_REFRESH_SECS, self._flush_strength)
+
+    def _flush_strength(self) -> bool:
+        self._strength_timer = None
+        self._rebuild({'aps'})
+        return False
+
+    def _on_nm_state(self, state: int) -> None:
+        self._full_reload = True
+        self._schedule()
+
+    def _on_device_list(self, path: str) -> None:
+        self._full_reload = True
+        self._schedule()
+
+    def _is_wifi_device(self, path: str) -> bool:
+        wdev = self._wifi_device()
+        return wdev is not None and wdev['path'] == str(path)
+
+    def _on_ap_added(self, ap_path: str, path: str = '') -> None:
+        if not self._is_wifi_device(path):
+            return
+        self._dirty_aps.add(str(ap_path))
+        self._schedule()
+
+    def _on_ap_removed(self, ap_path: str, path: str = '') -> None:
+        if not self._is_wifi_device(path):
+            return
+        ap_path = str(ap_path)
+        self._dirty_aps.discard(ap_path)
+        if self._aps.pop(ap_path, None) is not None:
+            self._rebuild({'aps'})
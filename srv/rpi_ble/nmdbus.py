@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""NetworkManager D-Bus network backend.
+
+Reads Device / IP4Config / AccessPoint properties straight from
+NetworkManager and issues RequestScan, AddAndActivateConnection, Update and
+ActivateConnection as asynchronous D-Bus calls, so no nmcli process is
+spawned. Implements the same interface as netcfg.NmcliBackend; `on_done`
+callbacks always run on the GLib main loop.
+"""
+from __future__ import annotations
+
+import ipaddress
+import socket
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import dbus
+import dbus.mainloop.glib
+from gi.repository import GLib
+
+NM_BUS = 'org.freedesktop.NetworkManager'
+NM_PATH = '/org/freedesktop/NetworkManager'
+NM_IFACE = 'org.freedesktop.NetworkManager'
+NM_SETTINGS_PATH = '/org/freedesktop/NetworkManager/Settings'
+NM_SETTINGS_IFACE = 'org.freedesktop.NetworkManager.Settings'
+NM_CONNECTION_IFACE = 'org.freedesktop.NetworkManager.Settings.Connection'
+NM_DEVICE_IFACE = 'org.freedesktop.NetworkManager.Device'
+NM_WIRELESS_IFACE = 'org.freedesktop.NetworkManager.Device.Wireless'
+NM_AP_IFACE = 'org.freedesktop.NetworkManager.AccessPoint'
+NM_IP4_IFACE = 'org.freedesktop.NetworkManager.IP4Config'
+NM_ACTIVE_IFACE = 'org.freedesktop.NetworkManager.Connection.Active'
+PROPS_IFACE = 'org.freedesktop.DBus.Properties'
+
+DEVICE_TYPE_ETHERNET = 1
+DEVICE_TYPE_WIFI = 2
+DEVICE_STATE_ACTIVATED = 100
+ACTIVE_STATE_ACTIVATED = 2
+ACTIVE_STATE_DEACTIVATED = 4
+
+# NM80211ApFlags / NM80211ApSecurityFlags
+AP_FLAGS_PRIVACY = 0x1
+AP_SEC_KEY_MGMT_PSK = 0x100
+AP_SEC_KEY_MGMT_802_1X = 0x200
+AP_SEC_KEY_MGMT_SAE = 0x400
+AP_SEC_KEY_MGMT_OWE = 0x800
+
+SCAN_TIMEOUT_SECS = 15
+ACTIVATE_TIMEOUT_SECS = 45
+SCAN_MIN_SIGNAL = 50
+
+# on_done(ok, err) for applies, on_done(data, err) for scans
+ApplyDone = Callable[[bool, Optional[str]], None]
+ScanDone = Callable[[Optional[Dict[str, Any]], Optional[BaseException]], None]
+
+
+def _later(fn: Callable[..., Any], *args: Any) -> None:
+    """Call fn(*args) once from the main loop."""
+    def _once() -> bool:
+        fn(*args)
+        return False
+    GLib.idle_add(_once)
+
+
+def _ip_to_u32(ip: str) -> int:
+    """NM keeps IPv4 DNS servers as uint32 in network byte order."""
+    return struct.unpack('=I', socket.inet_aton(ip))[0]
+
+
+def _u32_to_ip(n: int) -> str:
+    return socket.inet_ntoa(struct.pack('=I', int(n)))
+
+
+def ap_security(flags: int, wpa_flags: int, rsn_flags: int) -> str:
+    """Security summary in the same words `nmcli -f SECURITY` prints."""
+    out: List[str] = []
+    if (flags & AP_FLAGS_PRIVACY) and not wpa_flags and not rsn_flags:
+        out.append('WEP')
+    if wpa_flags:
+        out.append('WPA1')
+    if rsn_flags & (AP_SEC_KEY_MGMT_PSK | AP_SEC_KEY_MGMT_802_1X):
+        out.append('WPA2')
+    if rsn_flags & AP_SEC_KEY_MGMT_SAE:
+        out.append('WPA3')
+    if rsn_flags & AP_SEC_KEY_MGMT_OWE:
+        out.append('OWE')
+    if (wpa_flags | rsn_flags) & AP_SEC_KEY_MGMT_802_1X:
+        out.append('802.1X')
+    return ' '.join(out)
+
+
+class NMDBusBackend:
+    name = 'dbus'
+
+    def __init__(self, bus: Optional[dbus.Bus] = None):
+        # reads may come from worker threads
+        dbus.mainloop.glib.threads_init()
+        self.bus = bus or dbus.SystemBus()
+        self.nm = dbus.Interface(self.bus.get_object(NM_BUS, NM_PATH), NM_IFACE)
+
+    @classmethod
+    def available(cls) -> Optional['NMDBusBackend']:
+        """Return a backend if NetworkManager answers on the system bus."""
+        try:
+            backend = cls()
+            backend._prop(NM_PATH, NM_IFACE, 'Version')
+            return backend
+        except dbus.exceptions.DBusException as e:
+            print(f'NetworkManager D-Bus backend unavailable: {e}')
+            return None
+
+    # ---- low level ----
+
+    def _obj(self, path: str):
+        return self.bus.get_object(NM_BUS, path)
+
+    def _prop(self, path: str, iface: str, name: str) -> Any:
+        return self._obj(path).Get(iface, name, dbus_interface=PROPS_IFACE)
+
+    def _props(self, path: str, iface: str) -> Dict[str, Any]:
+        return self._obj(path).GetAll(iface, dbus_interface=PROPS_IFACE)
+
+    def device_at(self, path: str) -> Dict[str, Any]:
+        """{path, iface, type, state, active, ip4} of one NM device."""
+        p = self._props(path, NM_DEVICE_IFACE)
+        return {
+            'path': str(path),
+            'iface': str(p.get('Interface', '')),
+            'type': int(p.get('DeviceType', 0)),
+            'state': int(p.get('State', 0)),
+            'active': str(p.get('ActiveConnection', '/')),
+            'ip4': str(p.get('Ip4Config', '/')),
+        }
+
+    def devices(self) -> List[Dict[str, Any]]:
+        return [self.device_at(path) for path in self.nm.GetDevices()]
+
+    def device(self, iface: str) -> Optional[Dict[str, Any]]:
+        for dev in self.devices():
+            if dev['iface'] == iface:
+                return dev
+        return None
+
+    def ip4(self, ip4_path: str) -> Dict[str, Any]:
+        """{addresses: ['a.b.c.d/nn'], gateway, dns: [...]} of an IP4Config."""
+        if not ip4_path or ip4_path == '/':
+            return {'addresses': [], 'gateway': None, 'dns': []}
+        p = self._props(ip4_path, NM_IP4_IFACE)
+        addrs = [f"{a['address']}/{int(a['prefix'])}" for a in p.get('AddressData', [])]
+        if 'NameserverData' in p:
+            dns = [str(d['address']) for d in p['NameserverData']]
+        else:
+            dns = [_u32_to_ip(n) for n in p.get('Nameservers', [])]
+        return {'addresses': addrs, 'gateway': str(p.get('Gateway') or '') or None, 'dns': dns}
+
+    def active_connection(self, active_path: str) -> Optional[Dict[str, Any]]:
+        if not active_path or active_path == '/':
+            return None
+        p = self._props(active_path, NM_ACTIVE_IFACE)
+        return {'id': str(p.get('Id', '')), 'connection': str(p.get('Connection', '/')),
+                'state': int(p.get('State', 0))}
+
+    def connection_settings(self, con_path: str) -> Dict[str, Any]:
+        return dbus.Interface(self._obj(con_path), NM_CONNECTION_IFACE).GetSettings()
+
+    def access_points(self, dev_path: str) -> List[Dict[str, Any]]:
+        wifi = dbus.Interface(self._obj(dev_path), NM_WIRELESS_IFACE)
+        aps = []
+        for ap_path in wifi.GetAllAccessPoints():
+            try:
+                aps.append(self.access_point(ap_path))
+            except dbus.exceptions.DBusException:
+                continue  # AP vanished between the two calls
+        return aps
+
+    def access_point(self, ap_path: str) -> Dict[str, Any]:
+        p = self._props(ap_path, NM_AP_IFACE)
+        return {
+            'path': str(ap_path),
+            'ssid': bytes(bytearray(p.get('Ssid', b''))).decode('utf-8', errors='replace'),
+            'sign': int(p.get('Strength', 0)),
+            'secu': ap_security(int(p.get('Flags', 0)), int(p.get('WpaFlags', 0)), int(p.get('RsnFlags', 0))),
+            'rsn': int(p.get('RsnFlags', 0)),
+        }
+
+    # ---- reads (same shapes as the nmcli helpers in netcfg) ----
+
+    def list_ifaces(self, include_wifi: bool = True) -> list[tuple[str, str, str]]:
+        items = []
+        for dev in self.devices():
+            typ = {DEVICE_TYPE_ETHERNET: 'ethernet', DEVICE_TYPE_WIFI: 'wifi'}.get(dev['type'])
+            if typ == 'ethernet' or (include_wifi and typ == 'wifi'):
+                state = 'connected' if dev['state'] == DEVICE_STATE_ACTIVATED else 'disconnected'
+                items.append((dev['iface'], typ, state))
+        return items
+
+    def read_wifi_cfg(self, iface: str = 'wlan0') -> Dict[str, Any]:
+        dev = self.device(iface)
+        if dev is None:
+            return {"ssid": None, "ip": None, "connected": False}
+        ac = self.active_connection(dev['active'])
+        addrs = self.ip4(dev['ip4'])['addresses']
+        ssid = ac['id'] if ac else None
+        return {"ssid": ssid or None, "ip": addrs[0].split('/')[0] if addrs else None, "connected": bool(ssid)}
+
+    def iface_cfg(self, dev: Dict[str, Any]) -> Dict[str, Any]:
+        ac = self.active_connection(dev['active'])
+        method_raw = None
+        if ac and ac['connection'] != '/':
+            method_raw = str(self.connection_settings(ac['connection']).get('ipv4', {}).get('method', '')) or None
+        method = {'auto': 'dhcp', 'manual': 'static'}.get(method_raw or '', method_raw)
+        ip4 = self.ip4(dev['ip4'])
+        ip = mask = None
+        if ip4['addresses']:
+            iface = ipaddress.IPv4Interface(ip4['addresses'][0])
+            ip, mask = str(iface.ip), str(iface.netmask)
+        data = {k: v for k, v in {
+            'method': method,
+            'ip': ip,
+            'mask': mask,
+            'gw': ip4['gateway'],
+            'dns': ip4['dns'],
+            'device': dev['iface'],
+        }.items() if v not in (None, '', [])}
+        return data
+
+    def read_lan_cfg_all(self) -> Dict[str, Any]:
+        lst = [self.iface_cfg(dev) for dev in self.devices()
+               if dev['type'] in (DEVICE_TYPE_ETHERNET, DEVICE_TYPE_WIFI)]
+        return {"ifaces": [x for x in lst if x]}
+
+    @staticmethod
+    def _scan_entry(ap: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not ap['ssid'] or ap['sign'] < SCAN_MIN_SIGNAL:
+            return None
+        return {"ssid": ap['ssid'], "sign": ap['sign'], "secu": ap['secu'] or "?"}
+
+    def scan_results(self, iface: str = 'wlan0') -> Dict[str, Any]:
+        dev = self.device(iface)
+        aps: List[Dict[str, Any]] = []
+        if dev is not None:
+            for ap in self.access_points(dev['path']):
+                entry = self._scan_entry(ap)
+                if entry is not None:
+                    aps.append(entry)
+        return {"ts": time.time(), "aps": aps}
+
+    # ---- asynchronous operations ----
+
+    def scan(self, on_done: ScanDone, on_ap: Optional[Callable[[Dict[str, Any]], None]] = None,
+             iface: str = 'wlan0') -> None:
+        """RequestScan, then wait for LastScan to change (or time out) and read the APs.
+
+        With `on_ap`, access points NetworkManager adds during the scan are
+        reported as they appear.
+        """
+        state: Dict[str, Any] = {'done': False, 'match': None, 'ap_match': None, 'timer': None}
+        try:
+            dev = self.device(iface)
+        except dbus.exceptions.DBusException as e:
+            # the scan pipeline waits for on_done before it starts another scan
+            _later(on_done, None, e)
+            return
+        if dev is None:
+            _later(on_done, None, RuntimeError(f'no_device: {iface}'))
+            return
+        path = dev['path']
+        try:
+            last_scan = int(self._prop(path, NM_WIRELESS_IFACE, 'LastScan'))
+        except dbus.exceptions.DBusException:
+            last_scan = None  # NM < 1.12: no LastScan, rely on the timeout
+
+        def _finish(err: Optional[BaseException] = None) -> bool:
+            if state['done']:
+                return False
+            state['done'] = True
+            for key in ('match', 'ap_match'):
+                if state[key] is not None:
+                    state[key].remove()
+            if state['timer'] is not None:
+                GLib.source_remove(state['timer'])
+            data = None
+            if err is None:
+                try:
+                    data = self.scan_results(iface)
+                except dbus.exceptions.DBusException as e:
+                    err = e
+            _later(on_done, data, err)
+            return False
+
+        def _changed(interface: str, changed: Dict[str, Any], invalidated: List[str]) -> None:
+            if interface == NM_WIRELESS_IFACE and 'LastScan' in changed and int(changed['LastScan']) != last_scan:
+                _finish()
+
+        def _ap_added(ap_path: str) -> None:
+            try:
+                entry = self._scan_entry(self.access_point(ap_path))
+            except dbus.exceptions.DBusException:
+                return
+            if entry is not None and not state['done']:
+                on_ap(entry)
+
+        def _scan_error(e: dbus.exceptions.DBusException) -> None:
+            # NM refuses a scan while one is already running: just wait for it
+            if 'ScanNotAllowed' not in (e.get_dbus_name() or ''):
+                _finish(e)
+
+        try:
+            state['match'] = self.bus.add_signal_receiver(
+                _changed, signal_name='PropertiesChanged', dbus_interface=PROPS_IFACE,
+                bus_name=NM_BUS, path=path)
+            if on_ap is not None:
+                state['ap_match'] = self.bus.add_signal_receiver(
+                    _ap_added, signal_name='AccessPointAdded', dbus_interface=NM_WIRELESS_IFACE,
+                    bus_name=NM_BUS, path=path)
+            state['timer'] = GLib.timeout_add_seconds(SCAN_TIMEOUT_SECS, _finish)
+            dbus.Interface(self._obj(path), NM_WIRELESS_IFACE).RequestScan(
+                dbus.Dictionary({}, signature='sv'),
+                reply_handler=lambda: None, error_handler=_scan_error)
+        except dbus.exceptions.DBusException as e:
+            _finish(e)
+
+    def _wait_activated(self, active_path: str, on_done: ApplyDone) -> None:
+        state: Dict[str, Any] = {'done': False, 'match': None, 'timer': None}
+
+        def _finish(ok: bool, err: Optional[str]) -> bool:
+            if state['done']:
+                return False
+            state['done'] = True
+            if state['match'] is not None:
+                state['match'].remove()
+            if state['timer'] is not None:
+                GLib.source_remove(state['timer'])
+            on_done(ok, err)
+            return False
+
+        def _state_changed(st: int, reason: int) -> None:
+            if st == ACTIVE_STATE_ACTIVATED:
+                _finish(True, None)
+            elif st == ACTIVE_STATE_DEACTIVATED:
+                _finish(False, f'activation_failed: reason {int(reason)}')
+
+        try:
+            state['match'] = self.bus.add_signal_receiver(
+                _state_changed, signal_name='StateChanged', dbus_interface=NM_ACTIVE_IFACE,
+                bus_name=NM_BUS, path=active_path)
+            state['timer'] = GLib.timeout_add_seconds(
+                ACTIVATE_TIMEOUT_SECS, lambda: _finish(False, 'activation_timeout'))
+            _state_changed(int(self._prop(active_path, NM_ACTIVE_IFACE, 'State')), 0)
+        except dbus.exceptions.DBusException as e:
+            _finish(False, str(e))
+
+    def _find_connection(self, con_id: str) -> Optional[str]:
+        settings = dbus.Interface(self._obj(NM_SETTINGS_PATH), NM_SETTINGS_IFACE)
+        for path in settings.ListConnections():
+            try:
+                con = self.connection_settings(path).get('connection', {})
+            except dbus.exceptions.DBusException:
+                continue
+            if str(con.get('id', '')) == con_id:
+                return str(path)
+        return None
+
+    def apply_wifi(self, cfg: Dict[str, Any], on_done: ApplyDone, iface: str = 'wlan0') -> None:
+        ssid = cfg.get("ssid")
+        psk = cfg.get("psk")
+        if not ssid:
+            _later(on_done, False, "no_ssid")
+            return
+
+        def _err(e: dbus.exceptions.DBusException) -> None:
+            _later(on_done, False, e.get_dbus_message() or str(e))
+
+        def _activated(active_path: str) -> None:
+            self._wait_activated(str(active_path), on_done)
+
+        try:
+            dev = self.device(iface)
+            if dev is None:
+                _later(on_done, False, f"no_device: {iface}")
+                return
+            aps = [ap for ap in self.access_points(dev['path']) if ap['ssid'] == ssid]
+            ap = max(aps, key=lambda a: a['sign']) if aps else None
+            existing = self._find_connection(ssid)
+            specific = ap['path'] if ap else '/'
+            if existing:
+                def _activate() -> None:
+                    # also the reply handler of Update: a raise there would be lost in dbus-python
+                    try:
+                        self.nm.ActivateConnection(existing, dev['path'], specific,
+                                                   reply_handler=_activated, error_handler=_err)
+                    except dbus.exceptions.DBusException as e:
+                        _err(e)
+                if not psk:
+                    _activate()
+                    return
+                settings = self.connection_settings(existing)
+                sec = settings.setdefault('802-11-wireless-security', dbus.Dictionary({}, signature='sv'))
+                sec['psk'] = psk
+                sec.setdefault('key-mgmt', self._key_mgmt(ap))
+                dbus.Interface(self._obj(existing), NM_CONNECTION_IFACE).Update(
+                    settings, reply_handler=_activate, error_handler=_err)
+                return
+
+            con: Dict[str, Any] = {
+                'connection': dbus.Dictionary({'id': ssid, 'type': '802-11-wireless'}, signature='sv'),
+                '802-11-wireless': dbus.Dictionary({'ssid': dbus.ByteArray(ssid.encode()),
+                                                    'mode': 'infrastructure'}, signature='sv'),
+            }
+            if psk:
+                con['802-11-wireless-security'] = dbus.Dictionary(
+                    {'key-mgmt': self._key_mgmt(ap), 'psk': psk}, signature='sv')
+            self.nm.AddAndActivateConnection(
+                dbus.Dictionary(con, signature='sa{sv}'), dev['path'], specific,
+                reply_handler=lambda _con_path, active_path: _activated(active_path),
+                error_handler=_err)
+        except dbus.exceptions.DBusException as e:
+            _err(e)
+
+    @staticmethod
+    def _key_mgmt(ap: Optional[Dict[str, Any]]) -> str:
+        if ap and ap['rsn'] & AP_SEC_KEY_MGMT_SAE and not ap['rsn'] & AP_SEC_KEY_MGMT_PSK:
+            return 'sae'
+        return 'wpa-psk'
+
+    def primary_eth_iface(self) -> Optional[str]:
+        items = self.list_ifaces(include_wifi=False)
+        for dev, _typ, state in items:
+            if state == 'connected':
+                return dev
+        return items[0][0] if items else None
+
+    def apply_lan(self, cfg: Dict[str, Any], on_done: ApplyDone) -> None:
+        try:
+            name = cfg.get('device') or self.primary_eth_iface()
+            dev = self.device(name) if name else None
+            if dev is None:
+                _later(on_done, False, f"no_device: {name}")
+                return
+            ac = self.active_connection(dev['active'])
+            con_path = ac['connection'] if ac else self._find_connection('Wired connection 1')
+            if not con_path or con_path == '/':
+                _later(on_done, False, "no_connection")
+                return
+            settings = self.connection_settings(con_path)
+            ipv4 = settings.setdefault('ipv4', dbus.Dictionary({}, signature='sv'))
+            # deprecated fields would conflict with address-data / route-data
+            for key in ('addresses', 'routes'):
+                ipv4.pop(key, None)
+                settings.get('ipv6', {}).pop(key, None)
+            if cfg.get("method") == "static":
+                prefix = ipaddress.IPv4Network(f'0.0.0.0/{cfg["mask"]}').prefixlen
+                ipv4['method'] = 'manual'
+                ipv4['address-data'] = dbus.Array(
+                    [dbus.Dictionary({'address': cfg["ip"], 'prefix': dbus.UInt32(prefix)}, signature='sv')],
+                    signature='a{sv}')
+                ipv4['gateway'] = cfg["gw"]
+                ipv4['dns'] = dbus.Array([dbus.UInt32(_ip_to_u32(d)) for d in cfg.get("dns", [])],
+                                         signature='u')
+            else:
+                ipv4['method'] = 'auto'
+                ipv4['address-data'] = dbus.Array([], signature='a{sv}')
+                ipv4.pop('gateway', None)
+        except (dbus.exceptions.DBusException, KeyError, ValueError) as e:
+            _later(on_done, False, str(e))
+            return
+
+        def _err(e: dbus.exceptions.DBusException) -> None:
+            _later(on_done, False, e.get_dbus_message() or str(e))
+
+        def _activate() -> None:
+            try:
+                self.nm.ActivateConnection(con_path, dev['path'], '/',
+                                           reply_handler=lambda ap: self._wait_activated(str(ap), on_done),
+                                           error_handler=_err)
+            except dbus.exceptions.DBusException as e:
+                _err(e)
+
+        try:
+            dbus.Interface(self._obj(con_path), NM_CONNECTION_IFACE).Update(
+                settings, reply_handler=_activate, error_handler=_err)
+        except dbus.exceptions.DBusException as e:
+            _err(e)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Concurrent connectivity probes with a shared overall deadline.
+
+Each probe belongs to a group. All probes start at once; probes in the same
+group race each other and the first one to succeed settles the group, the
+rest of that group is no longer waited for. Groups not settled before the
+deadline are reported with ``timeout: True``.
+
+A probe that already runs cannot be cancelled, so probes bound their own
+work by the deadline: time_left() is what remains of it on the probe's
+thread (netcfg.run caps tool timeouts with it).
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from rpi_ble import metrics
+
+MAX_WORKERS = 10
+
+_executor: Optional[ThreadPoolExecutor] = None
+_local = threading.local()
+
+
+class Probe(NamedTuple):
+    group: str
+    fn: Callable[[], Any]
+    label: Optional[str] = None
+    ok: Callable[[Any], bool] = bool
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='netcfg-probe')
+    return _executor
+
+
+def time_left() -> Optional[float]:
+    """Seconds to the deadline of the probe running on this thread; None outside a probe."""
+    deadline = getattr(_local, 'deadline', None)
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _call(fn: Callable[[], Any], deadline: float) -> Any:
+    _local.deadline = deadline
+    try:
+        return fn()
+    finally:
+        _local.deadline = None
+
+
+def run_probes(probes: List[Probe], timeout: float) -> Dict[str, Dict[str, Any]]:
+    """Run all probes concurrently and return {group: result}.
+
+    A result holds ``ok``, ``value`` (of the winning probe, or the last
+    failure), ``ms`` (time until the group settled), ``timeout`` and ``by``
+    (label of the winning probe).
+    """
+    t0 = time.monotonic()
+    deadline = t0 + timeout
+    results: Dict[str, Dict[str, Any]] = {}
+    left: Dict[str, int] = {}
+    futs: Dict[Future, Probe] = {}
+    for p in probes:
+        results.setdefault(p.group, {"ok": False, "value": None, "ms": None, "timeout": False, "by": None})
+        left[p.group] = left.get(p.group, 0) + 1
+        futs[_get_executor().submit(_call, p.fn, deadline)] = p
+
+    pending = set(futs)
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        now_ms = round((time.monotonic() - t0) * 1000.0, 1)
+        for f in done:
+            p = futs[f]
+            res = results[p.group]
+            left[p.group] -= 1
+            if res["ok"] or f.cancelled():
+                continue
+            try:
+                val = f.result()
+                ok = bool(p.ok(val))
+            except Exception:
+                val, ok = None, False
+            metrics.observe('probe', p.group, now_ms, error=not ok)
+            if ok:
+                res.update(ok=True, value=val, ms=now_ms, by=p.label)
+                # первый успешный — остальных в группе больше не ждём
+                for other in list(pending):
+                    if futs[other].group == p.group:
+                        other.cancel()
+                        pending.discard(other)
+            else:
+                res["value"] = val
+                if left[p.group] == 0:
+                    res["ms"] = now_ms
+
+    for f in pending:
+        f.cancel()
+        res = results[futs[f].group]
+        if not res["ok"]:
+            res["timeout"] = True
+            res["ms"] = round(timeout * 1000.0, 1)
+            metrics.observe('probe', futs[f].group, res["ms"], error=True)
+    return results
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Periodic background refresh with stale-while-revalidate semantics.
+
+A Refresher runs its job on the worker pool, hands the result to
+`on_result` on the GLib main loop, then re-arms itself with a GLib timeout.
+The delay is asked from `interval()` every time, so the cadence can follow
+the BLE side (idle / connected / subscribed). Readers keep serving the last
+result and call `kick()` when they find it stale.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Optional
+
+from gi.repository import GLib
+
+from rpi_ble import worker
+
+
+class Refresher:
+    def __init__(self, name: str, job: Callable[[], Any],
+                 on_result: Callable[[Any], None],
+                 interval: Callable[[], float]):
+        self.name = name
+        self._job = job
+        self._on_result = on_result
+        self._interval = interval
+        self._source: Optional[int] = None
+        self._running = False
+
+    def start(self) -> None:
+        self._running = True
+        self._schedule(0)
+
+    def stop(self) -> None:
+        self._running = False
+        self._cancel_timer()
+
+    def kick(self) -> None:
+        """Refresh now unless a refresh is already in flight."""
+        if self._running and not worker.busy(self._key):
+            self._schedule(0)
+
+    def reschedule(self) -> None:
+        """Re-arm the timer after the cadence changed."""
+        if self._running and self._source is not None:
+            self._schedule(self._interval())
+
+    @property
+    def _key(self) -> str:
+        return f'refresh_{self.name}'
+
+    def _cancel_timer(self) -> None:
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def _schedule(self, delay: float) -> None:
+        self._cancel_timer()
+        self._source = GLib.timeout_add(max(0, int(delay * 1000)), self._tick)
+
+    def _tick(self) -> bool:
+        self._source = None
+        # if the previous run is still going this is a no-op; its completion re-arms the timer
+        worker.submit(self._job, on_done=self._done, key=self._key)
+        return False
+
+    def _done(self, result: Any, err: Optional[BaseException]) -> None:
+        if err is None:
+            self._on_result(result)
+        if self._running and self._source is None:
+            self._schedule(self._interval())
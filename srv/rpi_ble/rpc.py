@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Request/response RPC over one write + notify characteristic.
+
+A central writes {"id", "method", "params"} envelopes, or a list of them
+(a batch), as JSON or CBOR. Long requests may be split into frames
+(framing.frames); a write whose first byte is a frame flag byte (< 0x08)
+is reassembled per central, anything else is one complete request.
+
+Every request gets {"id", "result"} or {"id", "error": {"code", "message"}}
+back through `send(msg, device)`, addressed to the central that sent it:
+ids are chosen by each client, so two centrals may well both use 1. Requests do not wait for each other: synchronous
+methods answer at once (the answers of a batch go out together, as one
+list), asynchronous ones whenever they finish, so several requests can be
+in flight on one connection. Error codes follow JSON-RPC 2.0.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional
+
+from rpi_ble import framing, wire
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# application errors
+BUSY = 1
+FAILED = 2
+
+Reply = Callable[..., None]  # reply(result) or reply(error=(code, message))
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class RpcServer:
+    def __init__(self, send: Callable[[Any, str], None]):
+        self._send = send
+        self._methods: Dict[str, Callable[..., Any]] = {}
+        self._async: Dict[str, bool] = {}
+        self._frames: Dict[str, framing.Reassembler] = {}
+        self.inflight = 0
+        self.calls = 0
+
+    def method(self, name: str, fn: Callable[..., Any], is_async: bool = False) -> None:
+        """fn(params) returns the result; with is_async fn(params, reply) answers later."""
+        self._methods[name] = fn
+        self._async[name] = is_async
+
+    def forget(self, device: str) -> None:
+        self._frames.pop(device, None)
+
+    def feed(self, data: bytes, device: str = '') -> None:
+        """One GATT write: a complete request or a frame of one."""
+        if data and data[0] < 0x08:
+            asm = self._frames.setdefault(device, framing.Reassembler(wire.inflate))
+            msg = asm.feed(data)
+            if msg is None:
+                return
+            data = msg
+        self.handle(data, device)
+
+    def handle(self, data: bytes, device: str = '') -> None:
+        try:
+            req = wire.decode(data)
+        except Exception as e:
+            self._send({"id": None, "error": {"code": PARSE_ERROR, "message": str(e)}}, device)
+            return
+        if isinstance(req, list):
+            batch: List[Dict[str, Any]] = []
+            for env in req:
+                self._dispatch(env, batch, device)
+            if batch:
+                self._send(batch, device)
+        else:
+            self._dispatch(req, None, device)
+
+    def _dispatch(self, env: Any, batch: Optional[List[Dict[str, Any]]], device: str) -> None:
+        self.calls += 1
+        rid = env.get("id") if isinstance(env, dict) else None
+        state = {"sync": True}
+
+        def reply(result: Any = None, error: Optional[tuple] = None) -> None:
+            msg: Dict[str, Any] = {"id": rid}
+            if error is not None:
+                msg["error"] = {"code": error[0], "message": error[1]}
+            else:
+                msg["result"] = result
+            if state["sync"] and batch is not None:
+                batch.append(msg)
+            else:
+                if not state["sync"]:
+                    self.inflight -= 1
+                self._send(msg, device)
+
+        if not isinstance(env, dict) or not isinstance(env.get("method"), str):
+            reply(error=(INVALID_REQUEST, "expected {id, method, params}"))
+            return
+        name = env["method"]
+        params = env.get("params") or {}
+        fn = self._methods.get(name)
+        if fn is None:
+            reply(error=(METHOD_NOT_FOUND, f"unknown method {name!r}"))
+            return
+        if not isinstance(params, dict):
+            reply(error=(INVALID_PARAMS, "params must be an object"))
+            return
+        try:
+            if self._async[name]:
+                answered: List[bool] = []
+
+                def later(result: Any = None, error: Optional[tuple] = None) -> None:
+                    answered.append(True)
+                    reply(result, error)
+                fn(params, later)
+                if not answered:
+                    # still running: the answer goes out on its own
+                    state["sync"] = False
+                    self.inflight += 1
+            else:
+                reply(fn(params))
+        except RpcError as e:
+            reply(error=(e.code, str(e)))
+        except Exception as e:
+            reply(error=(INTERNAL_ERROR, f"{type(e).__name__}: {e}"))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wi-Fi scan pipeline: one radio scan, streamed to every listener.
+
+`request()` starts a scan through the network backend unless one is already
+running, in which case the caller just joins it. Access points are handed
+to listeners as they are seen (("ap", ap) events), then every AP of the
+final result that was not streamed yet, then a ("done", data, err) event.
+A network (SSID + security) is streamed once per scan, as first seen:
+another AP of the same mesh, or the same AP with a new RSSI, is not
+repeated.
+All events are delivered on the GLib main loop.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# start(on_ap, on_done): on_ap(ap) per access point, on_done(data, err) once
+StartScan = Callable[[Callable[[Dict[str, Any]], None],
+                      Callable[[Optional[Dict[str, Any]], Optional[BaseException]], None]], None]
+Listener = Callable[..., None]
+
+
+class ScanPipeline:
+    def __init__(self, start: StartScan):
+        self._start = start
+        self._listeners: List[Listener] = []
+        self._running = False
+        self._seen: Set[Tuple[str, str]] = set()  # (ssid, secu)
+        self.joined = 0  # requests coalesced into the running scan
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._running, "joined": self.joined}
+
+    def add_listener(self, fn: Listener) -> None:
+        self._listeners.append(fn)
+
+    def request(self) -> bool:
+        """Start a scan; returns False if the request joined the running one."""
+        if self._running:
+            self.joined += 1
+            return False
+        self._running = True
+        self._seen = set()
+        try:
+            self._start(self._on_ap, self._on_done)
+        except Exception:
+            # no on_done would ever come: do not block every later scan
+            self._running = False
+            raise
+        return True
+
+    def _emit(self, *event: Any) -> None:
+        for fn in list(self._listeners):
+            fn(*event)
+
+    def _on_ap(self, ap: Dict[str, Any]) -> None:
+        key = (ap.get("ssid", ""), ap.get("secu", ""))
+        if not self._running or key in self._seen:
+            return
+        self._seen.add(key)
+        self._emit("ap", ap)
+
+    def _on_done(self, data: Optional[Dict[str, Any]], err: Optional[BaseException]) -> None:
+        if data is not None:
+            for ap in data.get("aps", []):
+                self._on_ap(ap)
+        self._running = False
+        self._emit("done", data, err)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Which connected centrals get which notifications.
+
+Several centrals may be connected at once (a phone and a monitoring host,
+two technicians). BlueZ aggregates their Client Characteristic
+Configuration writes: StartNotify comes with the first central that
+subscribes, StopNotify after the last one, and one Value change goes out
+to every subscribed central. The registry keeps, per characteristic name,
+the object to notify through while notifications are on, and the set of
+connected centrals:
+
+- centrals come and go with BlueZ Device1 "Connected" changes (on_connect /
+  on_disconnect), a device removed without a disconnect (InterfacesRemoved)
+  counts as disconnected;
+- a transport that knows exactly who subscribed (rpi_ble.loopback, its
+  characteristics have `devices`) reports it, with BlueZ every connected
+  central counts as a subscriber once notifications are on. If no central
+  is known (device tracking failed, or it connected before the daemon
+  started), a BlueZ characteristic with notifications on still has one
+  subscriber, UNKNOWN: StartNotify came from somebody;
+- get(name) is None while nobody connected would receive the message, so
+  nothing is encoded for nobody; a characteristic whose notification
+  raised is dropped until the transport turns notifications on again;
+- every central has its own session options (encoding, framing...), the
+  defaults until it negotiates others and again after it disconnects.
+  groups() splits the subscribers of a characteristic by them; with BlueZ
+  all subscribers get the same Value change, so when they disagree the
+  options negotiated last are used for all of them and on_conflict(name,
+  options, devices) is told which centrals did not get what they asked for.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# Address of a BlueZ subscriber whose connection was never seen
+UNKNOWN = '?'
+
+
+class Registry:
+    def __init__(self, default_options: Optional[Dict[str, Any]] = None) -> None:
+        self._chars: Dict[str, Any] = {}  # name -> characteristic, while notifications are on
+        self.centrals: Set[str] = set()
+        self.dropped = 0
+        self.default_options: Dict[str, Any] = dict(default_options or {})
+        self._options: Dict[str, Dict[str, Any]] = {}  # device -> options it negotiated, oldest first
+        self.on_conflict: Optional[Callable[[str, Dict[str, Any], Set[str]], None]] = None
+
+    def set_notifying(self, name: str, characteristic: Any, notifying: bool) -> None:
+        """notify_callback of the transport: first subscriber came / last one left."""
+        if notifying:
+            self._chars[name] = characteristic
+        elif self._chars.get(name) is characteristic:
+            del self._chars[name]
+
+    def connect(self, device: str) -> None:
+        self.centrals.add(device)
+
+    def disconnect(self, device: str) -> bool:
+        """False if the device was not connected (a repeated signal)."""
+        self._options.pop(device, None)
+        if device not in self.centrals:
+            return False
+        self.centrals.discard(device)
+        return True
+
+    def devices(self, name: str) -> Set[str]:
+        """Connected centrals subscribed to `name`."""
+        characteristic = self._chars.get(name)
+        if characteristic is None:
+            return set()
+        known = getattr(characteristic, 'devices', None)
+        if known is not None:
+            return set(known)
+        return set(self.centrals) or {UNKNOWN}
+
+    def options(self, device: Optional[str]) -> Dict[str, Any]:
+        """Session options of a central (the defaults until it negotiated any)."""
+        return self._options.get(device, self.default_options) if device else self.default_options
+
+    def set_options(self, device: str, **changes: Any) -> None:
+        opts = {**self.options(device), **changes}
+        self._options.pop(device, None)  # now the latest negotiation
+        self._options[device] = opts
+
+    def per_device(self, name: str) -> bool:
+        """The transport can notify single centrals (loopback); BlueZ notifies all subscribers at once."""
+        return getattr(self._chars.get(name), 'devices', None) is not None
+
+    def groups(self, name: str, *keys: str) -> List[Tuple[Dict[str, Any], Set[str]]]:
+        """Subscribers of `name` by their options `keys`: [(options, devices)]."""
+        by: Dict[Tuple[Any, ...], Tuple[Dict[str, Any], Set[str]]] = {}
+        for device in self.devices(name):
+            opts = {key: self.options(device).get(key) for key in keys}
+            by.setdefault(tuple(opts.values()), (opts, set()))[1].add(device)
+        if len(by) > 1 and not self.per_device(name):
+            # one Value change for everybody: the latest negotiation wins, the others are told
+            everyone = set().union(*(devices for _, devices in by.values()))
+            latest = [d for d in self._options if d in everyone][-1]
+            opts = {key: self.options(latest).get(key) for key in keys}
+            if self.on_conflict is not None:
+                self.on_conflict(name, opts, {d for d in everyone if d not in by[tuple(opts.values())][1]})
+            return [(opts, everyone)]
+        return list(by.values())
+
+    def get(self, name: str) -> Optional[Any]:
+        """The characteristic to notify through, or None if no connected central would get it."""
+        characteristic = self._chars.get(name)
+        if characteristic is None or not self.devices(name):
+            return None
+        return characteristic
+
+    def active(self, *names: str) -> bool:
+        return any(self.get(n) is not None for n in names)
+
+    def drop(self, name: str, error: Exception) -> None:
+        """Notifying raised: stop using the characteristic until notifications are turned on again."""
+        if self._chars.pop(name, None) is not None:
+            self.dropped += 1
+            print(f'notify {name}: {error}; subscription dropped')
+
+    def stats(self) -> Dict[str, Any]:
+        return {"centrals": len(self.centrals), "dropped": self.dropped, "negotiated": len(self._options),
+                "subscribed": {n: len(self.devices(n)) for n in sorted(self._chars)}}
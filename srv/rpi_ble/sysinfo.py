@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""In-process readers for /proc, sysfs and /etc used by Device Info.
+
+Every reader returns ``None`` when its source file is missing so the caller
+can fall back to the old subprocess path.
+"""
+from __future__ import annotations
+
+import math
+import os
+import socket
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Roots are module-level so a fake tree can be swapped in.
+PROC_ROOT = "/proc"
+SYS_ROOT = "/sys"
+OS_RELEASE = "/etc/os-release"
+THERMAL_ZONE = "class/thermal/thermal_zone0/temp"
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8", errors="replace")
+    except OSError:
+        return None
+
+
+def read_loadavg1() -> Optional[float]:
+    """loadavg(1m): first column of /proc/loadavg."""
+    s = _read_text(os.path.join(PROC_ROOT, "loadavg"))
+    if not s:
+        return None
+    try:
+        return float(s.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_meminfo() -> Dict[str, int]:
+    """Return /proc/meminfo as {key: bytes}; empty dict if unavailable."""
+    s = _read_text(os.path.join(PROC_ROOT, "meminfo"))
+    info: Dict[str, int] = {}
+    if not s:
+        return info
+    for line in s.splitlines():
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if not parts:
+            continue
+        try:
+            val = int(parts[0])
+        except ValueError:
+            continue
+        if len(parts) > 1 and parts[1] == "kB":
+            val *= 1024
+        info[key.strip()] = val
+    return info
+
+
+def read_mem_used_pct() -> Optional[float]:
+    """(MemTotal - MemAvailable) / MemTotal, same as `free` computes it."""
+    info = read_meminfo()
+    total = info.get("MemTotal")
+    available = info.get("MemAvailable")
+    if not total or available is None:
+        return None
+    return round((total - available) * 100.0 / total, 1)
+
+
+def read_uptime_secs() -> Optional[float]:
+    s = _read_text(os.path.join(PROC_ROOT, "uptime"))
+    if not s:
+        return None
+    try:
+        return float(s.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def format_uptime(secs: float) -> str:
+    """Format seconds the way `uptime -p` does: 'up 2 days, 3 hours, 4 minutes'."""
+    mins_total = int(secs) // 60
+    weeks, rem = divmod(mins_total, 7 * 24 * 60)
+    days, rem = divmod(rem, 24 * 60)
+    hours, minutes = divmod(rem, 60)
+    parts = []
+    for n, unit in ((weeks, "week"), (days, "day"), (hours, "hour"), (minutes, "minute")):
+        if n:
+            parts.append(f"{n} {unit}{'' if n == 1 else 's'}")
+    if not parts:
+        parts.append("0 minutes")
+    return "up " + ", ".join(parts)
+
+
+def read_temp_c() -> Optional[float]:
+    s = _read_text(os.path.join(SYS_ROOT, THERMAL_ZONE))
+    if not s or not s.strip().lstrip("-").isdigit():
+        return None
+    return int(s.strip()) / 1000.0
+
+
+def read_disk_used_pct(path: str = "/") -> Optional[float]:
+    """Use% of the filesystem holding `path`, rounded up like `df -P`."""
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return None
+    used = st.f_blocks - st.f_bfree
+    avail = st.f_bavail
+    if used + avail <= 0:
+        return None
+    return float(math.ceil(used * 100.0 / (used + avail)))
+
+
+def read_arch() -> str:
+    return os.uname().machine or "unknown"
+
+
+def read_kernel() -> str:
+    return os.uname().release or "unknown"
+
+
+def read_hostname() -> str:
+    """Short host name, same as `hostname -s`."""
+    return socket.gethostname().split(".", 1)[0]
+
+
+def read_rpi_model() -> Optional[str]:
+    s = _read_text(os.path.join(PROC_ROOT, "device-tree/model"))
+    if s is None:
+        return None
+    return s.replace("\0", "").strip() or None
+
+
+def read_os_release() -> Dict[str, str]:
+    s = _read_text(OS_RELEASE)
+    out: Dict[str, str] = {}
+    if not s:
+        return out
+    for line in s.splitlines():
+        key, sep, val = line.partition("=")
+        if not sep or key.startswith("#"):
+            continue
+        out[key.strip()] = val.strip().strip('"').strip("'")
+    return out
+
+
+def read_pretty_name() -> Optional[str]:
+    return read_os_release().get("PRETTY_NAME") or None
+
+
+def load_identity() -> Dict[str, Any]:
+    """Fields of Device Info that stay the same for the life of the process."""
+    return {
+        "hostname": read_hostname(),
+        "os": f"{read_pretty_name() or 'Linux'} {read_arch()}",
+        "host": read_rpi_model() or "Unknown",
+        "kernel": read_kernel(),
+    }
+
+
+class DeviceIdentity:
+    """Lazily filled cache of the static Device Info fields.
+
+    Values are loaded once, on first access or via `load()` at startup, and
+    only reloaded after an explicit `invalidate()` (e.g. hostname change).
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, Any]] = load_identity):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._fields: Optional[Dict[str, Any]] = None
+
+    def load(self) -> Dict[str, Any]:
+        fields = self._fields
+        if fields is None:
+            with self._lock:
+                if self._fields is None:
+                    self._fields = self._loader()
+                fields = self._fields
+        return fields
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fields = None
+
+    @property
+    def hostname(self) -> str:
+        return self.load()["hostname"]
+
+    @property
+    def local_name(self) -> str:
+        """BLE advertising name."""
+        return f"rpi-netcfg-{self.hostname}"
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wire encodings for GATT values: JSON (default), CBOR and packed scan.
+
+"cbor" is RFC 8949 for the types our payloads use (dict, list, str, int,
+float, bool, None); the encoder is built in so the Debian package needs
+no extra dependency. "packed" lays a scan result out as
+
+    u8 0x53 ('S'), u32 ts
+    u8 n_ssids, n_ssids x (u8 len, utf-8 ssid)    -- SSID dictionary
+    u8 n_aps,   n_aps x (u8 ssid index, u8 signal, u8 security bits)
+
+and falls back to CBOR for anything else (or a scan it cannot represent).
+The first byte tells the formats apart: '{' JSON, 0xA0-0xBF CBOR map,
+0x53 packed scan.
+
+Any of them can additionally be deflated ("compress": "zlib"): raw deflate
+with ZDICT as the preset dictionary, flagged per message by the framing
+layer (framing.FLAG_COMPRESSED).
+"""
+from __future__ import annotations
+
+import json
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+ENCODINGS = ('json', 'cbor', 'packed')
+
+PACKED_SCAN = 0x53
+# Bit order matches the token order nmcli / nmdbus.ap_security() print
+SECURITY_BITS = ('WEP', 'WPA1', 'WPA2', 'WPA3', 'OWE', '802.1X')
+
+COMPRESSIONS = ('zlib',)
+
+# Preset deflate dictionary: fragments of read_lan_cfg_all() and scan_wifi()
+# output in JSON and CBOR, the most frequent ones last (shortest distance).
+# Both ends must use the very same bytes: never edit it in place, add a new
+# compression name instead.
+ZDICT = (
+    b'{"ifaces": [{"method": "static", "ip": "192.168.", "mask": "255.255.255.0", "gw": "192.168.'
+    b'1.1", "dns": ["1.1.1.1", "8.8.8.8"], "device": "eth0"}, {"method": "dhcp", "ip": "10.0.0.'
+    b'", "device": "wlan0"}]}'
+    b'\xa1fifaces\x81\xa6fmethodfstaticbipdmaskm255.255.255.0bgwcdns\x82fdevicedeth0ddhcpewlan0'
+    b'caps\xa3dssiddsigndsecua?dWPA2iWPA2 WPA3iWPA1 WPA2k WPA2 802.1X'
+    b'{"ts": 17, "aps": [{"ssid": "", "sign": 5, "secu": "WPA1 WPA2"}, {"ssid": "'
+    b'", "sign": 6, "secu": "WPA2 802.1X"}, {"ssid": "", "sign": 7, "secu": "?"}, {"ssid": "'
+    b'", "sign": 8, "secu": "WPA2 WPA3"}, {"ssid": "", "sign": 7, "secu": "WPA2"}, {"ssid": "'
+)
+
+
+# ---- CBOR ----
+
+def _head(major: int, n: int, out: bytearray) -> None:
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out += struct.pack('>BB', major << 5 | 24, n)
+    elif n < 0x10000:
+        out += struct.pack('>BH', major << 5 | 25, n)
+    elif n < 0x100000000:
+        out += struct.pack('>BI', major << 5 | 26, n)
+    else:
+        out += struct.pack('>BQ', major << 5 | 27, n)
+
+
+def _cbor(obj: Any, out: bytearray) -> None:
+    if obj is None:
+        out.append(0xF6)
+    elif obj is True:
+        out.append(0xF5)
+    elif obj is False:
+        out.append(0xF4)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            _head(0, obj, out)
+        else:
+            _head(1, -1 - obj, out)
+    elif isinstance(obj, float):
+        f32 = struct.pack('>f', obj) if abs(obj) < 3.4e38 else b''
+        if f32 and struct.unpack('>f', f32)[0] == obj:
+            out += b'\xFA' + f32  # exact in single precision
+        else:
+            out += b'\xFB' + struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        b = obj.encode()
+        _head(3, len(b), out)
+        out += b
+    elif isinstance(obj, (bytes, bytearray)):
+        _head(2, len(obj), out)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _head(4, len(obj), out)
+        for v in obj:
+            _cbor(v, out)
+    elif isinstance(obj, dict):
+        _head(5, len(obj), out)
+        for k, v in obj.items():
+            _cbor(k, out)
+            _cbor(v, out)
+    else:
+        raise TypeError(f'cannot CBOR-encode {type(obj).__name__}')
+
+
+def cbor_dumps(obj: Any) -> bytes:
+    out = bytearray()
+    _cbor(obj, out)
+    return bytes(out)
+
+
+def _cbor_item(b: bytes, i: int) -> Tuple[Any, int]:
+    ib = b[i]
+    major, info = ib >> 5, ib & 0x1F
+    i += 1
+    if major == 7:
+        if info == 20:
+            return False, i
+        if info == 21:
+            return True, i
+        if info in (22, 23):
+            return None, i
+        if info == 26:
+            return struct.unpack_from('>f', b, i)[0], i + 4
+        if info == 27:
+            return struct.unpack_from('>d', b, i)[0], i + 8
+        raise ValueError(f'unsupported CBOR simple value {info}')
+    if info < 24:
+        n = info
+    elif info <= 27:
+        size = 1 << (info - 24)
+        n = int.from_bytes(b[i:i + size], 'big')
+        i += size
+    else:
+        raise ValueError('indefinite-length CBOR items are not supported')
+    if major == 0:
+        return n, i
+    if major == 1:
+        return -1 - n, i
+    if major == 2:
+        return bytes(b[i:i + n]), i + n
+    if major == 3:
+        return b[i:i + n].decode(), i + n
+    if major == 4:
+        arr = []
+        for _ in range(n):
+            v, i = _cbor_item(b, i)
+            arr.append(v)
+        return arr, i
+    if major == 5:
+        obj = {}
+        for _ in range(n):
+            k, i = _cbor_item(b, i)
+            obj[k], i = _cbor_item(b, i)
+        return obj, i
+    raise ValueError(f'unsupported CBOR major type {major}')
+
+
+def cbor_loads(data: bytes) -> Any:
+    obj, _ = _cbor_item(bytes(data), 0)
+    return obj
+
+
+# ---- packed scan ----
+
+def _secu_bits(secu: str) -> Optional[int]:
+    bits = 0
+    for tok in secu.split():
+        if tok == '?':
+            continue
+        if tok not in SECURITY_BITS:
+            return None
+        bits |= 1 << SECURITY_BITS.index(tok)
+    return bits
+
+
+def pack_scan(data: Any) -> Optional[bytes]:
+    """Packed layout of {"ts", "aps"}; None if data is not a representable scan."""
+    if not isinstance(data, dict) or set(data) != {"ts", "aps"}:
+        return None
+    ssids: Dict[str, int] = {}
+    entries: List[bytes] = []
+    for ap in data["aps"]:
+        ssid = ap.get("ssid") or ""
+        bits = _secu_bits(ap.get("secu") or "")
+        sign = ap.get("sign", 0)
+        if bits is None or not isinstance(sign, int) or not 0 <= sign <= 255:
+            return None
+        idx = ssids.setdefault(ssid, len(ssids))
+        entries.append(struct.pack('<BBB', idx, sign, bits))
+    if len(ssids) > 255 or len(entries) > 255:
+        return None
+    out = bytearray(struct.pack('<BI', PACKED_SCAN, int(data["ts"]) & 0xFFFFFFFF))
+    out.append(len(ssids))
+    for ssid in ssids:
+        b = ssid.encode()
+        if len(b) > 255:
+            return None
+        out.append(len(b))
+        out += b
+    out.append(len(entries))
+    for e in entries:
+        out += e
+    return bytes(out)
+
+
+def unpack_scan(data: bytes) -> Dict[str, Any]:
+    _, ts = struct.unpack_from('<BI', data)
+    i = 5
+    ssids: List[str] = []
+    n = data[i]
+    i += 1
+    for _ in range(n):
+        ln = data[i]
+        ssids.append(data[i + 1:i + 1 + ln].decode())
+        i += 1 + ln
+    n = data[i]
+    i += 1
+    aps = []
+    for _ in range(n):
+        idx, sign, bits = struct.unpack_from('<BBB', data, i)
+        i += 3
+        secu = ' '.join(t for k, t in enumerate(SECURITY_BITS) if bits & (1 << k))
+        aps.append({"ssid": ssids[idx], "sign": sign, "secu": secu or "?"})
+    return {"ts": ts, "aps": aps}
+
+
+# ---- compression ----
+
+def deflate(data: bytes) -> bytes:
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    return c.compress(data) + c.flush()
+
+
+def inflate(data: bytes) -> bytes:
+    d = zlib.decompressobj(-15, zdict=ZDICT)
+    return d.decompress(data) + d.flush()
+
+
+# ---- dispatch ----
+
+def encode(obj: Any, enc: str = 'json') -> bytes:
+    if enc == 'packed':
+        packed = pack_scan(obj)
+        if packed is not None:
+            return packed
+        enc = 'cbor'
+    if enc == 'cbor':
+        return cbor_dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def decode(data: bytes) -> Any:
+    """Decode a value of any encoding, telling them apart by the first byte."""
+    if not data:
+        raise ValueError('empty value')
+    if data[0] == PACKED_SCAN:
+        return unpack_scan(data)
+    if data[0] in b'{["' or data[0] in b' \t\r\n':
+        return json.loads(data.decode())
+    return cbor_loads(data)
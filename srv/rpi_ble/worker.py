@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Background executor for slow work (nmcli, ping, curl) bridged to the GLib loop.
+
+GATT callbacks run on the single GLib main loop, so anything that can take
+seconds is submitted here instead. The job runs on a worker thread and its
+completion callback is marshalled back to the main loop via GLib.idle_add,
+where it is safe to touch characteristics and shared state.
+"""
+from __future__ import annotations
+
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from gi.repository import GLib
+
+MAX_WORKERS = 4
+
+_executor: Optional[ThreadPoolExecutor] = None
+_inflight: Dict[str, Future] = {}
+_lock = threading.Lock()
+
+# on_done(result, error) — error is None on success
+DoneCallback = Callable[[Any, Optional[BaseException]], None]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='netcfg-worker')
+    return _executor
+
+
+def call_in_main(fn: Callable[..., Any], *args: Any) -> None:
+    """Schedule fn(*args) once on the GLib main loop."""
+    def _once() -> bool:
+        try:
+            fn(*args)
+        except Exception:
+            traceback.print_exc()
+        return False
+    GLib.idle_add(_once)
+
+
+def busy(key: str) -> bool:
+    with _lock:
+        fut = _inflight.get(key)
+        return fut is not None and not fut.done()
+
+
+def submit(fn: Callable[..., Any], *args: Any,
+           on_done: Optional[DoneCallback] = None,
+           key: Optional[str] = None) -> Optional[Future]:
+    """Run fn(*args) on a worker thread and deliver on_done on the main loop.
+
+    With `key`, at most one job per key runs at a time: a second submit while
+    the first is still running returns None and is dropped.
+    """
+    with _lock:
+        if key is not None:
+            fut = _inflight.get(key)
+            if fut is not None and not fut.done():
+                return None
+        fut = _get_executor().submit(fn, *args)
+        if key is not None:
+            _inflight[key] = fut
+
+    def _finished(f: Future) -> None:
+        if key is not None:
+            with _lock:
+                if _inflight.get(key) is f:
+                    del _inflight[key]
+        err = f.exception()
+        if err is not None:
+            traceback.print_exception(type(err), err, err.__traceback__)
+        if on_done is not None:
+            call_in_main(on_done, None if err else f.result(), err)
+
+    fut.add_done_callback(_finished)
+    return fut
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None